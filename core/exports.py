@@ -0,0 +1,202 @@
+"""
+streaming exports of products, categories, orders and order lines, as CSV or NDJSON (optionally gzipped)
+
+rows are read with QuerySet.iterator(chunk_size=...): on PostgreSQL a server-side cursor, so only
+one chunk of rows is in memory at a time. rows are encoded and compressed as they are read, so an export
+takes the same memory whether it has 1k or 10M rows.
+
+used by ExportView (core/views.py) and the export_data management command.
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from orders.models import Order, OrderItem
+from products.models import Product, Category
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 2000
+# encoded rows are buffered up to this size before being compressed / sent
+BUFFER_SIZE = 64 * 1024
+
+
+class ExportFilters:
+    def __init__(self, date_from=None, date_to=None, category_id=None, paid=None):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.category_id = category_id
+        self.paid = paid
+
+    @classmethod
+    def from_query(cls, query):
+        """
+        :param query: request.GET or a dict of command options.
+            parameters: date_from, date_to (YYYY-MM-DD, inclusive), category (id), paid (true / false)
+        :raises ValueError: a parameter is invalid (an export is never silently unfiltered)
+        """
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            value = query.get(name) or None
+            if value is not None:
+                try:
+                    dates[name] = parse_date(value)
+                except ValueError:
+                    dates[name] = None
+                if dates[name] is None:
+                    raise ValueError(f"{name} must be a date (YYYY-MM-DD), got '{value}'")
+        category = str(query.get('category') or '')
+        if category and not category.isdigit():
+            raise ValueError(f"category must be an id, got '{category}'")
+        paid = str(query.get('paid') or '').lower()
+        if paid not in ('', 'true', 'false'):
+            raise ValueError(f"paid must be true or false, got '{paid}'")
+        return cls(
+            date_from=dates.get('date_from'),
+            date_to=dates.get('date_to'),
+            category_id=int(category) if category else None,
+            paid={'true': True, 'false': False}.get(paid),
+        )
+
+    @staticmethod
+    def _start_of_day(date):
+        value = datetime.datetime.combine(date, datetime.time.min)
+        return timezone.make_aware(value) if settings.USE_TZ else value
+
+    def apply(self, queryset, created_at=None, category=None, paid=None):
+        """
+        :param created_at, category, paid: lookups of the filtered fields in queryset's model.
+            None if the model can't be filtered by it (the filter is ignored)
+        :return: filtered queryset
+        """
+        filters = {}
+        if created_at:
+            # compare with the bounds of the days, so an index of created_at is used
+            if self.date_from:
+                filters[f'{created_at}__gte'] = self._start_of_day(self.date_from)
+            if self.date_to:
+                filters[f'{created_at}__lt'] = self._start_of_day(self.date_to + datetime.timedelta(days=1))
+        if category and self.category_id is not None:
+            filters[category] = self.category_id
+        if paid and self.paid is not None:
+            filters[paid] = self.paid
+        return queryset.filter(**filters)
+
+
+class Dataset:
+    """
+    an exported table: its columns (header -> lookup) and the filters it supports
+    """
+    def __init__(self, model, columns, created_at=None, category=None, paid=None):
+        self.model = model
+        self.columns = columns
+        self.filter_lookups = {'created_at': created_at, 'category': category, 'paid': paid}
+
+    def rows(self, filters, chunk_size=CHUNK_SIZE):
+        """
+        :return: iterator of tuples of values, in the order of columns, ordered by id
+        """
+        queryset = filters.apply(self.model.objects.all(), **self.filter_lookups)
+        return queryset.order_by('pk').values_list(*self.columns.values()).iterator(chunk_size=chunk_size)
+
+
+DATASETS = {
+    'products': Dataset(Product, {
+        'id': 'id', 'name': 'name', 'description': 'description', 'price': 'price', 'stock': 'stock',
+        'category_id': 'category_id', 'category': 'category__name',
+    }, category='category_id'),
+    'categories': Dataset(Category, {
+        'id': 'id', 'name': 'name', 'description': 'description',
+    }),
+    'orders': Dataset(Order, {
+        'id': 'id', 'user_id': 'user_id', 'username': 'user__username', 'created_at': 'created_at',
+        'updated_at': 'updated_at', 'is_paid': 'is_paid', 'total_amount': 'total_amount',
+        'item_count': 'item_count', 'line_count': 'line_count',
+    }, created_at='created_at', paid='is_paid'),
+    'order_items': Dataset(OrderItem, {
+        'id': 'id', 'order_id': 'order_id', 'order_created_at': 'order__created_at', 'is_paid': 'order__is_paid',
+        'product_id': 'product_id', 'product': 'product__name', 'category_id': 'product__category_id',
+        'quantity': 'quantity', 'price': 'price',
+    }, created_at='order__created_at', category='product__category_id', paid='order__is_paid'),
+}
+
+
+def _to_text(value):
+    """
+    :return: value as written to CSV / JSON. Money as '12.34', datetimes in ISO 8601
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    return str(value)
+
+
+def _csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_to_text(value) for value in row])
+        # hand over what was written so far, and reuse the buffer
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, (_to_text(value) for value in row)))) + '\n'
+
+
+def _buffered(lines, size=BUFFER_SIZE):
+    """
+    join small strings into chunks of about size bytes, encoded as utf-8
+    """
+    parts, length = [], 0
+    for line in lines:
+        parts.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(parts).encode()
+            parts, length = [], 0
+    if parts:
+        yield ''.join(parts).encode()
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export(dataset, file_format, filters=None, compress=False, chunk_size=CHUNK_SIZE):
+    """
+    :param dataset: key of DATASETS
+    :param file_format: key of FORMATS
+    :param filters: ExportFilters. None for all rows
+    :param compress: gzip the output
+    :param chunk_size: number of rows fetched from db at a time
+    :return: iterator of bytes, to be written out as they come (StreamingHttpResponse, a file)
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset '{dataset}'")
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format '{file_format}'")
+    columns = list(DATASETS[dataset].columns)
+    rows = DATASETS[dataset].rows(filters or ExportFilters(), chunk_size=chunk_size)
+    lines = _csv_lines(columns, rows) if file_format == 'csv' else _ndjson_lines(columns, rows)
+    chunks = _buffered(lines)
+    return _gzipped(chunks) if compress else chunks
@@ -0,0 +1,102 @@
+"""
+request-scoped identity map
+
+within a request (see IdentityMapMiddleware), the manager getters (get_order, get_order_item, get_product,
+get_category) load a row once: repeated lookups of the same key return the same instance, with no query.
+
+the map is kept coherent with writes:
+    save() / delete() of any model: the row's entries are dropped (unless it's the mapped instance itself),
+        by signals (see core/signals.py)
+    queryset.update() / bulk writes in managers: the managers call forget() for the rows they change
+
+outside of a request (management commands, shell, tests) there's no active map, and getters always query.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import logging
+
+logger = logging.getLogger('django')
+
+_current_map = ContextVar('identity_map', default=None)
+
+
+class IdentityMap:
+    def __init__(self):
+        self._instances = {}  # (model's label, field, value) -> instance
+
+    @staticmethod
+    def _key(model, field, value):
+        return model._meta.label, field, value
+
+    def get(self, model, field, value):
+        return self._instances.get(self._key(model, field, value))
+
+    def add(self, instance, field, value):
+        self._instances[self._key(type(instance), field, value)] = instance
+
+    def discard(self, model, pks=None, keep=None):
+        """
+        drop instances of model
+        :param pks: primary keys of instances to drop. None to drop all instances of model
+        :param keep: instance not to drop (it's current)
+        """
+        label = model._meta.label
+        stale_keys = [key for key, instance in self._instances.items()
+                      if key[0] == label and instance is not keep and (pks is None or instance.pk in pks)]
+        for key in stale_keys:
+            del self._instances[key]
+
+    def __len__(self):
+        return len(self._instances)
+
+
+def get_identity_map():
+    """
+    :return: IdentityMap of current request, None if there's none
+    """
+    return _current_map.get()
+
+
+@contextmanager
+def identity_map_scope():
+    """
+    activate a new identity map, until the block ends
+    """
+    token = _current_map.set(IdentityMap())
+    try:
+        yield _current_map.get()
+    finally:
+        _current_map.reset(token)
+
+
+def lookup(model, field, value, load):
+    """
+    :param model: model class
+    :param field: name of a unique field (or 'pk')
+    :param value: value of field
+    :param load: function loading the instance from db (called only if it's not mapped)
+    :return: mapped instance, or the loaded one
+    """
+    identity_map = get_identity_map()
+    if identity_map is None:
+        return load()
+    instance = identity_map.get(model, field, value)
+    if instance is None:
+        instance = load()
+        identity_map.add(instance, field, value)
+    else:
+        logger.debug(f"identity map hit: {model._meta.label} {field}={value}")
+    return instance
+
+
+def forget(model, pks=None, keep=None):
+    """
+    drop stale instances from the current identity map (if any)
+    :param model: model class
+    :param pks: primary keys of changed rows. None if any row may have changed
+    :param keep: instance not to drop (it was updated in memory as well)
+    """
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        identity_map.discard(model, pks=None if pks is None else set(pks), keep=keep)
@@ -0,0 +1,190 @@
+"""
+invalidation bus: change events of cached models, sent to every process (gunicorn workers, other nodes,
+management commands), so each one drops what it cached in memory
+
+    publish(model_label, pks): called where a change is made (signals, bulk writes). a change of the whole table
+        (or of too many rows to list) is published with pks=None
+    subscribe(model_label, handler): handler(pks) evicts this process's entries (see products/signals.py,
+        users/signals.py)
+
+events are sent only when the transaction commits. a process doesn't receive its own events: the change was
+applied to its caches when it was made.
+
+buses:
+    PostgreSQL: NOTIFY on the INVALIDATION_CHANNEL channel. each process listens on a background thread, started
+        by its first request, over a connection of its own. after the connection is lost, events may have been
+        missed: every handler is called with pks=None
+    any other database (SQLite, tests): in-process stand-in, events reach the listeners of this process only
+"""
+import json
+import os
+import select
+import threading
+import time
+import uuid
+
+from django.db import connection, transaction
+
+import logging
+
+logger = logging.getLogger('django')
+
+INVALIDATION_CHANNEL = 'cache_invalidation'
+# NOTIFY payloads are limited to 8000 bytes: events of more rows invalidate the whole table
+MAX_PKS = 500
+# seconds: wait for events before checking the connection, wait before reconnecting
+POLL_TIMEOUT = 5
+RECONNECT_DELAY = 1
+
+_origin = None
+_origin_pid = None
+
+_handlers = {}  # model label -> list of handler(pks)
+
+
+def subscribe(model_label, handler):
+    """
+    :param model_label: 'app_label.ModelName'
+    :param handler: function(pks) evicting entries of these rows from this process. pks is None for all rows
+    """
+    _handlers.setdefault(model_label, []).append(handler)
+
+
+def get_origin():
+    """
+    :return: id of this process: its own events are ignored. a forked worker (e.g. gunicorn --preload) gets
+        an id of its own, not its parent's
+    """
+    global _origin, _origin_pid
+    if _origin_pid != os.getpid():
+        _origin, _origin_pid = uuid.uuid4().hex, os.getpid()
+    return _origin
+
+
+def encode(model_label, pks=None, origin=None):
+    if origin is None:
+        origin = get_origin()
+    if pks is not None:
+        pks = sorted(pks)
+        if len(pks) > MAX_PKS:
+            pks = None
+    return json.dumps({'model': model_label, 'pks': pks, 'origin': origin})
+
+
+def publish(model_label, pks=None):
+    """
+    send a change event to the other processes, once the current transaction commits
+    :param model_label: 'app_label.ModelName'
+    :param pks: primary keys of changed rows, None for all rows
+    """
+    get_bus().publish(encode(model_label, pks))
+
+
+def receive(message):
+    """
+    call the handlers of an event, unless it came from this process
+    :param message: event, as encoded by encode()
+    """
+    event = json.loads(message)
+    if event['origin'] == get_origin():
+        return
+    for handler in _handlers.get(event['model'], ()):
+        try:
+            handler(event['pks'])
+        except Exception:
+            logger.exception(f"invalidation handler of {event['model']} failed")
+    logger.debug(f"invalidated {event['model']} {event['pks'] if event['pks'] is not None else '(all)'}")
+
+
+def receive_all():
+    """
+    call every handler with pks=None: after events may have been missed
+    """
+    for model_label, handlers in _handlers.items():
+        for handler in handlers:
+            try:
+                handler(None)
+            except Exception:
+                logger.exception(f"invalidation handler of {model_label} failed")
+
+
+class LocalBus:
+    """
+    in-process stand-in: delivers events to the listeners of this process, after commit
+    """
+    def __init__(self):
+        self._listeners = []
+
+    def publish(self, message):
+        transaction.on_commit(lambda: self.deliver(message))
+
+    def deliver(self, message):
+        for listener in list(self._listeners):
+            listener(message)
+
+    def listen(self, callback):
+        self._listeners.append(callback)
+
+
+class PostgresBus:
+    """
+    NOTIFY / LISTEN. a NOTIFY is part of the transaction: it's sent on commit, and dropped on rollback
+    """
+    def publish(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [INVALIDATION_CHANNEL, message])
+
+    def listen(self, callback):
+        threading.Thread(target=self._run, args=(callback,), name='invalidation-listener', daemon=True).start()
+
+    def _run(self, callback):
+        # connections are per thread: this thread has a connection of its own
+        while True:
+            try:
+                self._listen(callback)
+            except Exception:
+                logger.exception(f"lost connection listening on {INVALIDATION_CHANNEL}, reconnecting")
+            finally:
+                connection.close()
+            time.sleep(RECONNECT_DELAY)
+
+    def _listen(self, callback):
+        connection.ensure_connection()
+        raw_connection = connection.connection
+        with raw_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+        logger.info(f"listening on {INVALIDATION_CHANNEL}")
+        # events sent while not listening are lost
+        receive_all()
+        while True:
+            if select.select([raw_connection], [], [], POLL_TIMEOUT) == ([], [], []):
+                continue
+            raw_connection.poll()
+            while raw_connection.notifies:
+                callback(raw_connection.notifies.pop(0).payload)
+
+
+_bus = None
+_listening_pid = None
+_listening_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus
+    if _bus is None:
+        _bus = PostgresBus() if connection.vendor == 'postgresql' else LocalBus()
+    return _bus
+
+
+def start_listening():
+    """
+    listen for events of the other processes. once per process (a forked worker listens on its own)
+    """
+    global _listening_pid
+    if _listening_pid == os.getpid():
+        return
+    with _listening_lock:
+        if _listening_pid == os.getpid():
+            return
+        get_bus().listen(receive)
+        _listening_pid = os.getpid()
@@ -1,15 +1,18 @@
+import base64
+import binascii
+import json
+
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
+from django.core.exceptions import PermissionDenied, ObjectDoesNotExist, ValidationError
 import logging
-from django.db.models import QuerySet
+from django.db.models import QuerySet, Q
 from django.http import HttpResponseForbidden, Http404
 from django.template.context_processors import request
 from django.views import View
 from django.views.generic import CreateView
 from django.views.generic.detail import SingleObjectMixin
 
-from ecommerce.constants import EXCEPTION_LOG_LEVELS
-from orders.models import Order
+from users.groups import is_in_any_group
 
 logger = logging.getLogger('django')
 
@@ -26,48 +29,32 @@ class SafeGetObjectMixin:
 
 
 class OwnershipRequiredMixin:
+    """
+    mixin for single object views: users of enforce_for_groups can access only objects they own.
+
+    ownership is enforced by scoping the view's queryset to the request's user, so a single query
+    both authorizes and loads the object. an object of another user is not found (404).
+    """
     # ownership check only for this groups
     enforce_for_groups = ['customers']
+    # lookup from model to the user owning it (e.g. 'order__user' for an order's items)
+    owner_field = 'user'
 
     def is_in_enforce_group(self, request):
-        return any(group.name in self.enforce_for_groups for group in request.user.groups.all())
+        return is_in_any_group(request.user, self.enforce_for_groups)
 
-    def get_object_owner(self, **kwargs):
-        try:
-            if hasattr(self.model, 'objects'):
-                if hasattr(self.model.objects, 'get_owner_user'):
-                    # special case, use helper method in manager
-                    logger.debug(f"trying to fetch owner using get_owner_user() in model {self.model}"
-                                 f"with pk= {kwargs.get('pk')}")
-                    return self.model.objects.get_owner_user(kwargs.get('pk'))
-
-                # default - return user field
-                logger.debug(f"trying to fetch owner using default get_object().user")
-                obj = self.get_object()
-                return obj.user
-
-        except Exception as e:
-            log_level = EXCEPTION_LOG_LEVELS.get(type(e), logging.ERROR)
-            logger.log(log_level, f"Error retrieving owner: {str(e)}", exc_info=True)
-            return None
-
-    def dispatch(self, request, *args, **kwargs):
-        if self.is_in_enforce_group(request):
-            try:
-                request_user = request.user
-                object_owner = self.get_object_owner(pk=self.kwargs.get('pk'))
-                if request_user != object_owner:
-                    logger.error(f"Permission denied: request_user {request_user} is not the same as object_owner {object_owner}")
-                    raise Http404
-            except Http404 as e:
-                logger.warning(f"Ownership enforcement triggered Http404: {str(e)}")
-                raise
-            except Exception as e:
-                log_level = EXCEPTION_LOG_LEVELS.get(type(e), logging.ERROR)
-                logger.log(log_level, f"Unexpected error in ownership check: {str(e)}", exc_info=True)
-                raise Http404("Ownership validation failed.")
-
-        return super().dispatch(request, *args, **kwargs)
+    def scope_to_owner(self, queryset, owner_field=None):
+        """
+        :param queryset: QuerySet to scope
+        :param owner_field: lookup to the owning user. default: owner_field of the view
+        :return: queryset, limited to objects of request's user if ownership is enforced for them
+        """
+        if self.is_in_enforce_group(self.request):
+            return queryset.filter(**{owner_field or self.owner_field: self.request.user})
+        return queryset
+
+    def get_queryset(self):
+        return self.scope_to_owner(super().get_queryset())
 
 
 class GroupRequiredMixin(UserPassesTestMixin):
@@ -78,9 +65,7 @@ class GroupRequiredMixin(UserPassesTestMixin):
     allowed_groups = []
 
     def test_func(self):
-        user = self.request.user
-        user_groups = user.groups.values_list('name', flat=True)
-        if not any(group in self.allowed_groups for group in user_groups):
+        if not is_in_any_group(self.request.user, self.allowed_groups):
             # user is not a member of any allowed group
             return False
 
@@ -90,3 +75,109 @@ class GroupRequiredMixin(UserPassesTestMixin):
         # Optionally handle unauthorized access
         logger.error("You do not have permission to access this view.")
         return HttpResponseForbidden("You do not have permission to access this page.")
+
+
+class KeysetPaginationMixin:
+    """
+    mixin for ListView: cursor (keyset) pagination.
+
+    instead of OFFSET, a page continues from the sort key of the last row of the previous page:
+        WHERE (a, id) > (last_a, last_id) ORDER BY a, id LIMIT page_size
+    so fetching a page costs the same, no matter how deep into the table it is.
+
+    next / previous pages are linked with an opaque cursor in the query string.
+    other query string parameters (filters) are kept in the links.
+    """
+    # override with ordering. prefix a field with '-' for descending order.
+    # fields must not be nullable, and last field must be unique (usually 'id'), to keep the ordering stable
+    keyset_ordering = ('id',)
+    page_size = 50
+    cursor_param = 'cursor'
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    @staticmethod
+    def _reverse_ordering(ordering):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+    @staticmethod
+    def _keyset_filter(ordering, values):
+        """
+        :return: Q object selecting the rows that come after values, in ordering
+            (a > x) OR (a = x AND b > y) OR ...
+        """
+        condition = Q()
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal_prefix = {ordering[j].lstrip('-'): values[j] for j in range(i)}
+            condition |= Q(**equal_prefix, **{f'{name}__{lookup}': values[i]})
+        return condition
+
+    def _encode_cursor(self, direction, obj, ordering):
+        values = [getattr(obj, self.model._meta.get_field(field.lstrip('-')).attname) for field in ordering]
+        # default=str keeps full precision of datetimes and decimals (parsed back by the field's to_python)
+        raw = json.dumps([direction, list(ordering), values], default=str)
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def _decode_cursor(self, cursor, ordering):
+        """
+        :return: (direction, values), where direction is 'next' or 'prev'
+        :raises ValueError: cursor is malformed
+        """
+        try:
+            direction, cursor_ordering, raw_values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            # a cursor is valid only for the ordering it was created for
+            if direction not in ('next', 'prev') or tuple(cursor_ordering) != tuple(ordering):
+                raise ValueError(f"Invalid cursor {cursor}")
+            values = [self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                      for field, value in zip(ordering, raw_values)]
+            return direction, values
+        except (TypeError, ValueError, binascii.Error, ValidationError) as e:
+            raise ValueError(f"Invalid cursor {cursor}") from e
+
+    def _page_url(self, cursor):
+        query = self.request.GET.copy()
+        query[self.cursor_param] = cursor
+        return f'?{query.urlencode()}'
+
+    def paginate_keyset(self, queryset):
+        """
+        :return: (list of objects in page, url of next page or None, url of previous page or None)
+        """
+        ordering = tuple(self.get_keyset_ordering())
+        direction, values = 'next', None
+        cursor = self.request.GET.get(self.cursor_param)
+        if cursor:
+            try:
+                direction, values = self._decode_cursor(cursor, ordering)
+            except ValueError as e:
+                logger.warning(f"{str(e)}, showing first page")
+
+        query_ordering = ordering if direction == 'next' else self._reverse_ordering(ordering)
+        queryset = queryset.order_by(*query_ordering)
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(query_ordering, values))
+
+        # one extra row tells if there's another page in this direction
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if direction == 'next':
+            has_next, has_previous = has_more, values is not None
+        else:
+            page.reverse()
+            has_next, has_previous = True, has_more
+
+        next_url = self._page_url(self._encode_cursor('next', page[-1], ordering)) if page and has_next else None
+        previous_url = self._page_url(self._encode_cursor('prev', page[0], ordering)) if page and has_previous else None
+        return page, next_url, previous_url
+
+    def get_context_data(self, **kwargs):
+        queryset = kwargs.pop('object_list', self.object_list)
+        page, next_url, previous_url = self.paginate_keyset(queryset)
+        context = super().get_context_data(object_list=page, **kwargs)
+        context['next_page_url'] = next_url
+        context['previous_page_url'] = previous_url
+        return context
@@ -0,0 +1,118 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction, router
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+class DirtyFieldsMixin:
+    """
+    model mixin: track which fields changed since the instance was loaded (or last saved).
+
+    save() of an existing row writes only the changed fields (UPDATE ... SET changed fields),
+    and skips the write entirely when nothing changed.
+    clean_changed_fields() validates only the changed fields.
+
+    a new instance (not saved yet) is saved and validated as a whole.
+
+    invariants (uniqueness, check constraints) are enforced by the database as well, and a violation
+    (IntegrityError) is raised as a ValidationError. so trusted internal writes can skip python-side validation
+    (see validate_for_save).
+    """
+    # fields never written by save() of an existing row (maintained by other means, e.g. F() updates)
+    untracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_saved_state()
+        return instance
+
+    def _remember_saved_state(self, field_names=None):
+        """
+        remember the current values as the values stored in db
+        :param field_names: names of the fields that were saved. None for all loaded fields
+        """
+        saved_state = getattr(self, '_saved_state', None) or {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (field_names is None or field.name in field_names):
+                saved_state[field.attname] = self.__dict__[field.attname]
+        self._saved_state = saved_state
+
+    def get_saved_value(self, field_name, default=None):
+        """
+        :return: value of field as it was loaded from db (or last saved). default if unknown
+        """
+        return getattr(self, '_saved_state', {}).get(self._meta.get_field(field_name).attname, default)
+
+    def get_dirty_fields(self):
+        """
+        :return: list of names of fields changed since loaded from db. None for a new instance (all fields)
+        """
+        if self._state.adding:
+            return None
+        saved_state = getattr(self, '_saved_state', {})
+        missing = object()
+        return [field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.untracked_fields
+                and field.attname in self.__dict__
+                and saved_state.get(field.attname, missing) != self.__dict__[field.attname]]
+
+    def clean_changed_fields(self):
+        """
+        full_clean() of the fields that changed. so an unchanged unique field costs no uniqueness query.
+        check constraints are not evaluated here (a query each), but by the database when saving:
+        field validators already cover them with friendlier messages
+        """
+        dirty_fields = self.get_dirty_fields()
+        exclude = None if dirty_fields is None else [field.name for field in self._meta.concrete_fields
+                                                     if field.name not in dirty_fields]
+        self.full_clean(exclude=exclude, validate_constraints=False)
+
+    def validate_for_save(self, save_kwargs):
+        """
+        validate before save, unless the caller passed save(trusted=True):
+        internal code whose values are known to be valid (computed, or already validated) skips python-side
+        validation (including a query per foreign key). database constraints still apply.
+        :param save_kwargs: kwargs of save(). 'trusted' is removed from it
+        """
+        if not save_kwargs.pop('trusted', False):
+            self.clean_changed_fields()
+
+    def saved_in_transaction(self):
+        """
+        called by save() once the row is written, in the same atomic block: for writes that must be atomic
+        with the row's (e.g. denormalized totals), without a transaction of their own
+        """
+
+    def _integrity_error_to_validation_error(self, error):
+        message = str(error)
+        for constraint in self._meta.constraints:
+            if constraint.name in message:
+                return ValidationError(constraint.get_violation_error_message(), code='constraint')
+        if 'unique' in message.lower():
+            for field in self._meta.concrete_fields:
+                if field.unique and not field.primary_key and field.column in message:
+                    return ValidationError({field.name: [self.unique_error_message(type(self), (field.name,))]})
+        return ValidationError(message)
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None and not kwargs.get('force_insert') and not self._state.adding:
+            dirty_fields = self.get_dirty_fields()
+            if not dirty_fields:
+                logger.debug(f"nothing changed in {self._meta.label} #{self.pk}, not saved")
+                return
+            # auto_now fields are set on every save, and are written only if listed
+            auto_now_fields = [field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+            kwargs['update_fields'] = set(dirty_fields) | set(auto_now_fields)
+
+        try:
+            # a single atomic block, shared with saved_in_transaction(). a savepoint only inside a transaction:
+            # after a violation, the surrounding transaction is still usable (PostgreSQL aborts it)
+            with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+                super().save(*args, **kwargs)
+                self.saved_in_transaction()
+        except IntegrityError as e:
+            raise self._integrity_error_to_validation_error(e) from e
+        self._remember_saved_state(kwargs.get('update_fields'))
@@ -0,0 +1,143 @@
+"""
+money as integer minor units (cents)
+
+Money holds an int number of cents, so arithmetic (line totals, order totals, aggregates) is integer math.
+it's shown with two decimal places ("12.34"), so templates, forms and admin look as with a DecimalField.
+
+MoneyField stores Money in a BIGINT column (cents). lookups accept Money, or a number of currency units:
+    Product.objects.filter(price__lt=25)  ->  WHERE price < 2500
+"""
+import decimal
+from functools import total_ordering
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+CENTS = 100
+_CENT = decimal.Decimal('0.01')
+
+
+@total_ordering
+class Money:
+    __slots__ = ('cents',)
+
+    def __init__(self, cents=0):
+        if not isinstance(cents, int) or isinstance(cents, bool):
+            raise TypeError(f"Money is created from an int number of cents, got {cents!r}. use Money.coerce()")
+        self.cents = cents
+
+    @classmethod
+    def coerce(cls, value):
+        """
+        :param value: Money, or an amount in currency units (Decimal, int, float or str, e.g. '12.34')
+            more than two decimal places are truncated (rounded down), as prices always were
+        :return: Money
+        :raises ValidationError: value is not a number
+        """
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return cls(value * CENTS)
+        try:
+            amount = decimal.Decimal(str(value) if isinstance(value, float) else value)
+            return cls(int(amount.quantize(_CENT, rounding=decimal.ROUND_DOWN) * CENTS))
+        except (decimal.InvalidOperation, TypeError, ValueError):
+            raise ValidationError(f"'{value}' value must be an amount of money.", code='invalid')
+
+    def to_decimal(self):
+        return decimal.Decimal(self.cents).scaleb(-2)
+
+    def __str__(self):
+        sign = '-' if self.cents < 0 else ''
+        units, cents = divmod(abs(self.cents), CENTS)
+        return f'{sign}{units}.{cents:02d}'
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+    def __format__(self, format_spec):
+        return format(self.to_decimal(), format_spec) if format_spec else str(self)
+
+    def __hash__(self):
+        # equal to the Decimal of the same amount
+        return hash(self.to_decimal())
+
+    def __eq__(self, other):
+        try:
+            return self.cents == Money.coerce(other).cents
+        except ValidationError:
+            return NotImplemented
+
+    def __lt__(self, other):
+        try:
+            return self.cents < Money.coerce(other).cents
+        except ValidationError:
+            return NotImplemented
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+    def __add__(self, other):
+        return Money(self.cents + Money.coerce(other).cents)
+
+    __radd__ = __add__  # so sum() works
+
+    def __sub__(self, other):
+        return Money(self.cents - Money.coerce(other).cents)
+
+    def __rsub__(self, other):
+        return Money(Money.coerce(other).cents - self.cents)
+
+    def __mul__(self, quantity):
+        if not isinstance(quantity, int) or isinstance(quantity, bool):
+            return NotImplemented
+        return Money(self.cents * quantity)
+
+    __rmul__ = __mul__
+
+
+class MoneyAttribute(DeferredAttribute):
+    """
+    any value assigned to a MoneyField (for example a Decimal from a form) is kept as Money
+    """
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = self.field.to_python(value)
+
+
+class MoneyField(models.BigIntegerField):
+    description = "Amount of money, in cents"
+    descriptor_class = MoneyAttribute
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else Money(int(value))
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Money):
+            return value
+        return Money.coerce(value)
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)  # resolves lazy values, without IntegerField's int()
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return Money.coerce(value).cents
+
+    def formfield(self, **kwargs):
+        # skip IntegerField's form field (and its int range), a decimal input with 2 places is shown instead
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField,
+            'decimal_places': 2,
+            **kwargs,
+        })
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        return None if value is None else str(value)
@@ -0,0 +1,244 @@
+"""
+read-through object cache, in two levels:
+    L1: per-process LRU, for settings.OBJECT_CACHE_L1_TIMEOUT seconds (default 30). a hit costs microseconds
+    L2: the shared Django cache ('default'), for settings.OBJECT_CACHE_TIMEOUT seconds (default 300)
+
+rows are cached by primary key, and by a natural (unique) key pointing to the primary key.
+a row is cached as its field values, and every lookup builds a new instance (Model.from_db), so callers never
+share (and mutate) a cached instance. volatile fields (e.g. a product's stock, changed by every checkout) are not
+cached: they are deferred, and read from db when accessed, so they are never stale.
+
+invalidation:
+    save() / delete(): by signals (see products/signals.py), right away and again after commit
+    bulk writes (queryset.update(), bulk_create) of cached fields: invalidate_all()
+entries are stored only after the transaction that read them commits, so rolled back data is never cached.
+other processes drop their entries by the invalidation bus (see core/invalidation.py).
+
+a miss is loaded by a single worker at a time (per row, per process unless the L2 cache is on redis or
+memcached, see core/single_flight.py), so a popular row expiring doesn't send every concurrent request to db.
+
+the request-scoped identity map (core/identity_map.py) sits in front of this cache.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, router
+
+from core import single_flight
+
+import logging
+
+logger = logging.getLogger('django')
+
+# seconds: lock of a row being loaded (a row is loaded in milliseconds, the lock is released after commit)
+LOCK_TIMEOUT = 5
+
+
+class LRUCache:
+    """
+    thread-safe, size bounded, in-memory cache. least recently used entries are evicted first
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ObjectCache:
+    def __init__(self, model_label, natural_key='name', volatile_fields=()):
+        """
+        :param model_label: 'app_label.ModelName' (resolved lazily, so managers can use it)
+        :param natural_key: name of a unique field rows are looked up by
+        :param volatile_fields: names of fields not cached (read from db when accessed)
+        """
+        self.model_label = model_label
+        self.natural_key = natural_key
+        self.volatile_fields = volatile_fields
+        self.l1 = LRUCache(getattr(settings, 'OBJECT_CACHE_L1_SIZE', 1000))
+        self._lock = threading.Lock()
+        self._counters = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
+        # number of invalidations so far: a row read before an invalidation is not stored after it
+        self._generation = 0
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    @property
+    def l1_timeout(self):
+        return getattr(settings, 'OBJECT_CACHE_L1_TIMEOUT', 30)
+
+    @property
+    def l2_timeout(self):
+        return getattr(settings, 'OBJECT_CACHE_TIMEOUT', 300)
+
+    def _cached_fields(self):
+        return [field for field in self.model._meta.concrete_fields if field.name not in self.volatile_fields]
+
+    def _version(self):
+        """
+        version of all entries, bumped by invalidate_all. kept in L1 as well, so an L1 hit costs no L2 access
+        """
+        key = f'objects:{self.model_label}:version'
+        version = self.l1.get(key)
+        if version is None:
+            version = cache.get(key)
+            if version is None:
+                # a fresh, never used version: entries from before the version was lost can't come back
+                version = time.time_ns()
+                cache.add(key, version, timeout=None)
+                version = cache.get(key, version)
+            self.l1.set(key, version, self.l1_timeout)
+        return version
+
+    def _key(self, field, value, version=None):
+        if field != 'pk':
+            # any value is a valid key, on any cache backend
+            value = hashlib.md5(str(value).encode()).hexdigest()
+        return f'objects:{self.model_label}:{self._version() if version is None else version}:{field}:{value}'
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _read(self, key):
+        value = self.l1.get(key)
+        if value is not None:
+            return value, 'l1_hits'
+        value = cache.get(key)
+        if value is not None:
+            self.l1.set(key, value, self.l1_timeout)
+            return value, 'l2_hits'
+        return None, 'misses'
+
+    def _write(self, entries, generation):
+        if generation != self._generation:
+            logger.debug(f"{self.model_label} was invalidated while loading, not cached")
+            return
+        for key, value in entries.items():
+            self.l1.set(key, value, self.l1_timeout)
+        cache.set_many(entries, timeout=self.l2_timeout)
+
+    def _build(self, values):
+        fields = self._cached_fields()
+        return self.model.from_db(router.db_for_read(self.model), [field.attname for field in fields], values)
+
+    def _lookup(self, field, value, version):
+        values, level = self._read(self._key(field, value, version))
+        if values is not None and field != 'pk':
+            # natural key -> primary key -> row. a row renamed since is a miss
+            values, level = self._read(self._key('pk', values, version))
+            natural_key_index = [field.name for field in self._cached_fields()].index(self.natural_key)
+            if values is not None and values[natural_key_index] != value:
+                values, level = None, 'misses'
+        return values, level
+
+    def get(self, field, value, load):
+        """
+        on a miss, a single worker loads the row (see core/single_flight.py). the others wait for it shortly
+        (settings.OBJECT_CACHE_WAIT_TIMEOUT, default 0.1 seconds), then load it themselves
+        :param field: 'pk' or the natural key
+        :param value: value of field
+        :param load: function loading the instance from db (called only on a miss)
+        :return: instance of model. a new one on every call
+        :raises Model.DoesNotExist: raised by load
+        """
+        version = self._version()
+        values, level = self._lookup(field, value, version)
+        key = self._key(field, value, version)
+        locked = values is None and single_flight.acquire(key, cache, timeout=LOCK_TIMEOUT)
+        if values is None and not locked:
+            single_flight.wait_for(key, cache, timeout=getattr(settings, 'OBJECT_CACHE_WAIT_TIMEOUT', 0.1))
+            values, level = self._lookup(field, value, version)
+        self._count(level)
+        if values is not None:
+            return self._build(values)
+
+        generation = self._generation
+        try:
+            instance = load()
+        except Exception:
+            if locked:
+                single_flight.release(key, cache)
+            raise
+        values = tuple(getattr(instance, field.attname) for field in self._cached_fields())
+        entries = {self._key('pk', instance.pk, version): values,
+                   self._key(self.natural_key, getattr(instance, self.natural_key), version): instance.pk}
+
+        def write():
+            self._write(entries, generation)
+            if locked:
+                single_flight.release(key, cache)
+        # only committed rows are cached. if the transaction rolls back, the lock expires
+        transaction.on_commit(write)
+        return instance
+
+    def invalidate(self, pks):
+        """
+        drop rows from both levels (natural keys are checked against the row on lookup)
+        :param pks: primary keys of changed or deleted rows
+        """
+        with self._lock:
+            self._generation += 1
+        keys = [self._key('pk', pk) for pk in pks]
+        for key in keys:
+            self.l1.delete(key)
+        cache.delete_many(keys)
+
+    def invalidate_all(self):
+        with self._lock:
+            self._generation += 1
+        try:
+            cache.incr(f'objects:{self.model_label}:version')
+        except ValueError:
+            # no version yet: nothing is cached under it
+            pass
+        self.l1.clear()
+
+    def stats(self):
+        """
+        :return: dict: l1_hits, l2_hits, misses, hit_ratio (of all lookups), l1_size
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = sum(counters.values())
+        hits = counters['l1_hits'] + counters['l2_hits']
+        return {**counters, 'hit_ratio': hits / lookups if lookups else 0.0, 'l1_size': len(self.l1)}
+
+    def reset_stats(self):
+        with self._lock:
+            self._counters = dict.fromkeys(self._counters, 0)
@@ -0,0 +1,27 @@
+from django.core.signals import request_started
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core import invalidation
+from core.identity_map import forget
+from products.models import Product, Category
+
+
+@receiver(post_save)
+def forget_saved_instance(sender, instance, **kwargs):
+    # instance itself is current: other instances of the same row are stale
+    forget(sender, pks=[instance.pk], keep=instance)
+
+
+# only for models without bulk deletes: a post_delete receiver turns a queryset's delete() into
+# a fetch and a delete per row. orders and order_items are forgotten by their managers / delete()
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def forget_deleted_instance(sender, instance, **kwargs):
+    forget(sender, pks=[instance.pk])
+
+
+@receiver(request_started)
+def listen_for_invalidations(sender, **kwargs):
+    # a worker starts listening on its first request, after it was forked
+    invalidation.start_listening()
@@ -0,0 +1,138 @@
+"""
+single-flight (dogpile protection) for expensive cache misses
+
+when a popular entry expires, only one worker (process or thread) recomputes it:
+    per-key lock: on backends whose add() is atomic across processes (redis, memcached), a lock entry taken
+        with cache.add(), so a single worker of all the processes sharing the backend recomputes. on the others
+        (locmem, files, db), add() checks and then sets: the lock is kept in the process instead, so a single
+        worker per process recomputes
+    stale while revalidate: entries are kept past their expiry (stale_timeout). while one worker recomputes,
+        the others are served the stale value. an entry of an old version (e.g. the catalog version was bumped)
+        is stale as well
+    probabilistic early expiration ("XFetch"): shortly before an entry expires, a request may recompute it
+        ahead of time. the longer the value took to compute, the earlier. so a hot entry is usually refreshed
+        before it expires, by a single request
+when there's no value at all (cold), the others wait for the worker computing it, up to wait_timeout.
+"""
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+
+import logging
+
+logger = logging.getLogger('django')
+
+# seconds: lock of a computation (longer than any computation takes), poll interval while waiting
+LOCK_TIMEOUT = 30
+POLL_INTERVAL = 0.05
+
+# backends whose add() is a single atomic operation of the server
+ATOMIC_ADD_BACKENDS = (RedisCache, BaseMemcachedCache)
+
+_local_locks = {}  # key -> expiry (time.monotonic()) of locks kept in this process
+_local_locks_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def acquire(key, cache=None, timeout=LOCK_TIMEOUT):
+    """
+    :return: True if the lock of key was taken (it's released by release(), or expires after timeout)
+    """
+    cache = cache or default_cache
+    if isinstance(cache, ATOMIC_ADD_BACKENDS):
+        return cache.add(f'{key}:lock', True, timeout=timeout)
+    now = time.monotonic()
+    with _local_locks_lock:
+        if _local_locks.get(key, 0) > now:
+            return False
+        _local_locks[key] = now + timeout
+        return True
+
+
+def release(key, cache=None):
+    cache = cache or default_cache
+    if isinstance(cache, ATOMIC_ADD_BACKENDS):
+        cache.delete(f'{key}:lock')
+    else:
+        with _local_locks_lock:
+            _local_locks.pop(key, None)
+
+
+def wait_for(key, cache=None, timeout=None, accept=lambda value: True):
+    """
+    wait for another worker to store a value of key
+    :param accept: function telling if a value is the awaited one (e.g. not of an old version)
+    :return: the value, or None if it didn't come within timeout seconds
+    """
+    cache = cache or default_cache
+    deadline = time.monotonic() + (_setting('SINGLE_FLIGHT_WAIT_TIMEOUT', 3) if timeout is None else timeout)
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None and accept(value):
+            return value
+    return None
+
+
+def _is_fresh(entry, version, beta):
+    _, entry_version, expires_at, compute_time = entry
+    if entry_version != version:
+        return False
+    # XFetch: recompute early with a probability growing as expiry gets closer (log of (0, 1] is <= 0)
+    return time.time() - compute_time * beta * math.log(1.0 - random.random()) < expires_at
+
+
+def get_or_compute(key, compute, timeout, cache=None, version=None, stale_timeout=None, beta=1.0,
+                   wait_timeout=None):
+    """
+    :param key: cache key
+    :param compute: function computing the value. if it returns None, nothing is stored
+    :param timeout: seconds the value is fresh
+    :param cache: cache backend. default: the 'default' cache
+    :param version: current version of the value (e.g. the catalog version). an entry of another version is stale
+    :param stale_timeout: seconds a stale value is kept, to be served while recomputed.
+        default: settings.SINGLE_FLIGHT_STALE_TIMEOUT (300)
+    :param beta: eagerness of early recomputation. 0 disables it, above 1 favors recomputing earlier
+    :param wait_timeout: seconds to wait for a value computed by another worker, when there's no stale value.
+        default: settings.SINGLE_FLIGHT_WAIT_TIMEOUT (3). after that, the value is computed anyway
+    :return: the value (fresh, or stale while another worker recomputes it)
+    """
+    cache = cache or default_cache
+    entry = cache.get(key)
+    if entry is not None and _is_fresh(entry, version, beta):
+        return entry[0]
+
+    if not acquire(key, cache):
+        if entry is not None:
+            logger.debug(f"serving stale {key} while it's recomputed")
+            return entry[0]
+        entry = wait_for(key, cache, timeout=wait_timeout, accept=lambda entry: entry[1] == version)
+        if entry is not None:
+            return entry[0]
+        logger.warning(f"gave up waiting for {key}, computing it")
+        return _compute(key, compute, timeout, cache, version, stale_timeout)
+
+    try:
+        return _compute(key, compute, timeout, cache, version, stale_timeout)
+    finally:
+        release(key, cache)
+
+
+def _compute(key, compute, timeout, cache, version, stale_timeout):
+    started = time.monotonic()
+    value = compute()
+    compute_time = time.monotonic() - started
+    if value is not None:
+        stale_timeout = _setting('SINGLE_FLIGHT_STALE_TIMEOUT', 300) if stale_timeout is None else stale_timeout
+        cache.set(key, (value, version, time.time() + timeout, compute_time), timeout=timeout + stale_timeout)
+        logger.debug(f"computed {key} in {compute_time:.3f}s")
+    return value
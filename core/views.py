@@ -1,5 +1,36 @@
+from django.http import StreamingHttpResponse, HttpResponseBadRequest, Http404
+from django.views import View
 from django.views.generic import TemplateView
 
+from core.exports import DATASETS, FORMATS, ExportFilters, export
+from core.mixins import GroupRequiredMixin
+
 
 class HomePageView(TemplateView):
     template_name = 'core/home.html'
+
+
+class ExportView(GroupRequiredMixin, View):
+    """
+    streams a dataset (products, categories, orders, order_items) as a file download.
+    query string: format (csv / ndjson), gzip (true), and filters: date_from, date_to, category, paid
+    """
+    allowed_groups = ['staff', 'shift_manager']
+
+    def get(self, request, dataset):
+        if dataset not in DATASETS:
+            raise Http404(f"Unknown dataset '{dataset}'")
+        file_format = request.GET.get('format', 'csv')
+        if file_format not in FORMATS:
+            return HttpResponseBadRequest(f"format must be one of: {', '.join(FORMATS)}")
+        try:
+            filters = ExportFilters.from_query(request.GET)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        compress = request.GET.get('gzip', '').lower() == 'true'
+
+        filename = f'{dataset}.{file_format}' + ('.gz' if compress else '')
+        response = StreamingHttpResponse(export(dataset, file_format, filters, compress=compress),
+                                         content_type='application/gzip' if compress else FORMATS[file_format])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
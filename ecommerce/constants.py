@@ -1,10 +1,12 @@
 import logging
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
+from products.exceptions import InsufficientStockError
 
 # a way to control the log level of a caught exception
 EXCEPTION_LOG_LEVELS = {
     ValidationError: logging.WARNING,
+    InsufficientStockError: logging.WARNING,
     IntegrityError: logging.ERROR,
     Exception: logging.CRITICAL,
 }
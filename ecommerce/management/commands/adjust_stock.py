@@ -0,0 +1,50 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Product
+from products.stock import parse_adjustments, StockAdjustmentError
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+    help = ("Adjusts stock of many products in one transaction, from a CSV or JSONL manifest "
+            "(columns / keys: id or name, and delta or stock)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL manifest')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='format of the manifest (default: by file extension)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only check the manifest and report the changes, without adjusting stock')
+
+    def handle(self, *args, **kwargs):
+        path = kwargs['path']
+        file_format = kwargs.get('format') or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        dry_run = kwargs.get('dry_run', False)
+        logger.info(f"Starting with stock adjustment from {path}, format= {file_format}, dry_run= {dry_run}")
+
+        with open(path, newline='', encoding='utf-8') as file:
+            try:
+                if file_format == 'csv':
+                    rows = list(csv.DictReader(file))
+                else:
+                    rows = [json.loads(line) for line in file if line.strip()]
+            except ValueError as e:
+                raise CommandError(f"Can't read manifest: {str(e)}")
+
+        try:
+            changes = Product.objects.apply_stock_adjustments(parse_adjustments(rows), dry_run=dry_run)
+        except StockAdjustmentError as e:
+            for message in e.messages:
+                self.stderr.write(message)
+            raise CommandError(f"{len(e.conflicts)} conflicts in manifest, no stock was adjusted")
+
+        for product_id, (before, after) in changes.items():
+            self.stdout.write(f"Product #{product_id}: {before} -> {after}")
+        action = 'would be adjusted' if dry_run else 'adjusted'
+        self.stdout.write(f"Stock of {len(changes)} products {action}")
+        logger.info(f"Done with stock adjustment: {len(changes)} products {action}")
@@ -4,6 +4,7 @@ from django.contrib.contenttypes.models import ContentType
 from products.models import Product, Category
 from orders.models import Order, OrderItem
 from users.models import User
+from users.groups import invalidate_all_groups
 
 import logging
 
@@ -109,5 +110,8 @@ class Command(BaseCommand):
         ])
         logger.debug("Done with shift_manager_group permissions")
 
+        # groups may have been created: drop cached group memberships
+        invalidate_all_groups()
+
         # Feedback to console
         logger.info('Permissions successfully assigned to groups!')
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from products.snapshot import build_snapshot
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+    help = ("Compiles the product name index of autocomplete into a binary snapshot file, memory-mapped by the "
+            "workers (see products/snapshot.py). replaces the previous snapshot atomically")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='snapshot file (default: settings.CATALOG_SNAPSHOT_PATH)')
+
+    def handle(self, *args, **kwargs):
+        path = kwargs.get('output') or settings.CATALOG_SNAPSHOT_PATH
+        if not path:
+            raise CommandError("No snapshot file: give --output, or set CATALOG_SNAPSHOT_PATH")
+        logger.info(f"Starting with catalog snapshot: {path}")
+
+        started = time.monotonic()
+        try:
+            built = build_snapshot(path)
+        except OSError as e:
+            raise CommandError(f"Can't write {path}: {e}")
+
+        self.stdout.write(f"Built {path}: {built['products']} products, {built['size']} bytes "
+                          f"in {time.monotonic() - started:.1f}s")
+        logger.info("Done with catalog snapshot")
@@ -0,0 +1,65 @@
+import codecs
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import DATASETS, FORMATS, CHUNK_SIZE, ExportFilters, export
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+    help = "Exports products, categories, orders or order lines as CSV or NDJSON, streamed with constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(DATASETS))
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--output', default='-',
+                            help="file to write. '-' for stdout (default). a name ending with .gz is gzipped")
+        parser.add_argument('--gzip', action='store_true', help='gzip the output')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help=f'number of rows fetched from db at a time (default: {CHUNK_SIZE})')
+        parser.add_argument('--date-from', help='only orders created on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='only orders created on or before this date (YYYY-MM-DD)')
+        parser.add_argument('--category', help='only products of this category (id)')
+        parser.add_argument('--paid', choices=['true', 'false'], help='only paid / unpaid orders')
+
+    def handle(self, *args, **kwargs):
+        dataset, file_format, output = kwargs['dataset'], kwargs.get('format', 'csv'), kwargs.get('output', '-')
+        compress = kwargs.get('gzip', False) or output.endswith('.gz')
+        try:
+            filters = ExportFilters.from_query(kwargs)
+        except ValueError as e:
+            raise CommandError(str(e))
+        logger.info(f"Starting with export of {dataset}, format= {file_format}, output= {output}, gzip= {compress}")
+
+        # stdout of a command is text: plain exports are decoded and written through it. gzipped ones are bytes,
+        # written to the binary stdout of the process
+        if output != '-':
+            file = open(output, 'wb')
+        elif compress:
+            file = sys.stdout.buffer
+        else:
+            file = None
+        # a chunk may end in the middle of a character
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        chunks = export(dataset, file_format, filters, compress=compress,
+                        chunk_size=kwargs.get('chunk_size', CHUNK_SIZE))
+        written = 0
+        try:
+            for chunk in chunks:
+                if file is None:
+                    self.stdout.write(decoder.decode(chunk), ending='')
+                else:
+                    file.write(chunk)
+                written += len(chunk)
+            if file is None:
+                self.stdout.write(decoder.decode(b'', final=True), ending='')
+            else:
+                file.flush()
+        finally:
+            if output != '-':
+                file.close()
+        logger.info(f"Done with export of {dataset}: {written} bytes written")
@@ -0,0 +1,205 @@
+import csv
+import json
+import sys
+import time
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, DatabaseError
+
+from core import invalidation
+from products.autocomplete import product_name_index
+from products.cache import invalidate_catalog, product_cache
+from products.models import Product, Category
+
+import logging
+
+logger = logging.getLogger('django')
+
+# fields written when a product with the same name already exists
+UPDATE_FIELDS = ('description', 'price', 'stock', 'category')
+
+
+class Command(BaseCommand):
+    help = ("Imports products from a CSV or JSONL file (columns / keys: name, description, price, stock, category), "
+            "creating new products and updating existing ones by name")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file to import, '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='format of the file (default: by file extension)')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='number of rows validated and written together (default: 2000)')
+        parser.add_argument('--rejects', help='write rejected rows (line, reason, row) to this CSV file')
+
+    def handle(self, *args, **kwargs):
+        path = kwargs['path']
+        file_format = kwargs.get('format') or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        batch_size = kwargs.get('batch_size', 2000)
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive")
+        logger.info(f"Starting with products import from {path}, format= {file_format}, batch_size= {batch_size}")
+
+        self.categories = self.load_categories()
+        self.imported = 0
+        self.rejected = 0
+        self.reasons = Counter()
+        # rejected rows are written as they come, so memory doesn't grow with the number of rejects
+        self.rejects_file = self.rejects_writer = None
+        if kwargs.get('rejects'):
+            self.rejects_file = open(kwargs['rejects'], 'w', newline='', encoding='utf-8')
+            self.rejects_writer = csv.writer(self.rejects_file)
+            self.rejects_writer.writerow(['line', 'reason', 'row'])
+        started = time.monotonic()
+
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            batch = []
+            for line_number, row in self.read_rows(file, file_format):
+                batch.append((line_number, row))
+                if len(batch) >= batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+            if self.rejects_file is not None:
+                self.rejects_file.close()
+
+        # bulk_create skips signals: this process's autocomplete index is rebuilt on next lookup,
+        # and cached products and catalog pages are dropped. running workers drop theirs by the invalidation bus
+        product_name_index.clear()
+        product_cache.invalidate_all()
+        invalidate_catalog()
+        invalidation.publish(Product._meta.label)
+
+        elapsed = time.monotonic() - started
+        rate = self.imported / elapsed if elapsed else 0
+        self.stdout.write(f"Imported {self.imported} products in {elapsed:.1f}s ({rate:.0f} rows/s), "
+                          f"rejected {self.rejected}")
+        for reason, count in self.reasons.most_common():
+            self.stdout.write(f"  {count} rejected: {reason}")
+        if self.rejects_file is not None:
+            self.stdout.write(f"Rejected rows were written to {kwargs['rejects']}")
+        logger.info(f"Done with products import: imported {self.imported}, rejected {self.rejected}")
+
+    @staticmethod
+    def load_categories():
+        """
+        :return: dict of category's name -> id (first category of each name)
+        """
+        categories = {}
+        for category_id, name in Category.objects.order_by('pk').values_list('pk', 'name').iterator():
+            categories.setdefault(name, category_id)
+        return categories
+
+    def read_rows(self, file, file_format):
+        """
+        stream rows of file, one at a time
+        :return: iterator of (line number, dict of row)
+        """
+        if file_format == 'csv':
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    self.reject(line_number, 'invalid JSON', line.strip())
+                    continue
+                if not isinstance(row, dict):
+                    self.reject(line_number, 'invalid JSON', line.strip())
+                    continue
+                yield line_number, row
+
+    def reject(self, line_number, reason, row):
+        self.rejected += 1
+        # report by field, not by exact message
+        self.reasons[reason.split(':')[0]] += 1
+        if self.rejects_writer is not None:
+            self.rejects_writer.writerow([line_number, reason,
+                                          row if isinstance(row, str) else json.dumps(row, default=str)])
+
+    def build_product(self, row):
+        """
+        :return: unsaved Product, validated (without queries)
+        :raises ValidationError: row is invalid
+        """
+        category_name = (row.get('category') or '').strip()
+        if not category_name:
+            raise ValidationError({'category': ['This field cannot be blank.']})
+        max_length = Category._meta.get_field('name').max_length
+        if len(category_name) > max_length:
+            # not truncated: distinct long names would end up in the same category
+            raise ValidationError({'category': [f'Ensure this value has at most {max_length} characters '
+                                                f'(it has {len(category_name)}).']})
+        product = Product(
+            name=(row.get('name') or '').strip(),
+            description=row.get('description') or '',
+            stock=row.get('stock') if row.get('stock') not in (None, '') else 0,
+        )
+        try:
+            product.price = row.get('price') if row.get('price') not in (None, '') else None
+        except ValidationError as e:
+            # MoneyField coerces on assignment
+            raise ValidationError({'price': e.messages})
+        product.clean_fields(exclude=['category'])
+        product._category_name = category_name
+        return product
+
+    def resolve_categories(self, category_names):
+        """
+        create the categories that don't exist yet, in a single INSERT
+        """
+        missing = [name for name in category_names if name not in self.categories]
+        if missing:
+            Category.objects.bulk_create([Category(name=name) for name in missing])
+            for category_id, name in Category.objects.filter(name__in=missing).order_by('pk').values_list('pk', 'name'):
+                self.categories.setdefault(name, category_id)
+            logger.debug(f"created {len(missing)} categories")
+
+    def import_batch(self, batch):
+        # validate in python (no queries). later rows of the same name replace earlier ones
+        products = {}
+        accepted = []
+        for line_number, row in batch:
+            try:
+                product = self.build_product(row)
+            except (ValidationError, TypeError) as e:
+                errors = getattr(e, 'message_dict', None) or {'row': [str(e)]}
+                field, messages = next(iter(errors.items()))
+                self.reject(line_number, f"{field}: {messages[0]}", row)
+                continue
+            products[product.name] = product
+            accepted.append((line_number, row))
+        if not products:
+            return
+
+        try:
+            with transaction.atomic():
+                self.resolve_categories({product._category_name for product in products.values()})
+                for product in products.values():
+                    product.category_id = self.categories[product._category_name]
+                # one INSERT ... ON CONFLICT (name) DO UPDATE for the whole batch
+                Product.objects.bulk_create(products.values(), update_conflicts=True, unique_fields=['name'],
+                                            update_fields=UPDATE_FIELDS)
+                # bulk_create skips signals: index the batch for search explicitly
+                product_ids = list(Product.objects.filter(name__in=products.keys()).values_list('pk', flat=True))
+                Product.objects.update_search_index(product_ids)
+        except DatabaseError as e:
+            logger.error(f"Failed importing a batch: {str(e)}", exc_info=True)
+            # categories created in this batch were rolled back
+            self.categories = self.load_categories()
+            for line_number, row in accepted:
+                self.reject(line_number, f"database: {str(e)}", row)
+            return
+
+        self.imported += len(products)
+        logger.debug(f"imported a batch of {len(products)} products, {self.imported} so far")
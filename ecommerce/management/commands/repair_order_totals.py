@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum, Count
+from orders.models import Order, OrderItem
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+    help = "Recomputes orders' denormalized totals (total_amount, item_count, line_count) and fixes any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='number of orders to recompute per chunk (default: 1000)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report orders with drifted totals, without fixing them')
+
+    def handle(self, *args, **kwargs):
+        chunk_size = kwargs.get('chunk_size', 1000)
+        dry_run = kwargs.get('dry_run', False)
+        logger.info(f"Starting with order totals repair, chunk_size= {chunk_size}, dry_run= {dry_run}")
+
+        checked = fixed = 0
+        last_id = 0
+        while True:
+            # keyset pagination over orders: each chunk costs the same, regardless of its position
+            orders = list(Order.objects.filter(pk__gt=last_id).order_by('pk')
+                          .only('pk', *Order.TOTALS_FIELDS)[:chunk_size])
+            if not orders:
+                break
+            last_id = orders[-1].pk
+
+            totals = {
+                row['order_id']: row for row in
+                OrderItem.objects.filter(order_id__gte=orders[0].pk, order_id__lte=last_id)
+                .values('order_id')
+                .annotate(total_amount=Sum('price'), item_count=Sum('quantity'), line_count=Count('pk'))
+            }
+
+            drifted = []
+            for order in orders:
+                row = totals.get(order.pk, {})
+                expected = (row.get('total_amount') or 0, row.get('item_count') or 0, row.get('line_count') or 0)
+                actual = (order.total_amount, order.item_count, order.line_count)
+                if actual != expected:
+                    logger.warning(f"Order #{order.pk} totals drifted: {actual} instead of {expected}")
+                    drifted.append(order.pk)
+
+            if drifted and not dry_run:
+                # not the totals read above: order_items may have changed since. recomputed from the current
+                # ones in a single UPDATE, so a concurrent change of totals is never overwritten with stale values
+                Order.objects.recompute_totals(drifted)
+            checked += len(orders)
+            fixed += len(drifted)
+
+        action = 'found' if dry_run else 'fixed'
+        self.stdout.write(f"Checked {checked} orders, {action} {fixed} with drifted totals")
+        logger.info(f"Done with order totals repair: checked {checked}, {action} {fixed}")
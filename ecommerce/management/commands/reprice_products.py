@@ -0,0 +1,55 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Product, Category
+from products.pricing import PriceRule, ROUNDING_MODES
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+    help = ("Reprices products (all, or of a category) with a single UPDATE: percentage and / or absolute change, "
+            "rounding, price ending and floor")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, help='reprice only products of this category (id)')
+        parser.add_argument('--percent', help='change by a percentage, e.g. -15 for 15%% off')
+        parser.add_argument('--amount', help='add an amount, e.g. 2.50 (negative to subtract)')
+        parser.add_argument('--round-to', type=int, help='round to a multiple of this number of cents, e.g. 5')
+        parser.add_argument('--rounding', choices=ROUNDING_MODES, default='nearest',
+                            help='rounding direction of --round-to (default: nearest)')
+        parser.add_argument('--ending', type=int, help='round down to a price ending with these cents, e.g. 99')
+        parser.add_argument('--floor', help='minimum price, e.g. 1.00')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only list the price changes, without repricing')
+
+    def handle(self, *args, **kwargs):
+        try:
+            rule = PriceRule(percent=kwargs.get('percent'), amount=kwargs.get('amount'),
+                             round_to=kwargs.get('round_to'), rounding=kwargs.get('rounding', 'nearest'),
+                             ending=kwargs.get('ending'), floor=kwargs.get('floor'))
+        except (ValueError, ValidationError) as e:
+            raise CommandError(f"Invalid price rule: {e}")
+        if not rule:
+            raise CommandError("Nothing to do: give at least one of --percent, --amount, --round-to, --ending, --floor")
+
+        products = None
+        if kwargs.get('category') is not None:
+            products = Category.objects.filter(pk=kwargs['category']).first()
+            if products is None:
+                raise CommandError(f"Category #{kwargs['category']} does not exist")
+        dry_run = kwargs.get('dry_run', False)
+        logger.info(f"Starting with repricing: {rule}, category= {kwargs.get('category')}, dry_run= {dry_run}")
+
+        if dry_run:
+            changed = 0
+            for product, differences in Product.objects.reprice_diff(rule, products):
+                old_price, new_price = differences['price']
+                self.stdout.write(f"{product.name} (#{product.pk}): {old_price} -> {new_price}")
+                changed += 1
+            self.stdout.write(f"{changed} products would be repriced ({rule})")
+        else:
+            changed = Product.objects.reprice(rule, products)
+            self.stdout.write(f"Repriced {changed} products ({rule})")
+        logger.info(f"Done with repricing: {changed} products, dry_run= {dry_run}")
@@ -3,6 +3,8 @@ import logging
 from django.core.exceptions import PermissionDenied
 from django.http import Http404
 
+from core.identity_map import identity_map_scope
+
 logger = logging.getLogger('django')
 
 class CustomErrorMiddleware:
@@ -29,3 +31,15 @@ class CustomErrorMiddleware:
             logger.error(f"Unhandled exception occurred: {str(e)}", exc_info=True)
             return render(request, '500.html', status=500)
 
+
+class IdentityMapMiddleware:
+    """
+    each request gets its own identity map (see core/identity_map.py):
+    repeated lookups of the same row through manager getters are loaded once
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identity_map_scope():
+            return self.get_response(request)
@@ -66,6 +66,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ecommerce.middleware.IdentityMapMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -116,6 +117,36 @@ else:
     }
 
 
+# Cache
+# the catalog cache (pages and fragments of the product catalog, see products/cache.py) is kept in memory
+# of each process, or in files shared by all processes of the host when CATALOG_CACHE_DIR is set
+CATALOG_CACHE_DIR = os.environ.get('CATALOG_CACHE_DIR')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache' if CATALOG_CACHE_DIR
+        else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': CATALOG_CACHE_DIR or 'catalog',
+    },
+}
+# seconds. full pages (anonymous users) and fragments (product grid) of the catalog
+CATALOG_PAGE_CACHE_TIMEOUT = int(os.environ.get('CATALOG_PAGE_CACHE_TIMEOUT', 300))
+CATALOG_FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('CATALOG_FRAGMENT_CACHE_TIMEOUT', 600))
+# binary snapshot of product names, memory-mapped by the workers (see products/snapshot.py), built by
+# build_catalog_snapshot. when set, autocomplete is served from it
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')
+# object cache of product and category lookups (see core/object_cache.py): L1 per process, L2 'default' cache
+OBJECT_CACHE_L1_SIZE = int(os.environ.get('OBJECT_CACHE_L1_SIZE', 1000))
+OBJECT_CACHE_L1_TIMEOUT = int(os.environ.get('OBJECT_CACHE_L1_TIMEOUT', 30))
+OBJECT_CACHE_TIMEOUT = int(os.environ.get('OBJECT_CACHE_TIMEOUT', 300))
+OBJECT_CACHE_WAIT_TIMEOUT = float(os.environ.get('OBJECT_CACHE_WAIT_TIMEOUT', 0.1))
+# seconds. single-flight of cache misses (see core/single_flight.py): how long a stale entry is kept, to be served
+# while it's recomputed, and how long to wait for another worker computing a missing one
+SINGLE_FLIGHT_STALE_TIMEOUT = int(os.environ.get('SINGLE_FLIGHT_STALE_TIMEOUT', 300))
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_WAIT_TIMEOUT', 3))
+
 if 'DEBUG' not in os.environ:
     DEBUG = False
 
@@ -164,6 +195,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# log file, e.g. LOG_FILE=django.log. not set: logs go to the console only (so test runs, whatever the runner,
+# write no file into the source tree)
+LOG_FILE = os.environ.get('LOG_FILE', '')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -183,8 +218,10 @@ LOGGING = {
         'file': {
             'level': 'DEBUG',
             'class': 'logging.FileHandler',
-            'filename': 'django.log',
+            'filename': LOG_FILE,
             'formatter': 'colored',
+        } if LOG_FILE else {
+            'class': 'logging.NullHandler',
         },
     },
     'loggers': {
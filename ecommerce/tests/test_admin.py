@@ -2,6 +2,10 @@ from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.urls import reverse
 
+from orders.models import Order, OrderItem
+from products.models import Product
+from products.tests.factories import ProductFactory
+
 
 class AdminSiteTests(TestCase):
     def setUp(self):
@@ -31,3 +35,45 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
         self.assertEqual(res.status_code, 200)
 
+
+
+class OrderAdminTests(TestCase):
+    def setUp(self):
+        self.admin_user = get_user_model().objects.create_superuser(
+            username='root',
+            email='admin@example.com',
+            password='testpass123'
+        )
+        self.client.force_login(self.admin_user)
+        self.product = ProductFactory(price='2.00', stock=10)
+        self.order = Order.objects.create_order(user=self.admin_user)
+        self.order_item = OrderItem.objects.create_order_item(self.order, self.product, 3)
+
+    def delete_selected(self, model_name, pks):
+        return self.client.post(reverse(f'admin:orders_{model_name}_changelist'),
+                                {'action': 'delete_selected', '_selected_action': pks, 'post': 'yes'})
+
+    def test_delete_selected_order_items(self):
+        """ bulk delete returns stock and updates the order's totals """
+        self.delete_selected('orderitem', [self.order_item.pk])
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.total_amount, order.item_count, order.line_count), (0, 0, 0))
+
+    def test_delete_order_item(self):
+        self.client.post(reverse('admin:orders_orderitem_delete', args=[self.order_item.pk]), {'post': 'yes'})
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).item_count, 0)
+
+    def test_delete_selected_orders(self):
+        """ bulk delete returns stock of the orders' items """
+        self.delete_selected('order', [self.order.pk])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+
+    def test_delete_order(self):
+        self.client.post(reverse('admin:orders_order_delete', args=[self.order.pk]), {'post': 'yes'})
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
@@ -0,0 +1,251 @@
+import csv
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from orders.models import Order, OrderItem
+from orders.tests.factories import OrderFactory, OrderItemFactory
+from products.autocomplete import product_name_index
+from products.models import Product, Category
+from products.snapshot import CatalogSnapshot, get_snapshot
+from products.tests.factories import ProductFactory, CategoryFactory
+
+
+class RepairOrderTotalsTests(TestCase):
+    def setUp(self):
+        self.order = OrderFactory()
+        self.order_item = OrderItemFactory(order=self.order, quantity=2, price=10)
+        self.order_item2 = OrderItemFactory(order=self.order, quantity=1, price=5)
+        self.empty_order = OrderFactory()
+
+    def test_totals_without_drift(self):
+        call_command('repair_order_totals', chunk_size=1)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_amount, self.order.item_count, self.order.line_count), (15, 3, 2))
+
+    def test_repair_drifted_totals(self):
+        Order.objects.filter(pk=self.order.pk).update(total_amount=0, item_count=7, line_count=0)
+        Order.objects.filter(pk=self.empty_order.pk).update(total_amount=3)
+
+        call_command('repair_order_totals', chunk_size=1)
+
+        self.order.refresh_from_db()
+        self.empty_order.refresh_from_db()
+        self.assertEqual((self.order.total_amount, self.order.item_count, self.order.line_count), (15, 3, 2))
+        self.assertEqual(self.empty_order.total_amount, 0)
+
+    def test_repair_writes_current_totals(self):
+        Order.objects.filter(pk=self.order.pk).update(item_count=7)
+        recompute_totals = Order.objects.recompute_totals
+
+        def recompute_after_change(order_ids):
+            # an order_item added between the read of the totals and their repair
+            OrderItem.objects.create_order_item(self.order, ProductFactory(price=1, stock=1), 1)
+            recompute_totals(order_ids)
+
+        with patch.object(Order.objects, 'recompute_totals', recompute_after_change):
+            call_command('repair_order_totals')
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_amount, self.order.item_count, self.order.line_count), (16, 4, 3))
+
+    def test_dry_run(self):
+        Order.objects.filter(pk=self.order.pk).update(item_count=7)
+        call_command('repair_order_totals', dry_run=True)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.item_count, 7)
+
+
+class ImportProductsTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory(name='Kitchen')
+        self.existing = ProductFactory(name='Kettle', price=10, stock=1, category=self.category)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_import_csv(self):
+        path = self.write_file('feed.csv', (
+            "name,description,price,stock,category\n"
+            "Kettle,steel kettle,12.50,4,Kitchen\n"
+            "Mug,a mug,3.99,20,Kitchen\n"
+            "Tent,two persons,150,2,Camping\n"
+        ))
+        out = StringIO()
+
+        call_command('import_products', path, batch_size=2, stdout=out)
+
+        self.assertIn('Imported 3 products', out.getvalue())
+        self.assertEqual(Product.objects.count(), 3)
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.description, self.existing.price, self.existing.stock),
+                         ('steel kettle', Decimal('12.50'), 4))
+        mug = Product.objects.get(name='Mug')
+        self.assertEqual((mug.price, mug.stock, mug.category), (Decimal('3.99'), 20, self.category))
+        # a missing category is created once
+        self.assertEqual(Category.objects.filter(name='Camping').count(), 1)
+        self.assertEqual(Product.objects.get(name='Tent').category.name, 'Camping')
+
+    def test_import_jsonl_with_rejects(self):
+        path = self.write_file('feed.jsonl', '\n'.join([
+            json.dumps({'name': 'Mug', 'price': 3.99, 'stock': 20, 'category': 'Kitchen'}),
+            json.dumps({'name': 'Broken', 'price': -1, 'stock': 1, 'category': 'Kitchen'}),
+            json.dumps({'name': 'Nameless', 'price': 'cheap', 'stock': 1, 'category': 'Kitchen'}),
+            json.dumps({'name': 'Orphan', 'price': 1, 'stock': 1}),
+            'not json',
+            json.dumps({'name': 'Mug', 'price': 4.5, 'stock': 10, 'category': 'Kitchen'}),
+        ]))
+        rejects_path = os.path.join(self.directory.name, 'rejects.csv')
+        out = StringIO()
+
+        call_command('import_products', path, rejects=rejects_path, stdout=out)
+
+        self.assertIn('Imported 1 products', out.getvalue())
+        self.assertIn('rejected 4', out.getvalue())
+        # the last row of a name wins
+        mug = Product.objects.get(name='Mug')
+        self.assertEqual((mug.price, mug.stock), (Decimal('4.50'), 10))
+        self.assertFalse(Product.objects.filter(name__in=['Broken', 'Nameless', 'Orphan']).exists())
+        with open(rejects_path, encoding='utf-8') as file:
+            rejects = list(csv.DictReader(file))
+        self.assertEqual([(row['line'], row['reason'].split(':')[0]) for row in rejects],
+                         [('5', 'invalid JSON'), ('2', 'price'), ('3', 'price'), ('4', 'category')])
+
+    def test_long_category_name_rejected(self):
+        long_name = 'Kitchen ' * 20
+        path = self.write_file('feed.jsonl', '\n'.join([
+            json.dumps({'name': 'Mug', 'price': 3.99, 'stock': 20, 'category': long_name + 'mugs'}),
+            json.dumps({'name': 'Pan', 'price': 9.99, 'stock': 2, 'category': long_name + 'pans'}),
+        ]))
+        out = StringIO()
+
+        call_command('import_products', path, stdout=out)
+
+        self.assertIn('rejected 2', out.getvalue())
+        self.assertIn('2 rejected: category', out.getvalue())
+        self.assertEqual(Category.objects.count(), 1)
+
+    def test_imported_products_are_searchable(self):
+        path = self.write_file('feed.csv', "name,description,price,stock,category\nTeapot,porcelain,20,3,Kitchen\n")
+        product_name_index.lookup('te')  # build index
+
+        call_command('import_products', path, stdout=StringIO())
+
+        teapot = Product.objects.get(name='Teapot')
+        self.assertEqual(list(Product.objects.search('porcelain')), [teapot])
+        self.assertEqual(product_name_index.lookup('tea'), [(teapot.id, 'Teapot')])
+
+
+class AdjustStockTests(TestCase):
+    def setUp(self):
+        self.kettle = ProductFactory(name='Kettle', stock=5)
+        self.mug = ProductFactory(name='Mug', stock=1)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_manifest(self, content, name='manifest.csv'):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_adjust_stock(self):
+        path = self.write_manifest("name,delta\nKettle,10\nMug,-1\n")
+        out = StringIO()
+        call_command('adjust_stock', path, stdout=out)
+        self.assertIn('Stock of 2 products adjusted', out.getvalue())
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Kettle': 15, 'Mug': 0})
+
+    def test_dry_run_jsonl(self):
+        path = self.write_manifest(json.dumps({'id': self.mug.pk, 'stock': 9}) + '\n', name='manifest.jsonl')
+        out = StringIO()
+        call_command('adjust_stock', path, dry_run=True, stdout=out)
+        self.assertIn(f'Product #{self.mug.pk}: 1 -> 9', out.getvalue())
+        self.assertEqual(Product.objects.get(pk=self.mug.pk).stock, 1)
+
+    def test_conflicts(self):
+        path = self.write_manifest("name,delta\nKettle,10\nMug,-2\n")
+        with self.assertRaises(CommandError):
+            call_command('adjust_stock', path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Kettle': 5, 'Mug': 1})
+
+
+class RepriceProductsTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory(name='Kitchen')
+        self.kettle = ProductFactory(name='Kettle', price='12.50', category=self.category)
+        self.tent = ProductFactory(name='Tent', price=100)
+
+    def test_reprice_category(self):
+        out = StringIO()
+        call_command('reprice_products', category=self.category.pk, percent='-20', ending=99, stdout=out)
+        self.assertIn('Repriced 1 products', out.getvalue())
+        self.assertEqual(dict(Product.objects.values_list('name', 'price')),
+                         {'Kettle': Decimal('9.99'), 'Tent': Decimal('100.00')})
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('reprice_products', amount='1.5', dry_run=True, stdout=out)
+        self.assertIn(f'Kettle (#{self.kettle.pk}): 12.50 -> 14.00', out.getvalue())
+        self.assertIn('2 products would be repriced', out.getvalue())
+        self.assertEqual(Product.objects.get(pk=self.kettle.pk).price, Decimal('12.50'))
+
+    def test_invalid_rule(self):
+        with self.assertRaises(CommandError):
+            call_command('reprice_products', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('reprice_products', percent='lots', stdout=StringIO())
+
+
+class BuildCatalogSnapshotTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'catalog.snapshot')
+        self.kitchen = CategoryFactory(name='Kitchen')
+        self.garden = CategoryFactory(name='Garden')
+        self.kettle = ProductFactory(name='Kettle', description='Boils water', price='19.99', stock=5,
+                                     category=self.kitchen)
+        self.mug = ProductFactory(name='Mug', description=None, price=5, stock=0, category=self.kitchen)
+        self.ketchup = ProductFactory(name='ketchup', price='2.50', category=self.garden)
+
+    def test_build(self):
+        out = StringIO()
+        call_command('build_catalog_snapshot', output=self.path, stdout=out)
+        self.assertIn('3 products', out.getvalue())
+
+        snapshot = CatalogSnapshot(self.path)
+        self.assertEqual(snapshot.lookup('KET'), [(self.ketchup.pk, 'ketchup'), (self.kettle.pk, 'Kettle')])
+        self.assertEqual(snapshot.lookup('ket', limit=1), [(self.ketchup.pk, 'ketchup')])
+        self.assertEqual(snapshot.lookup('mug'), [(self.mug.pk, 'Mug')])
+        self.assertEqual(snapshot.lookup('x'), [])
+
+    def test_rebuild_is_swapped_in(self):
+        with self.settings(CATALOG_SNAPSHOT_PATH=self.path), patch('products.snapshot.SNAPSHOT_CHECK_INTERVAL', 0):
+            self.assertIsNone(get_snapshot())
+            call_command('build_catalog_snapshot', stdout=StringIO())
+            snapshot = get_snapshot()
+            self.assertEqual(len(snapshot), 3)
+            self.assertIs(get_snapshot(), snapshot)
+
+            mug_id = self.mug.pk
+            self.mug.delete()
+            call_command('build_catalog_snapshot', stdout=StringIO())
+            self.assertEqual(get_snapshot().lookup('mug'), [])
+            # the replaced snapshot stays readable while in use
+            self.assertEqual(snapshot.lookup('mug'), [(mug_id, 'Mug')])
+        self.assertEqual(os.listdir(self.directory.name), ['catalog.snapshot'])
+
+    def test_no_output(self):
+        with self.settings(CATALOG_SNAPSHOT_PATH=None), self.assertRaises(CommandError):
+            call_command('build_catalog_snapshot', stdout=StringIO())
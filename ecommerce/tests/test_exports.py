@@ -0,0 +1,117 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from ecommerce.management.commands.assign_permissions import Command
+from orders.models import Order
+from orders.tests.factories import OrderFactory, OrderItemFactory
+from products.tests.factories import UserFactory, ProductFactory, CategoryFactory
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory(name='Kitchen')
+        self.other_category = CategoryFactory(name='Camping')
+        self.kettle = ProductFactory(name='Kettle', price='12.50', stock=3, category=self.category)
+        self.tent = ProductFactory(name='Tent', price=150, stock=1, category=self.other_category)
+
+        self.paid_order = OrderFactory(is_paid=True)
+        self.unpaid_order = OrderFactory(is_paid=False)
+        OrderItemFactory(order=self.paid_order, product=self.kettle, quantity=2, price='25.00')
+        OrderItemFactory(order=self.unpaid_order, product=self.tent, quantity=1, price='150.00')
+        Order.objects.filter(pk=self.paid_order.pk).update(
+            created_at=timezone.make_aware(datetime.datetime(2024, 3, 10, 12)))
+        Order.objects.filter(pk=self.unpaid_order.pk).update(
+            created_at=timezone.make_aware(datetime.datetime(2024, 5, 1, 12)))
+
+
+class ExportViewTests(ExportTestCase):
+    def setUp(self):
+        super().setUp()
+        Command().handle()
+        self.shift_manager = UserFactory(groups=[Group.objects.get(name='shift_manager')])
+        self.customer = UserFactory(groups=[Group.objects.get(name='customers')])
+        self.client.login(username=self.shift_manager.username, password='password')
+
+    def get_export(self, dataset, **query):
+        response = self.client.get(reverse('export', kwargs={'dataset': dataset}), query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content), response
+
+    def test_products_csv(self):
+        content, response = self.get_export('products')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="products.csv"')
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual([(row['name'], row['price'], row['category']) for row in rows],
+                         [('Kettle', '12.50', 'Kitchen'), ('Tent', '150.00', 'Camping')])
+
+    def test_products_filtered_by_category(self):
+        content, _ = self.get_export('products', category=self.other_category.pk)
+        self.assertEqual([row['name'] for row in csv.DictReader(io.StringIO(content.decode()))], ['Tent'])
+
+    def test_orders_ndjson_gzipped_with_filters(self):
+        content, response = self.get_export('orders', format='ndjson', gzip='true',
+                                            date_from='2024-03-10', date_to='2024-03-10', paid='true')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.ndjson.gz"')
+        rows = [json.loads(line) for line in gzip.decompress(content).decode().splitlines()]
+        self.assertEqual([(row['id'], row['is_paid'], row['total_amount']) for row in rows],
+                         [(self.paid_order.pk, True, '25.00')])
+
+    def test_order_items_by_date_range(self):
+        content, _ = self.get_export('order_items', format='ndjson', date_from='2024-04-01')
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([(row['order_id'], row['product'], row['quantity']) for row in rows],
+                         [(self.unpaid_order.pk, 'Tent', 1)])
+
+    def test_invalid_parameters(self):
+        url = reverse('export', kwargs={'dataset': 'orders'})
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'date_from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'paid': 'maybe'}).status_code, 400)
+
+    def test_customers_cannot_export(self):
+        self.client.login(username=self.customer.username, password='password')
+        response = self.client.get(reverse('export', kwargs={'dataset': 'orders'}))
+        self.assertEqual(response.status_code, 403)
+
+
+class ExportDataCommandTests(ExportTestCase):
+    def test_export_to_stdout(self):
+        out = io.StringIO()
+        call_command('export_data', 'categories', stdout=out)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual([row['name'] for row in rows], ['Kitchen', 'Camping'])
+
+    def test_export_to_gzipped_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'order_items.ndjson.gz')
+            call_command('export_data', 'order_items', format='ndjson', output=path, paid='true', chunk_size=1)
+            with gzip.open(path, 'rt') as file:
+                rows = [json.loads(line) for line in file]
+        self.assertEqual([(row['product'], row['price'], row['is_paid']) for row in rows],
+                         [('Kettle', '25.00', True)])
+
+    def test_export_gzipped_to_stdout(self):
+        stdout = io.TextIOWrapper(io.BytesIO())
+        with patch('sys.stdout', stdout):
+            call_command('export_data', 'categories', gzip=True)
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(stdout.buffer.getvalue()).decode())))
+        self.assertEqual([row['name'] for row in rows], ['Kitchen', 'Camping'])
+
+    def test_invalid_filter(self):
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'orders', date_to='2024-13-01', stdout=io.StringIO())
@@ -18,7 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from users.views import SignUpView
 from django.contrib.auth.views import LoginView
-from core.views import HomePageView
+from core.views import HomePageView, ExportView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -28,6 +28,7 @@ urlpatterns = [
     path('accounts/', include('django.contrib.auth.urls')),  # Include Django's auth URLs
     path('products/', include('products.urls')),
     path('orders/', include('orders.urls')),
+    path('exports/<str:dataset>/', ExportView.as_view(), name='export'),
     path('', HomePageView.as_view(), name='home')
 
 ]
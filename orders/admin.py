@@ -6,6 +6,15 @@ from .models import Order, OrderItem
 class OrderAdmin(admin.ModelAdmin):
     list_display = [field.name for field in Order._meta.fields]
     search_fields = ('product__name', 'user__username')
+    # maintained by OrderItem changes
+    readonly_fields = Order.TOTALS_FIELDS
+
+    # through the manager, so quantities of the order_items are returned to stock
+    def delete_model(self, request, obj):
+        Order.objects.delete_order(obj.pk)
+
+    def delete_queryset(self, request, queryset):
+        Order.objects.delete_orders(queryset)
 
 
 @admin.register(OrderItem)
@@ -13,3 +22,10 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_display = ('order', 'product', 'quantity')
     search_fields = ('order__id', 'product__name')
 
+    # through the manager, so quantities are returned to stock and orders' totals are updated
+    def delete_model(self, request, obj):
+        OrderItem.objects.delete_order_item(obj.pk)
+
+    def delete_queryset(self, request, queryset):
+        OrderItem.objects.delete_order_items(queryset)
+
@@ -1,10 +1,13 @@
 from typing import Union, Optional
 
 from django.db import models, transaction
-from products.managers import ProductManager
+from django.db.models import Q, F, Sum, Count, OuterRef, Subquery, Prefetch, Value, BigIntegerField
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
 from products.models import Product
 
+from core import identity_map
+from core.money import Money
 from ecommerce.constants import EXCEPTION_LOG_LEVELS
 import logging
 
@@ -22,13 +25,142 @@ class OrderManager(models.Manager):
             logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
             return None
 
+    def create_order_with_items(self, user, items: list, is_paid=False) -> Optional['Order']:
+        """
+        create an Order together with all of its order_items (a whole basket), in a single transaction.
+
+        all products are loaded in a single query, and locked in a deterministic order (by id) to avoid
+        deadlocks between concurrent checkouts. stock of all products is decremented in a single UPDATE,
+        and all order_items are inserted in a single INSERT.
+        lines of the same product are combined into one order_item.
+
+        :param user: owner of the new order
+        :param items: list of (product, quantity) pairs. product is product's id (int) OR product's name (str)
+        :param is_paid:
+        :return: new Order object if successful. None otherwise
+        """
+        try:
+            # combine quantities of repeating products
+            quantities = {}
+            for product_key, quantity in items:
+                if not isinstance(product_key, (int, str)) or isinstance(product_key, bool):
+                    raise ValidationError(f"Product must be given by its id or name, got {product_key!r}")
+                if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+                    raise ValidationError(f"Quantity of product {product_key} must be a positive int, got {quantity!r}")
+                quantities[product_key] = quantities.get(product_key, 0) + quantity
+            if not quantities:
+                raise ValidationError("Can't create an order without items")
+
+            product_ids = [key for key in quantities if isinstance(key, int)]
+            product_names = [key for key in quantities if isinstance(key, str)]
+
+            with transaction.atomic():
+                products = Product.objects.select_for_update().filter(
+                    Q(pk__in=product_ids) | Q(name__in=product_names)).order_by('pk')
+                products_by_id = {product.pk: product for product in products}
+                products_by_name = {product.name: product for product in products_by_id.values()}
+
+                quantities_by_id = {}
+                for product_key, quantity in quantities.items():
+                    if isinstance(product_key, int):
+                        product = products_by_id.get(product_key)
+                    else:
+                        product = products_by_name.get(product_key)
+                    if product is None:
+                        raise Product.DoesNotExist(f"Product {product_key} was not found")
+                    quantities_by_id[product.pk] = quantities_by_id.get(product.pk, 0) + quantity
+
+                Product.objects.adjust_stock_bulk(
+                    {product_id: -quantity for product_id, quantity in quantities_by_id.items()})
+
+                from orders.models import OrderItem
+                new_order_items = [
+                    OrderItem(product=products_by_id[product_id], quantity=quantity,
+                              price=products_by_id[product_id].price * quantity)
+                    for product_id, quantity in quantities_by_id.items()
+                ]
+                # bulk_create skips OrderItem.save(), so order's totals are set here
+                new_order = self.model(
+                    user=user, is_paid=is_paid,
+                    total_amount=sum(order_item.price for order_item in new_order_items),
+                    item_count=sum(quantities_by_id.values()),
+                    line_count=len(new_order_items),
+                )
+                # values were validated above: skip python-side validation (db constraints still apply)
+                new_order.save(trusted=True)
+                for order_item in new_order_items:
+                    order_item.order = new_order
+                OrderItem.objects.bulk_create(new_order_items)
+                logger.debug(f"new order was created successfully with {len(quantities_by_id)} items: {new_order}")
+                return new_order
+        except Product.DoesNotExist as e:
+            logger.error(f"An error occurred: {str(e)}")
+            return None
+        except ValidationError as e:
+            logger.error(f"An error occurred: {str(e)}", exc_info=True)
+            return None
+        except Exception as e:
+            log_level = EXCEPTION_LOG_LEVELS.get(type(e), logging.ERROR)
+            logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
+            return None
+
+    def adjust_totals(self, order: Union['Order', int], amount=0, item_count: int = 0, line_count: int = 0) -> None:
+        """
+        incrementally update order's denormalized totals, using a single UPDATE statement
+        (total_amount = total_amount + amount, ...), so concurrent changes to the same order can't lose updates.
+
+        if an Order object is given, its in-memory totals are kept in step with the update.
+
+        :param order: Order object OR order's id (int)
+        :param amount: change in total_amount
+        :param item_count: change in item_count (sum of quantities)
+        :param line_count: change in line_count (number of order_items)
+        """
+        order_id = order.pk if isinstance(order, self.model) else order
+        amount = Money.coerce(amount)
+        self.filter(pk=order_id).update(
+            total_amount=F('total_amount') + amount.cents,
+            item_count=F('item_count') + item_count,
+            line_count=F('line_count') + line_count,
+        )
+        if isinstance(order, self.model):
+            order.total_amount += amount
+            order.item_count += item_count
+            order.line_count += line_count
+            identity_map.forget(self.model, pks=[order_id], keep=order)
+        else:
+            identity_map.forget(self.model, pks=[order_id])
+        logger.debug(f"adjusted totals of order #{order_id} by amount= {amount}, "
+                     f"item_count= {item_count}, line_count= {line_count}")
+
+    def recompute_totals(self, order_ids) -> None:
+        """
+        recompute denormalized totals of orders from their order_items, using a single UPDATE statement.
+        for changes of order_items that skip OrderItem.save() / delete(), e.g. cascading deletes
+        :param order_ids: ids of orders
+        """
+        order_ids = list(order_ids)
+        if not order_ids:
+            return
+        from orders.models import OrderItem
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+
+        def total(aggregate):
+            return Coalesce(Subquery(items.annotate(total=aggregate).values('total')), Value(0),
+                            output_field=BigIntegerField())
+        self.filter(pk__in=order_ids).update(total_amount=total(Sum('price')), item_count=total(Sum('quantity')),
+                                             line_count=total(Count('pk')))
+        identity_map.forget(self.model, pks=order_ids)
+        logger.debug(f"recomputed totals of orders {order_ids}")
+
     def update_order(self, order_id, **kwargs):
         try:
             order = self.get(id=order_id)
             for key, value in kwargs.items():
                 setattr(order, key, value)
-                order.save()
-                logger.debug(f"Saved {key}:{value} in order {order_id}")
+            # a single UPDATE of the changed fields (see DirtyFieldsMixin)
+            order.save()
+            logger.debug(f"Saved {kwargs} in order {order_id}")
             return order
         except self.model.DoesNotExist:
             logger.error(f"Order #{order_id} does not exist.")
@@ -40,28 +172,64 @@ class OrderManager(models.Manager):
 
     def delete_order(self, order_id):
         """
-        delete an Order including all order_items in it
+        delete an Order including all order_items in it, returning their quantities to products' stock
         :param order_id: id field of Order object
-        :return:
+        :return: number of orders deleted and a dictionary with the number of deletions per object type,
+        None if something went wrong
+        """
+        result = self.delete_orders([order_id])
+        if result is not None and not result[0]:
+            logger.error(f"Order #{order_id} does not exist.")
+            return None
+        return result
+
+    def delete_orders(self, orders):
+        """
+        cancel many orders at once: delete them including all order_items in them,
+        returning the ordered quantities to products' stock.
+
+        runs in a constant number of queries, regardless of the number of orders and items:
+        stock is restored with a single grouped UPDATE (stock = stock + SUM(quantity) per product),
+        and order_items are deleted with a single DELETE.
+
+        :param orders: list of ids of Order objects, OR an Order queryset
+            (for example, Order.objects.filter(is_paid=False, created_at__lt=...))
+        :return: number of orders deleted and a dictionary with the number of deletions per object type,
+        None if something went wrong
         """
         try:
-            order = self.get(id=order_id)
-            logger.debug(f"Order #{order_id} was retrieved successfully")
+            from orders.models import OrderItem
+            if isinstance(orders, models.QuerySet):
+                orders_to_delete = orders
+            else:
+                orders_to_delete = self.filter(id__in=list(orders))
+            order_items_to_delete = OrderItem.objects.filter(order__in=orders_to_delete.values('pk'))
+
             with transaction.atomic():
-                from orders.models import OrderItem
-                order_items_to_delete = OrderItem.objects.get_all_order_items_from_order(order)
-                logger.debug(f"Got order_items_to_delete: {order_items_to_delete}")
-                if order_items_to_delete is None:
-                    raise Exception(f"Failed getting a list of items to delete, when trying to delete order {order}")
-                # if no order_items were found under order, order_items_to_delete should be an empty list
-                for order_item in order_items_to_delete:
-                    r = OrderItem.objects.delete_order_item(order_item.id)
-                    if not r:
-                        raise Exception(f"Deleting order_item {order_item} with id {order_item.id} failed."
-                                        f"Deleting order {order} with id {order_id} failed.")
-                    logger.debug(f"order item {order_item} was deleted successfully")
-                result = order.delete()
+                returned_quantity = (order_items_to_delete.filter(product_id=OuterRef('pk'))
+                                     .values('product_id')
+                                     .annotate(total=Sum('quantity'))
+                                     .values('total'))
+                restocked = Product.objects.filter(pk__in=order_items_to_delete.values('product_id')).update(
+                    stock=F('stock') + Subquery(returned_quantity))
+                logger.debug(f"returned stock to {restocked} products")
+
+                order_items_to_delete.delete()
+                result = orders_to_delete.delete()
+                # rows changed in bulk: drop all mapped instances of these models
+                for model in (Product, OrderItem, self.model):
+                    identity_map.forget(model)
+                logger.debug(f"deleted orders: {result}")
                 return result
+        except Exception as e:
+            log_level = EXCEPTION_LOG_LEVELS.get(type(e), logging.ERROR)
+            logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
+            return None
+
+    def get_order(self, order_id):
+        try:
+            order = identity_map.lookup(self.model, 'pk', int(order_id), lambda: self.get(id=order_id))
+            return order
         except self.model.DoesNotExist:
             logger.error(f"Order #{order_id} does not exist.")
             return None
@@ -70,9 +238,24 @@ class OrderManager(models.Manager):
             logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
             return None
 
-    def get_order(self, order_id):
+
+    def with_items(self):
+        """
+        :return: queryset of orders, with their order_items and the products of those order_items prefetched
+            (2 extra queries for the whole queryset, no matter how many orders or order_items)
+        """
+        from orders.models import OrderItem
+        return self.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('pk')))
+
+    def get_order_with_items(self, order_id):
+        """
+        get an order for display: with its owner, its order_items and their products,
+        in a fixed number of queries
+        :return: Order object, None if something went wrong
+        """
         try:
-            order = self.get(id=order_id)
+            order = self.with_items().select_related('user').get(id=order_id)
             return order
         except self.model.DoesNotExist:
             logger.error(f"Order #{order_id} does not exist.")
@@ -82,7 +265,6 @@ class OrderManager(models.Manager):
             logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
             return None
 
-
     def get_order_by_user(self, user):
         try:
             orders = self.filter(user=user)
@@ -108,28 +290,31 @@ class OrderItemManager(models.Manager):
         """
         try:
             if isinstance(product, str):
-                product = Product.objects.get(name=product)
+                product = Product.objects.get_cached(name=product)
+            if not isinstance(quantity, int) or quantity < 1:
+                raise ValidationError(f"Quantity must be a positive int, got {quantity!r}")
 
-            updated_stock = product.stock - quantity
             price = product.price * quantity
-            logger.debug(f"Before attempting transaction. price= {price}, updated_stock= {updated_stock}")
+            logger.debug(f"Before attempting transaction. price= {price}, quantity= {quantity}")
 
             with transaction.atomic():
                 '''
-                Two transactions:
-                 1. update product stock
+                Two statements:
+                 1. conditional stock decrement (a single UPDATE, fails if not enough stock)
                  2. create order_item
-                 
-                 transactions are atomic to ensure that order_item is created
+
+                 transaction is atomic to ensure that order_item is created
                  only when product's stock was updated successfully
                 '''
-                # updating product stock
-                updated_product = ProductManager.update_product(self, product, stock=updated_stock)
-                if not updated_product:
-                    raise ValidationError(f'Failed to create new order item with this attributes: '
-                                          f'order= {order}, product= {product}, quantity= {quantity}')
-                # creating order_item
-                return self.create(order=order, product=product, quantity=quantity, price=price)
+                Product.objects.adjust_stock(product, -quantity)
+                # creating order_item. price is computed and quantity checked: skip python-side validation
+                # (a query per foreign key). db constraints still apply
+                order_item = self.model(order=order, product=product, quantity=quantity, price=price)
+                order_item.save(trusted=True)
+                return order_item
+        except Product.DoesNotExist:
+            logger.error(f"Product {product} was not found")
+            return None
         except ValidationError as e:
             logger.error(f"An error occurred: {str(e)}", exc_info=True)
             return None
@@ -141,20 +326,14 @@ class OrderItemManager(models.Manager):
     def update_order_item(self, order_item_id: int, **kwargs) -> Optional['OrderItem']:
         try:
             with transaction.atomic():
-                order_item = self.get(id=order_item_id)
+                order_item = self.select_for_update(of=('self',)).select_related('product').get(id=order_item_id)
                 for key, value in kwargs.items():
                     if key == 'quantity':
-                        old_quantity = order_item.quantity
                         new_quantity = value
-                        change_in_stock = old_quantity - new_quantity
-                        updated_stock = order_item.product.stock + change_in_stock
-                        updated_product = ProductManager.update_product(
-                            self, order_item.product, stock=updated_stock)
-                        if not updated_product:
-                            raise ValidationError(f"Failed to update order item with this attributes: "
-                                                  f"order_item= {order_item}, key= {key}, value= {value}")
-                        updated_product.save()
-                        logger.debug(f"updated product {order_item.product} with new stock: {updated_stock}")
+                        change_in_stock = order_item.quantity - new_quantity
+                        # raises InsufficientStockError (a ValidationError) if there's not enough stock
+                        Product.objects.adjust_stock(order_item.product, change_in_stock)
+                        logger.debug(f"adjusted stock of product {order_item.product} by {change_in_stock}")
                         new_price = new_quantity * order_item.product.price
                         setattr(order_item, 'price', new_price)
                         logger.debug(f"new price for order_item {order_item_id} is {new_price}")
@@ -175,10 +354,18 @@ class OrderItemManager(models.Manager):
             return None
 
     def delete_order_item(self, order_item_id):
+        """
+        delete an order_item, returning its quantity to product's stock
+        :param order_item_id: id field of OrderItem object
+        :return: number of objects deleted and a dictionary with the number of deletions per object type,
+        None if something went wrong
+        """
         try:
-            order_item = self.get(id=order_item_id)
-            result = order_item.delete()
-            return result
+            with transaction.atomic():
+                order_item = self.select_for_update().get(id=order_item_id)
+                Product.objects.adjust_stock(order_item.product_id, order_item.quantity)
+                result = order_item.delete()
+                return result
         except self.model.DoesNotExist:
             logger.error(f"no order_item found for id {order_item_id}")
             return None
@@ -187,9 +374,47 @@ class OrderItemManager(models.Manager):
             logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
             return None
 
+    def delete_order_items(self, order_items):
+        """
+        delete many order_items at once, returning their quantities to products' stock and updating the totals
+        of their orders.
+
+        runs in a constant number of queries, regardless of the number of items: stock is restored with a single
+        UPDATE (see ProductManager.adjust_stock_bulk), order_items are deleted with a single DELETE, and totals of
+        the orders are recomputed with a single UPDATE (see OrderManager.recompute_totals).
+
+        :param order_items: list of ids of OrderItem objects, OR an OrderItem queryset
+        :return: number of objects deleted and a dictionary with the number of deletions per object type,
+        None if something went wrong
+        """
+        try:
+            from orders.models import Order
+            if isinstance(order_items, models.QuerySet):
+                order_items_to_delete = order_items
+            else:
+                order_items_to_delete = self.filter(id__in=list(order_items))
+
+            with transaction.atomic():
+                rows = list(order_items_to_delete.select_for_update().values_list('pk', 'order_id', 'product_id',
+                                                                                 'quantity'))
+                deltas = {}
+                for _, _, product_id, quantity in rows:
+                    deltas[product_id] = deltas.get(product_id, 0) + quantity
+                Product.objects.adjust_stock_bulk(deltas)
+                result = self.filter(pk__in=[pk for pk, _, _, _ in rows]).delete()
+                Order.objects.recompute_totals({order_id for _, order_id, _, _ in rows})
+                identity_map.forget(self.model)
+                logger.debug(f"deleted order_items: {result}")
+                return result
+        except Exception as e:
+            log_level = EXCEPTION_LOG_LEVELS.get(type(e), logging.ERROR)
+            logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
+            return None
+
     def get_order_item(self, order_item_id):
         try:
-            order_item = self.get(id=order_item_id)
+            order_item = identity_map.lookup(self.model, 'pk', int(order_item_id),
+                                             lambda: self.get(id=order_item_id))
             return order_item
         except self.model.DoesNotExist:
             logger.error(f"no order_item found for id {order_item_id}")
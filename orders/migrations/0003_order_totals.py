@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:54
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    items = OrderItem.objects.filter(order_id=OuterRef("pk")).values("order_id")
+    Order.objects.filter(pk__in=OrderItem.objects.values("order_id")).update(
+        total_amount=Subquery(items.annotate(total=Sum("price")).values("total")),
+        item_count=Subquery(items.annotate(total=Sum("quantity")).values("total")),
+        line_count=Subquery(items.annotate(total=Count("pk")).values("total")),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="line_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total_amount",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+import django.core.validators
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0004_order_list_indexes"),
+        ("products", "0005_model_constraints"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="orderitem",
+            name="price",
+            field=models.DecimalField(
+                decimal_places=2,
+                max_digits=10,
+                validators=[django.core.validators.MinValueValidator(0)],
+            ),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="quantity",
+            field=models.PositiveIntegerField(
+                default=1, validators=[django.core.validators.MinValueValidator(1)]
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="order",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("total_amount__gte", 0)),
+                name="order_total_amount_non_negative",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="orderitem",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("quantity__gte", 1)),
+                name="orderitem_quantity_positive",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="orderitem",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("price__gte", 0)),
+                name="orderitem_price_non_negative",
+            ),
+        ),
+    ]
@@ -0,0 +1,87 @@
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+import core.money
+
+
+def to_cents(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    Order.objects.update(total_amount_cents=Cast(Round(F('total_amount') * 100), models.BigIntegerField()))
+    OrderItem.objects.update(price_cents=Cast(Round(F('price') * 100), models.BigIntegerField()))
+
+
+def _from_cents(model, field_name):
+    # in python: integer division in SQL (on SQLite) would drop the cents
+    objects = []
+    for obj in model.objects.only('pk', f'{field_name}_cents').iterator(chunk_size=2000):
+        setattr(obj, field_name, getattr(obj, f'{field_name}_cents').to_decimal())
+        objects.append(obj)
+    model.objects.bulk_update(objects, [field_name], batch_size=2000)
+
+
+def from_cents(apps, schema_editor):
+    _from_cents(apps.get_model('orders', 'Order'), 'total_amount')
+    _from_cents(apps.get_model('orders', 'OrderItem'), 'price')
+
+
+class Migration(migrations.Migration):
+    """
+    Order.total_amount and OrderItem.price: DecimalField -> MoneyField (integer cents).
+    constraints on them are dropped while the columns are replaced, and created again
+    """
+
+    dependencies = [
+        ("orders", "0005_model_constraints"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(model_name="order", name="order_total_amount_non_negative"),
+        migrations.RemoveConstraint(model_name="orderitem", name="orderitem_price_non_negative"),
+        migrations.AddField(
+            model_name="order",
+            name="total_amount_cents",
+            field=core.money.MoneyField(default=0),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="price_cents",
+            field=core.money.MoneyField(default=0),
+        ),
+        # nullable while replaced, so the migration can be reversed (columns are re-added empty, then filled)
+        migrations.AlterField(
+            model_name="order",
+            name="total_amount",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, null=True),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="price",
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True,
+                                      validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunPython(to_cents, from_cents),
+        migrations.RemoveField(model_name="order", name="total_amount"),
+        migrations.RemoveField(model_name="orderitem", name="price"),
+        migrations.RenameField(model_name="order", old_name="total_amount_cents", new_name="total_amount"),
+        migrations.RenameField(model_name="orderitem", old_name="price_cents", new_name="price"),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="price",
+            field=core.money.MoneyField(validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddConstraint(
+            model_name="order",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("total_amount__gte", 0)), name="order_total_amount_non_negative"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="orderitem",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("price__gte", 0)), name="orderitem_price_non_negative"
+            ),
+        ),
+    ]
@@ -1,13 +1,17 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.core.validators import MinValueValidator
 from .managers import OrderManager, OrderItemManager
+from core import identity_map
+from core.models import DirtyFieldsMixin
+from core.money import MoneyField
 from ecommerce.constants import EXCEPTION_LOG_LEVELS
 import logging
 
 logger = logging.getLogger('django')
 
 
-class Order(models.Model):
+class Order(DirtyFieldsMixin, models.Model):
     """
     customer's order
     """
@@ -16,11 +20,31 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True,)
     is_paid = models.BooleanField(default=False)
 
+    # denormalized totals, maintained incrementally by OrderManager.adjust_totals()
+    # (can be recomputed with the repair_order_totals management command)
+    total_amount = MoneyField(default=0)  # in cents, see core/money.py
+    item_count = models.PositiveIntegerField(default=0)  # sum of quantities of all order_items
+    line_count = models.PositiveIntegerField(default=0)  # number of order_items
+
+    TOTALS_FIELDS = ('total_amount', 'item_count', 'line_count')
+    # never overwrite totals with (possibly stale) in-memory values of an existing order
+    untracked_fields = TOTALS_FIELDS
+
     objects = OrderManager()
 
+    class Meta:
+        indexes = [
+            # keyset pagination of order lists, newest first
+            models.Index(fields=['-created_at', '-id'], name='order_created_at_id_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_at_id_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(total_amount__gte=0), name='order_total_amount_non_negative'),
+        ]
+
     def save(self, *args, **kwargs):
         try:
-            self.full_clean()
+            self.validate_for_save(kwargs)
             if not self.pk:  # Check if it's a new instance
                 logger.debug(f'Creating Order: {self}')
             super().save(*args, **kwargs)
@@ -33,28 +57,84 @@ class Order(models.Model):
         return f'Order {self.id} by {self.user}'
 
 
-class OrderItem(models.Model):
+class OrderItem(DirtyFieldsMixin, models.Model):
     """
     individual item on a customer's order
     """
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey('products.Product', on_delete=models.CASCADE)
-    quantity = models.PositiveIntegerField(default=1)
-    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+    price = MoneyField(validators=[MinValueValidator(0)])  # line total (product's price * quantity), in cents
 
     objects = OrderItemManager()
 
+    class Meta:
+        # same invariants as the fields' validators, enforced by the db for writes that skip validation
+        constraints = [
+            models.CheckConstraint(condition=models.Q(quantity__gte=1), name='orderitem_quantity_positive'),
+            models.CheckConstraint(condition=models.Q(price__gte=0), name='orderitem_price_non_negative'),
+        ]
+
+    def _get_saved_values(self):
+        """
+        values stored in db that order's totals depend on (remembered when loaded, see DirtyFieldsMixin),
+        so a save / delete can update the totals by the difference only
+        :return: (order_id, quantity, price) as stored in db, None for a new order_item
+        """
+        if self._state.adding:
+            return None
+        saved_values = tuple(self.get_saved_value(field_name) for field_name in ('order', 'quantity', 'price'))
+        if None in saved_values:
+            # some of the fields were deferred when loaded
+            saved_values = OrderItem.objects.filter(pk=self.pk).values_list('order_id', 'quantity', 'price').first()
+        return saved_values
+
+    def _update_order_totals(self, saved_values, deleted=False):
+        """
+        update totals of the containing order by the difference between saved and current values
+        """
+        # when the Order object is already loaded, pass it to keep its in-memory totals in step.
+        # otherwise pass only its id, to save a query
+        order = self.order if self._meta.get_field('order').is_cached(self) else self.order_id
+
+        if saved_values is not None:
+            old_order_id, old_quantity, old_price = saved_values
+            if deleted or old_order_id != self.order_id:
+                # remove item from the order it was in
+                Order.objects.adjust_totals(old_order_id, -old_price, -old_quantity, -1)
+            else:
+                Order.objects.adjust_totals(order, self.price - old_price, self.quantity - old_quantity, 0)
+        if not deleted and (saved_values is None or saved_values[0] != self.order_id):
+            # add item to the order it is in now
+            Order.objects.adjust_totals(order, self.price, self.quantity, 1)
+
     def save(self, *args, **kwargs):
         try:
-            self.full_clean()
+            self.validate_for_save(kwargs)
             if not self.pk:  # Check if it's a new instance
                 logger.debug(f'Creating OrderItem: {self}')
+            # totals are updated by saved_in_transaction(), in the atomic block of the save
+            self._values_before_save = self._get_saved_values()
             super().save(*args, **kwargs)
         except Exception as e:
             log_level = EXCEPTION_LOG_LEVELS.get(type(e), logging.ERROR)
             logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
             raise
 
+    def saved_in_transaction(self):
+        self._update_order_totals(self._values_before_save)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        with transaction.atomic():
+            saved_values = self._get_saved_values()
+            result = super().delete(*args, **kwargs)
+            if saved_values is not None:
+                self._update_order_totals(saved_values, deleted=True)
+        self._saved_state = {}
+        identity_map.forget(type(self), pks=[pk])
+        return result
+
     def __str__(self):
         return f'{self.quantity} of {self.product.name}'
 
@@ -0,0 +1,25 @@
+from django.db.models.signals import pre_delete, post_delete
+from django.dispatch import receiver
+
+from orders.models import Order, OrderItem
+from products.models import Product
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+# deleting a product deletes its order_items in bulk (cascade), skipping OrderItem.delete():
+# totals of the orders they were in are recomputed
+@receiver(pre_delete, sender=Product)
+def remember_product_orders(sender, instance, **kwargs):
+    instance._order_ids = list(OrderItem.objects.filter(product=instance).values_list('order_id', flat=True)
+                               .distinct())
+
+
+@receiver(post_delete, sender=Product)
+def recompute_product_orders_totals(sender, instance, **kwargs):
+    order_ids = getattr(instance, '_order_ids', None)
+    if order_ids:
+        Order.objects.recompute_totals(order_ids)
+        logger.debug(f"recomputed totals of orders {order_ids}, after product {instance} was deleted")
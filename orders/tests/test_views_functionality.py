@@ -1,11 +1,19 @@
+from datetime import datetime
+from unittest.mock import patch
+
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-import factory
 from orders.models import Order, OrderItem
+from orders.views import OrderListView
 from orders.tests.factories import OrderItemFactory, OrderFactory
-from products.tests.factories import CategoryFactory, ProductFactory, UserFactory
+from core.money import Money
+from products.models import Product
+from products.tests.factories import ProductFactory, UserFactory
 from django.contrib.auth.models import Group
 from ecommerce.management.commands.assign_permissions import Command
 from django.forms.models import model_to_dict
@@ -243,6 +251,67 @@ class OrderItemViewTest(TestCase):
         self.assertRedirects(response, reverse('order-list'))
         self.assertEqual(OrderItem.objects.count(), 0)
 
+    def create_stocked_order_item(self):
+        # through the manager: stock is taken and order's totals are updated
+        product = ProductFactory(price='2.50', stock=10)
+        order_item = OrderItem.objects.create_order_item(self.order, product, 3)
+        return product, order_item
+
+    def test_update_order_item_adjusts_stock_and_totals(self):
+        product, order_item = self.create_stocked_order_item()
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.post(reverse('orderitem-update', args=[order_item.pk]),
+                                    data={'quantity': 5, 'price': '0.01'})
+        self.assertRedirects(response, reverse('order-list'))
+
+        order_item.refresh_from_db()
+        self.assertEqual((order_item.quantity, order_item.price), (5, Money(1250)))
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 5)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.total_amount, order.item_count, order.line_count),
+                         (self.order_item.price + Money(1250), self.order_item.quantity + 5, 2))
+
+    def test_update_order_item_not_enough_stock(self):
+        product, order_item = self.create_stocked_order_item()
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.post(reverse('orderitem-update', args=[order_item.pk]), data={'quantity': 20})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OrderItem.objects.get(pk=order_item.pk).quantity, 3)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 7)
+
+    def test_create_order_item_takes_stock(self):
+        product = ProductFactory(price='2.50', stock=10)
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.post(self.create_url, data={'product': product.pk, 'quantity': 4, 'price': '0.01'})
+        self.assertRedirects(response, reverse('order-list'))
+
+        order_item = OrderItem.objects.get(order=self.order, product=product)
+        self.assertEqual((order_item.quantity, order_item.price), (4, Money(1000)))
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 6)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.total_amount, order.item_count, order.line_count),
+                         (self.order_item.price + Money(1000), self.order_item.quantity + 4, 2))
+
+    def test_create_order_item_not_enough_stock(self):
+        product = ProductFactory(stock=10)
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.post(self.create_url, data={'product': product.pk, 'quantity': 1000})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(OrderItem.objects.filter(product=product).exists())
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 10)
+
+    def test_delete_order_item_returns_stock(self):
+        product, order_item = self.create_stocked_order_item()
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.post(reverse('orderitem-delete', args=[order_item.pk]))
+        self.assertRedirects(response, reverse('order-list'))
+
+        self.assertFalse(OrderItem.objects.filter(pk=order_item.pk).exists())
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 10)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.total_amount, order.item_count, order.line_count),
+                         (self.order_item.price, self.order_item.quantity, 1))
+
     def test_delete_non_existent_order_item(self):
         NON_EXISTENT_ORDER_ITEM_PK = 12345
         self.client.login(username=self.customer_user.username, password='password')
@@ -253,3 +322,200 @@ class OrderItemViewTest(TestCase):
 
         response = self.client.post(delete_url_non_existent)
         self.assertEqual(response.status_code, 403)
+
+
+class OrderCheckoutViewTest(TestCase):
+    def setUp(self):
+        # Set up permissions using assign_permissions script
+        Command().handle()
+
+        customer_group = Group.objects.get(name='customers')
+        self.customer_user = UserFactory(groups=[customer_group])
+        self.product1 = ProductFactory(name='apple', stock=10)
+        self.product2 = ProductFactory(name='banana', stock=10)
+
+        self.checkout_url = reverse('order-checkout')
+
+    def test_checkout_successful(self):
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.get(self.checkout_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'checkout.html')
+
+        response = self.client.post(self.checkout_url, data={
+            'product': ['apple', 'banana', ''], 'quantity': ['2', '3', '1']})
+        order = Order.objects.get(user=self.customer_user)
+        self.assertRedirects(response, reverse('order-detail', args=[order.pk]))
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(Product.objects.get(name='banana').stock, 7)
+
+    def test_checkout_not_enough_stock(self):
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.post(self.checkout_url, data={
+            'product': ['apple', 'banana'], 'quantity': ['2', '30']})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.context['error'])
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Product.objects.get(name='apple').stock, 10)
+
+    def test_checkout_invalid_quantity(self):
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.post(self.checkout_url, data={'product': ['apple'], 'quantity': ['many']})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.context['error'])
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class OrderListViewTest(TestCase):
+    def setUp(self):
+        # Set up permissions using assign_permissions script
+        Command().handle()
+
+        self.customer_user = UserFactory(groups=[Group.objects.get(name='customers')])
+        self.other_customer_user = UserFactory(groups=[Group.objects.get(name='customers')])
+        self.shift_manager_user = UserFactory(groups=[Group.objects.get(name='shift_manager')])
+
+        # 7 orders, one per day. newest order is the last one
+        self.orders = []
+        for day in range(1, 8):
+            order = OrderFactory(user=self.customer_user, is_paid=(day % 2 == 0))
+            Order.objects.filter(pk=order.pk).update(
+                created_at=timezone.make_aware(datetime(2024, 1, day, 12, 0)))
+            self.orders.append(order)
+        self.other_customer_order = OrderFactory(user=self.other_customer_user)
+
+        self.list_url = reverse('order-list')
+
+    def get_order_ids(self, response):
+        return [order.id for order in response.context['orders']]
+
+    def test_keyset_pagination(self):
+        self.client.login(username=self.customer_user.username, password='password')
+        with patch.object(OrderListView, 'page_size', 3):
+            first_page = self.client.get(self.list_url)
+            self.assertEqual(self.get_order_ids(first_page), [order.id for order in self.orders[6:3:-1]])
+            self.assertIsNone(first_page.context['previous_page_url'])
+
+            second_page = self.client.get(self.list_url + first_page.context['next_page_url'])
+            self.assertEqual(self.get_order_ids(second_page), [order.id for order in self.orders[3:0:-1]])
+
+            last_page = self.client.get(self.list_url + second_page.context['next_page_url'])
+            self.assertEqual(self.get_order_ids(last_page), [self.orders[0].id])
+            self.assertIsNone(last_page.context['next_page_url'])
+
+            # back to the second page
+            previous_page = self.client.get(self.list_url + last_page.context['previous_page_url'])
+            self.assertEqual(self.get_order_ids(previous_page), self.get_order_ids(second_page))
+
+    def test_customer_sees_only_own_orders(self):
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.get(self.list_url)
+        self.assertNotIn(self.other_customer_order.id, self.get_order_ids(response))
+        self.assertEqual(len(response.context['orders']), 7)
+
+    def test_filters(self):
+        self.client.login(username=self.shift_manager_user.username, password='password')
+        response = self.client.get(self.list_url, {'is_paid': 'True', 'created_from': '2024-01-03',
+                                                   'created_to': '2024-01-06',
+                                                   'customer': self.customer_user.username})
+        self.assertEqual(self.get_order_ids(response), [self.orders[5].id, self.orders[3].id])
+
+    def test_invalid_filters_and_cursor_are_ignored(self):
+        self.client.login(username=self.shift_manager_user.username, password='password')
+        response = self.client.get(self.list_url, {'is_paid': 15, 'created_from': '2024-13-45',
+                                                   'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['orders']), 8)
+
+    def test_shift_manager_list_queries(self):
+        """
+        customers of listed orders are loaded with the orders, not with a query per row
+        """
+        self.client.force_login(self.shift_manager_user)
+        self.client.get(self.list_url)  # warm up session
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url)
+        self.assertContains(response, self.other_customer_user.username)
+        OrderFactory(user=UserFactory())
+        with CaptureQueriesContext(connection) as more_customers_queries:
+            self.client.get(self.list_url)
+        self.assertEqual(len(queries), len(more_customers_queries))
+
+
+class OrderDetailViewTest(TestCase):
+    def setUp(self):
+        # Set up permissions using assign_permissions script
+        Command().handle()
+
+        self.customer_user = UserFactory(groups=[Group.objects.get(name='customers')])
+        self.order = OrderFactory(user=self.customer_user)
+        self.detail_url = reverse('order-detail', args=[self.order.pk])
+
+    def test_order_detail_shows_items_and_total(self):
+        order_item = OrderItemFactory(order=self.order, product__name='apple', quantity=2, price=30)
+        OrderItemFactory(order=self.order, product__name='banana', quantity=1, price=12)
+        self.client.login(username=self.customer_user.username, password='password')
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, order_item.product.name)
+        self.assertContains(response, '$42')
+
+    def test_order_detail_constant_queries(self):
+        """
+        number of queries does not grow with the number of lines in the order
+        """
+        self.client.force_login(self.customer_user)
+        OrderItemFactory(order=self.order, product__name='product0')
+        self.client.get(self.detail_url)  # warm up session
+        with CaptureQueriesContext(connection) as one_line:
+            self.client.get(self.detail_url)
+
+        for i in range(1, 6):
+            OrderItemFactory(order=self.order, product__name=f'product{i}')
+        with CaptureQueriesContext(connection) as many_lines:
+            response = self.client.get(self.detail_url)
+        self.assertEqual(len(response.context['order'].items.all()), 6)
+        self.assertEqual(len(one_line), len(many_lines))
+
+
+class OwnershipScopingTest(TestCase):
+    """
+    customers' ownership is enforced by the query loading the object
+    """
+    def setUp(self):
+        Command().handle()
+        customers = Group.objects.get(name='customers')
+        self.customer_user = UserFactory(groups=[customers])
+        self.other_customer = UserFactory(groups=[customers])
+        self.order_item = OrderItemFactory(order=OrderFactory(user=self.customer_user), product__name='apple')
+        self.client.force_login(self.customer_user)
+
+    def get_object_queries(self, url):
+        """
+        :return: response, and the queries of the request on orders' tables or groups (after a warm up request)
+        """
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [query['sql'] for query in queries
+                          if 'orders_' in query['sql'] or 'auth_group' in query['sql']]
+
+    def test_order_item_pages_single_query(self):
+        for url_name in ('orderitem-detail', 'orderitem-update', 'orderitem-delete'):
+            response, queries = self.get_object_queries(reverse(url_name, args=[self.order_item.pk]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(queries), 1, url_name)
+
+    def test_order_pages_single_query(self):
+        for url_name in ('order-update', 'order-delete'):
+            response, queries = self.get_object_queries(reverse(url_name, args=[self.order_item.order.pk]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(queries), 1, url_name)
+
+    def test_other_customers_objects_not_found(self):
+        self.client.force_login(self.other_customer)
+        for url_name in ('orderitem-detail', 'orderitem-update', 'orderitem-delete'):
+            response = self.client.get(reverse(url_name, args=[self.order_item.pk]))
+            self.assertEqual(response.status_code, 403)  # not found, shown as access denied by middleware
+        for url_name in ('order-detail', 'order-update', 'order-delete', 'orderitem-create'):
+            response = self.client.get(reverse(url_name, args=[self.order_item.order.pk]))
+            self.assertEqual(response.status_code, 403)  # not found, shown as access denied by middleware
@@ -58,6 +58,8 @@ class BaseOrderTestData(TestCase):
         cls.order_customer2_data__for_update = {**cls.order_customer2_data, 'is_paid': True}
 
         cls.order_customer1_order_item_data = model_to_dict(cls.order_customer1_order_item)
+        # creating takes the quantity from stock: one at a time, so every allowed user's post is in stock
+        cls.order_customer1_order_item_data__for_create = {**cls.order_customer1_order_item_data, 'quantity': 1}
         cls.order_customer1_order_item_data__for_update = {**cls.order_customer1_order_item_data, 'quantity': cls.order_customer1_order_item_data['quantity'] + 1}
         cls.order_customer2_order_item_data = model_to_dict(cls.order_customer2_order_item)
         cls.order_customer2_order_item_data__for_update = {**cls.order_customer2_order_item_data, 'quantity': cls.order_customer2_order_item_data['quantity'] + 1}
@@ -241,10 +243,10 @@ class OrderItemViewPermissionTest(BaseOrderTestData):
             {'user': self.shift_manager_user, 'expected_status': 200, 'method': 'get', 'data':None},
             {'user': self.staff_user, 'expected_status': 403, 'method': 'get', 'data':None},
 
-            {'user': self.customer1_user, 'expected_status': 302, 'method': 'post', 'data': self.order_customer1_order_item_data},
-            {'user': self.customer2_user, 'expected_status': 403, 'method': 'post', 'data': self.order_customer1_order_item_data},
-            {'user': self.shift_manager_user, 'expected_status': 302, 'method': 'post', 'data': self.order_customer1_order_item_data},
-            {'user': self.stock_personnel_user, 'expected_status': 403, 'method': 'post', 'data': self.order_customer1_order_item_data},
+            {'user': self.customer1_user, 'expected_status': 302, 'method': 'post', 'data': self.order_customer1_order_item_data__for_create},
+            {'user': self.customer2_user, 'expected_status': 403, 'method': 'post', 'data': self.order_customer1_order_item_data__for_create},
+            {'user': self.shift_manager_user, 'expected_status': 302, 'method': 'post', 'data': self.order_customer1_order_item_data__for_create},
+            {'user': self.stock_personnel_user, 'expected_status': 403, 'method': 'post', 'data': self.order_customer1_order_item_data__for_create},
             {'user': self.staff_user, 'expected_status': 403, 'method': 'post',
              'data': {'product': 1, 'quantity': 2, 'price': 10}},
         ]
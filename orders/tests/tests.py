@@ -4,6 +4,9 @@ from users.models import User
 from products.models import Category, Product
 from ecommerce.utils import compare_model_instances
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from core.identity_map import identity_map_scope
 
 
 class OrderManagerTest(TestCase):
@@ -132,10 +135,60 @@ class OrderItemManagerTest(TestCase):
         order_item = OrderItem.objects.get_order_item(order_item_id)
         self.assertIsNone(order_item)
 
+    def test_create_order_item_by_product_name(self):
+        order_item = OrderItem.objects.create_order_item(self.order, 'thingy', 2)
+        self.assertIsNotNone(order_item)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+
+    def test_create_order_item_by_product_name_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get_cached(name='thingy')
+        with CaptureQueriesContext(connection) as queries:
+            order_item = OrderItem.objects.create_order_item(self.order, 'thingy', 2)
+        self.assertEqual(order_item.price, 200)
+        # product is not selected: its price comes from the object cache, and stock is updated in db
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "products_product"')])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+
+    def test_create_order_item_not_enough_stock(self):
+        order_item = OrderItem.objects.create_order_item(self.order, self.product, 100)
+        self.assertIsNone(order_item)
+        # stock stays the same, no order_item was created
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_create_order_item_nonexistent_product(self):
+        order_item = OrderItem.objects.create_order_item(self.order, 'Nonexistent', 1)
+        self.assertIsNone(order_item)
+        self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_create_order_item_stale_product_object(self):
+        """
+        stock is decremented in the db, not computed from a stale in-memory product
+        """
+        stale_product = Product.objects.get(id=self.product.id)
+        OrderItem.objects.create_order_item(self.order, self.product, 2)
+        order_item = OrderItem.objects.create_order_item(self.order, stale_product, 1)
+        self.assertIsNotNone(order_item)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+    def test_update_order_item_decrease_quantity(self):
+        OrderItem.objects.update_order_item(self.order_item.id, quantity=3)
+        OrderItem.objects.update_order_item(self.order_item.id, quantity=1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
     def test_delete_order_item(self):
         result = OrderItem.objects.delete_order_item(self.order_item.id)
         self.assertIsNotNone(result)
         self.assertEqual(result, (1, {'orders.OrderItem': 1}))
+        # quantity was returned to product's stock
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 4)
 
     def test_delete_nonexistent_order_item(self):
         order_item_id = 5
@@ -189,6 +242,46 @@ class OrderIntegrationTests(TestCase):
         self.assertIsNotNone(result)
         self.assertEqual(result, (1, {'orders.Order': 1}))
 
+    def test_delete_order_returns_stock(self):
+        result = Order.objects.delete_order(self.order.id)
+        self.assertEqual(result, (1, {'orders.Order': 1}))
+        self.assertEqual(OrderItem.objects.count(), 0)
+        self.assertEqual(Product.objects.get(name='thingyM').stock, 4)
+        self.assertEqual(Product.objects.get(name='thingyL').stock, 8)
+        self.assertEqual(Product.objects.get(name='thingyS').stock, 20)
+
+    def test_delete_orders(self):
+        order2 = Order.objects.create_order_with_items(self.user, [('thingyM', 2), ('thingyS', 5)])
+        untouched_order = Order.objects.create_order_with_items(self.user, [('thingyS', 1)])
+
+        result = Order.objects.delete_orders([self.order.id, order2.id])
+        self.assertEqual(result, (2, {'orders.Order': 2}))
+        self.assertEqual(list(Order.objects.all()), [untouched_order])
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.assertEqual(Product.objects.get(name='thingyM').stock, 4)
+        self.assertEqual(Product.objects.get(name='thingyL').stock, 8)
+        self.assertEqual(Product.objects.get(name='thingyS').stock, 19)
+
+    def test_delete_orders_by_queryset(self):
+        Order.objects.create_order_with_items(self.user, [('thingyM', 1)], is_paid=True)
+        result = Order.objects.delete_orders(Order.objects.filter(is_paid=False))
+        self.assertEqual(result, (1, {'orders.Order': 1}))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(name='thingyM').stock, 3)
+
+    def test_delete_orders_constant_queries(self):
+        """
+        number of queries does not grow with the number of orders and items
+        """
+        orders = [Order.objects.create_order_with_items(self.user, [('thingyS', 1), ('thingyL', 1)])
+                  for _ in range(4)]
+        with CaptureQueriesContext(connection) as one_order:
+            Order.objects.delete_orders([self.order.id])
+        with CaptureQueriesContext(connection) as many_orders:
+            Order.objects.delete_orders([order.id for order in orders])
+        self.assertEqual(len(one_order), len(many_orders))
+        self.assertEqual(Product.objects.get(name='thingyS').stock, 20)
+
     def test_combine_two_order_items_of_the_same_product(self):
         # create new order_item with quantity 2
         # create new order_item (of the same product) with quantity 5
@@ -197,3 +290,208 @@ class OrderIntegrationTests(TestCase):
         pass
 
 
+
+
+class OrderWithItemsManagerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='shani',
+            email='shani@example.com',
+            password='abc12345')
+        self.category = Category.objects.create_category('Stuff', 'Stuff things')
+        self.products = [
+            Product.objects.create_product(f'thingy{i}', 'some thingy', 10 * (i + 1), self.category, 5)
+            for i in range(6)
+        ]
+
+    def test_create_order_with_items(self):
+        order = Order.objects.create_order_with_items(
+            self.user, [(self.products[0].id, 2), ('thingy1', 3)])
+        self.assertIsNotNone(order)
+        self.assertEqual(order.items.count(), 2)
+
+        order_item = order.items.get(product=self.products[1])
+        self.assertEqual(order_item.quantity, 3)
+        self.assertEqual(order_item.price, 60)
+
+        self.products[0].refresh_from_db()
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 3)
+        self.assertEqual(self.products[1].stock, 2)
+
+    def test_create_order_with_items_combines_same_product(self):
+        order = Order.objects.create_order_with_items(
+            self.user, [('thingy0', 2), (self.products[0].id, 1), ('thingy0', 1)])
+        self.assertIsNotNone(order)
+        self.assertEqual(order.items.count(), 1)
+        self.assertEqual(order.items.get().quantity, 4)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 1)
+
+    def test_create_order_with_items_not_enough_stock(self):
+        order = Order.objects.create_order_with_items(self.user, [('thingy0', 1), ('thingy1', 6)])
+        self.assertIsNone(order)
+        # nothing was changed
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(OrderItem.objects.count(), 0)
+        self.assertEqual(Product.objects.get(name='thingy0').stock, 5)
+
+    def test_create_order_with_items_nonexistent_product(self):
+        order = Order.objects.create_order_with_items(self.user, [('thingy0', 1), ('Nonexistent', 1)])
+        self.assertIsNone(order)
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(Product.objects.get(name='thingy0').stock, 5)
+
+    def test_create_order_with_items_invalid_quantity(self):
+        self.assertIsNone(Order.objects.create_order_with_items(self.user, [('thingy0', 0)]))
+        self.assertIsNone(Order.objects.create_order_with_items(self.user, []))
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_create_order_with_items_constant_queries(self):
+        """
+        number of queries does not grow with the number of lines in the basket
+        """
+        with CaptureQueriesContext(connection) as small_basket:
+            Order.objects.create_order_with_items(self.user, [('thingy0', 1)])
+        with CaptureQueriesContext(connection) as large_basket:
+            Order.objects.create_order_with_items(
+                self.user, [(product.name, 1) for product in self.products])
+        self.assertEqual(len(small_basket), len(large_basket))
+
+
+class OrderTotalsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='shani',
+            email='shani@example.com',
+            password='abc12345')
+        self.order = Order.objects.create_order(user=self.user)
+        self.category = Category.objects.create_category('Stuff', 'Stuff things')
+        self.product = Product.objects.create_product('thingyM', 'medium size thingy', 100, self.category, 10)
+        self.product2 = Product.objects.create_product('thingyS', 'small size thingy', 50, self.category, 10)
+
+    def assertTotals(self, order, total_amount, item_count, line_count):
+        order.refresh_from_db()
+        self.assertEqual((order.total_amount, order.item_count, order.line_count),
+                         (total_amount, item_count, line_count))
+
+    def test_create_order_item_updates_totals(self):
+        OrderItem.objects.create_order_item(self.order, self.product, 2)
+        OrderItem.objects.create_order_item(self.order, 'thingyS', 1)
+        # in-memory order is kept in step
+        self.assertEqual(self.order.total_amount, 250)
+        self.assertTotals(self.order, 250, 3, 2)
+
+    def test_update_order_item_updates_totals(self):
+        order_item = OrderItem.objects.create_order_item(self.order, self.product, 2)
+        OrderItem.objects.create_order_item(self.order, self.product2, 1)
+        OrderItem.objects.update_order_item(order_item.id, quantity=5)
+        self.assertTotals(self.order, 550, 6, 2)
+
+    def test_delete_order_item_updates_totals(self):
+        order_item = OrderItem.objects.create_order_item(self.order, self.product, 2)
+        OrderItem.objects.create_order_item(self.order, self.product2, 1)
+        OrderItem.objects.delete_order_item(order_item.id)
+        self.assertTotals(self.order, 50, 1, 1)
+
+    def test_delete_order_items_updates_totals_and_stock(self):
+        order2 = Order.objects.create_order(user=self.user)
+        item1 = OrderItem.objects.create_order_item(self.order, self.product, 2)
+        OrderItem.objects.create_order_item(self.order, self.product2, 1)
+        item3 = OrderItem.objects.create_order_item(order2, self.product, 3)
+        # lock, stock, delete and totals, in a savepoint (and a savepoint of adjust_stock_bulk)
+        with self.assertNumQueries(8):
+            OrderItem.objects.delete_order_items(OrderItem.objects.filter(pk__in=[item1.pk, item3.pk]))
+        self.assertTotals(self.order, 50, 1, 1)
+        self.assertTotals(order2, 0, 0, 0)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+        self.assertEqual(Product.objects.get(pk=self.product2.pk).stock, 9)
+
+    def test_delete_product_updates_totals(self):
+        order2 = Order.objects.create_order(user=self.user)
+        OrderItem.objects.create_order_item(self.order, self.product, 2)
+        OrderItem.objects.create_order_item(self.order, self.product2, 1)
+        OrderItem.objects.create_order_item(order2, self.product, 1)
+        # its order_items are deleted by cascade
+        self.product.delete()
+        self.assertTotals(self.order, 50, 1, 1)
+        self.assertTotals(order2, 0, 0, 0)
+
+    def test_move_order_item_between_orders(self):
+        order2 = Order.objects.create_order(user=self.user)
+        order_item = OrderItem.objects.create_order_item(self.order, self.product, 2)
+        order_item.order = order2
+        order_item.save()
+        self.assertTotals(self.order, 0, 0, 0)
+        self.assertTotals(order2, 200, 2, 1)
+
+    def test_create_order_with_items_sets_totals(self):
+        order = Order.objects.create_order_with_items(self.user, [('thingyM', 1), ('thingyS', 3)])
+        self.assertTotals(order, 250, 4, 2)
+
+    def test_saving_stale_order_keeps_totals(self):
+        stale_order = Order.objects.get(id=self.order.id)
+        OrderItem.objects.create_order_item(self.order, self.product, 2)
+        Order.objects.update_order(stale_order.id, is_paid=True)
+        stale_order.save()
+        self.assertTotals(self.order, 200, 2, 1)
+
+    def test_create_order_item_skips_validation_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            OrderItem.objects.create_order_item(self.order, self.product, 2)
+        # no query checking that the order and the product exist
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT')])
+        # stock, insert and totals. a savepoint of create_order_item (as TestCase runs in a transaction), and one
+        # of the save: not one more around the totals
+        self.assertEqual(len(queries), 7)
+
+    def test_create_order_item_invalid_quantity(self):
+        self.assertIsNone(OrderItem.objects.create_order_item(self.order, self.product, 0))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+    def test_update_order_writes_changed_fields_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            Order.objects.update_order(self.order.id, is_paid=True, user=self.user)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "orders_order"')]
+        self.assertEqual(len(updates), 1)
+        # lookup and the UPDATE, in a savepoint (TestCase runs in a transaction)
+        self.assertEqual(len(queries), 4)
+        self.assertIn('"is_paid"', updates[0])
+        self.assertIn('"updated_at"', updates[0])  # auto_now field is written with every change
+        self.assertNotIn('"user_id"', updates[0])
+        self.assertNotIn('"total_amount"', updates[0])
+
+
+class OrderIdentityMapTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.category = Category.objects.create(name='Fruit')
+        self.product = Product.objects.create(name='apple', price=3, category=self.category, stock=10)
+        self.order = Order.objects.create(user=self.user)
+        self.order_item = OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price=6)
+
+    def test_repeated_lookups_reuse_instance(self):
+        with identity_map_scope():
+            order = Order.objects.get_order(self.order.pk)
+            order_item = OrderItem.objects.get_order_item(self.order_item.pk)
+            with self.assertNumQueries(0):
+                self.assertIs(Order.objects.get_order(self.order.pk), order)
+                self.assertIs(Order.objects.get_order(str(self.order.pk)), order)
+                self.assertIs(OrderItem.objects.get_order_item(self.order_item.pk), order_item)
+
+    def test_order_totals_stay_current(self):
+        with identity_map_scope():
+            order = Order.objects.get_order(self.order.pk)
+            OrderItem.objects.create(order_id=self.order.pk, product=self.product, quantity=1, price=3)
+            self.assertEqual(Order.objects.get_order(self.order.pk).total_amount, order.total_amount + 3)
+
+    def test_deleted_objects_are_forgotten(self):
+        with identity_map_scope():
+            OrderItem.objects.get_order_item(self.order_item.pk)
+            OrderItem.objects.delete_order_item(self.order_item.pk)
+            self.assertIsNone(OrderItem.objects.get_order_item(self.order_item.pk))
+
+            Order.objects.get_order(self.order.pk)
+            Order.objects.delete_order(self.order.pk)
+            self.assertIsNone(Order.objects.get_order(self.order.pk))
@@ -5,6 +5,7 @@ from .views import (
     OrderCreateView,
     OrderUpdateView,
     OrderDeleteView,
+    OrderCheckoutView,
     # OrderItemListView,
     OrderItemDetailView,
     OrderItemCreateView,
@@ -16,6 +17,7 @@ urlpatterns = [
     # Order URLs
     path('orders/', OrderListView.as_view(), name='order-list'),
     path('orders/create/', OrderCreateView.as_view(), name='order-create'),
+    path('orders/checkout/', OrderCheckoutView.as_view(), name='order-checkout'),
     path('orders/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
     path('orders/<int:pk>/update/', OrderUpdateView.as_view(), name='order-update'),
     path('orders/<int:pk>/delete/', OrderDeleteView.as_view(), name='order-delete'),
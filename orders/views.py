@@ -1,35 +1,85 @@
-from django.shortcuts import get_object_or_404
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
+from datetime import datetime, time, timedelta
+
+from django.shortcuts import get_object_or_404, redirect
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
 from django.core.exceptions import ValidationError
 from django.urls import reverse_lazy
-from products.models import Product
+from django.http import Http404, HttpResponseRedirect
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from .models import Order, OrderItem
-from core.mixins import GroupRequiredMixin, OwnershipRequiredMixin
+from core.mixins import GroupRequiredMixin, OwnershipRequiredMixin, KeysetPaginationMixin
 from ecommerce.utils import validate_raw_bool_value
+from users.groups import get_user_groups
 
 def is_shift_manager(user):
-    return user.groups.filter(name='shift_manager').exists()
+    return 'shift_manager' in get_user_groups(user)
 
 ''' Order views'''
 
-class OrderListView(GroupRequiredMixin, ListView):
+class OrderListView(GroupRequiredMixin, KeysetPaginationMixin, ListView):
     model = Order
     template_name = 'order_list.html'
     context_object_name = 'orders'
     allowed_groups = ['staff', 'shift_manager', 'customers']
+    # newest orders first
+    keyset_ordering = ('-created_at', '-id')
+    page_size = 50
 
     def get_queryset(self):
-        if is_shift_manager(self.request.user):
+        self.all_orders = is_shift_manager(self.request.user)
+        if self.all_orders:
             # Shift managers have access to all orders
-            return Order.objects.all()
-        # Customers have access only to their orders
-        return Order.objects.filter(user=self.request.user)
+            queryset = Order.objects.select_related('user')
+            customer = self.request.GET.get('customer')
+            if customer:
+                queryset = queryset.filter(user__username=customer)
+        else:
+            # Customers have access only to their orders
+            queryset = Order.objects.filter(user=self.request.user).select_related('user')
+        return self.filter_queryset(queryset)
+
+    def filter_queryset(self, queryset):
+        """
+        filters from query string: is_paid (True / False), created_from and created_to (YYYY-MM-DD, inclusive)
+        invalid values are ignored
+        """
+        is_paid = self.request.GET.get('is_paid')
+        if validate_raw_bool_value(is_paid):
+            queryset = queryset.filter(is_paid=(is_paid == 'True'))
+
+        # compare created_at with datetimes (and not its date), so an index on created_at can be used
+        created_from = self.get_date_param('created_from')
+        if created_from:
+            queryset = queryset.filter(created_at__gte=self.start_of_day(created_from))
+        created_to = self.get_date_param('created_to')
+        if created_to:
+            queryset = queryset.filter(created_at__lt=self.start_of_day(created_to + timedelta(days=1)))
+        return queryset
+
+    def get_date_param(self, name):
+        try:
+            return parse_date(self.request.GET.get(name) or '')
+        except ValueError:
+            return None
+
+    @staticmethod
+    def start_of_day(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['all_orders'] = self.all_orders
+        context['filters'] = self.request.GET
+        return context
 
 
 class OrderDetailView(GroupRequiredMixin, OwnershipRequiredMixin, DetailView):
     model = Order
     template_name = 'order_detail.html'
     allowed_groups = ['staff', 'shift_manager', 'customers']
+    # order, its items and their products, in a fixed number of queries
+    queryset = Order.objects.with_items().select_related('user')
 
 
 class OrderCreateView(GroupRequiredMixin, CreateView):
@@ -70,39 +120,84 @@ class OrderDeleteView(GroupRequiredMixin, OwnershipRequiredMixin, DeleteView):
     success_url = reverse_lazy('order-list')
     allowed_groups = ['customers', 'shift_manager']
 
+    def form_valid(self, form):
+        # delete through the manager, so ordered quantities are returned to stock
+        success_url = self.get_success_url()
+        if Order.objects.delete_order(self.object.pk) is None:
+            raise Http404("Order could not be deleted")
+        return HttpResponseRedirect(success_url)
+
+
+class OrderCheckoutView(GroupRequiredMixin, TemplateView):
+    """
+    one-shot checkout: create an order with all of its items (the whole basket) in one request
+    """
+    template_name = 'checkout.html'
+    allowed_groups = ['customers', 'shift_manager']
+    basket_rows = 5  # number of product rows shown in the form
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['rows'] = range(self.basket_rows)
+        context.setdefault('success', None)
+        context.setdefault('error', None)
+        return context
+
+    def get_items(self):
+        """
+        :return: list of (product name, quantity) pairs from POST data. empty rows are skipped
+        :raises ValueError: quantity is not an int
+        """
+        products = self.request.POST.getlist('product')
+        quantities = self.request.POST.getlist('quantity')
+        return [(product.strip(), int(quantity))
+                for product, quantity in zip(products, quantities) if product.strip()]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            items = self.get_items()
+        except ValueError:
+            return self.render_to_response(self.get_context_data(error="Quantity must be a whole number"))
+
+        new_order = Order.objects.create_order_with_items(user=request.user, items=items)
+        if new_order is None:
+            return self.render_to_response(self.get_context_data(
+                error="Could not place the order. Check product names and available stock"))
+        return redirect('order-detail', pk=new_order.pk)
+
 
 ''' OrderItem views'''
 
 class OrderItemCreateView(OwnershipRequiredMixin, GroupRequiredMixin, CreateView):
     model = OrderItem
-    fields = ['product', 'quantity', 'price']
+    # price is the product's price * quantity, computed by the manager
+    fields = ['product', 'quantity']
     template_name = 'create_order_item.html'
     success_url = reverse_lazy('order-list')
     allowed_groups = ['customers', 'shift_manager']
 
     def get_order(self):
-        obj = Order.objects.get_order(self.kwargs['pk'])
-        return obj
-
-    def get_object_owner(self, **kwargs):
         """
         special case: check ownership not on associated model
             (check ownership on Order, since OrderItem was not created yet)
-        override OwnershipRequiredMixin method
         """
-        obj = self.get_order()
-        obj_owner = obj.user
-        return obj_owner
+        if not hasattr(self, '_order'):
+            orders = self.scope_to_owner(Order.objects.all(), owner_field='user')
+            self._order = get_object_or_404(orders, pk=self.kwargs['pk'])
+        return self._order
 
     def form_valid(self, form):
-        # Associate the order item with the order instance before saving
-        form.instance.order = self.get_order()
-        return super().form_valid(form)
+        # create through the manager, so the quantity is taken from stock (or the item isn't created)
+        self.object = OrderItem.objects.create_order_item(
+            self.get_order(), form.cleaned_data['product'], form.cleaned_data['quantity'])
+        if self.object is None:
+            form.add_error('quantity', "Not enough stock")
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['order'] = self.get_order()  # Pass the order to the template if needed
-        context['products'] = Product.objects.all()
         context['success'] = None
         context['error'] = None
 
@@ -111,10 +206,23 @@ class OrderItemCreateView(OwnershipRequiredMixin, GroupRequiredMixin, CreateView
 
 class OrderItemUpdateView(GroupRequiredMixin, OwnershipRequiredMixin, UpdateView):
     model = OrderItem
-    fields = ['quantity', 'price']
+    # price is the product's price * quantity, computed by the manager
+    fields = ['quantity']
     template_name = 'update_order_item.html'
     success_url = reverse_lazy('order-list')
     allowed_groups = ['customers', 'shift_manager']
+    owner_field = 'order__user'
+
+    def form_valid(self, form):
+        # update through the manager, so the change in quantity is taken from / returned to stock
+        try:
+            order_item = OrderItem.objects.update_order_item(self.object.pk, quantity=form.cleaned_data['quantity'])
+        except ValidationError as e:
+            form.add_error('quantity', e)
+            return self.form_invalid(form)
+        if order_item is None:
+            raise Http404("Order item could not be updated")
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class OrderItemDeleteView(GroupRequiredMixin, OwnershipRequiredMixin, DeleteView):
@@ -122,10 +230,21 @@ class OrderItemDeleteView(GroupRequiredMixin, OwnershipRequiredMixin, DeleteView
     template_name = 'delete_order_item.html'
     success_url = reverse_lazy('order-list')
     allowed_groups = ['customers', 'shift_manager']
+    owner_field = 'order__user'
+    queryset = OrderItem.objects.select_related('product')
+
+    def form_valid(self, form):
+        # delete through the manager, so the ordered quantity is returned to stock
+        success_url = self.get_success_url()
+        if OrderItem.objects.delete_order_item(self.object.pk) is None:
+            raise Http404("Order item could not be deleted")
+        return HttpResponseRedirect(success_url)
 
 
 class OrderItemDetailView(GroupRequiredMixin, OwnershipRequiredMixin, DetailView):
     model = OrderItem
     template_name = 'order_item_detail.html'
     allowed_groups = ['staff', 'shift_manager', 'customers']
+    owner_field = 'order__user'
+    queryset = OrderItem.objects.select_related('order', 'product')
 
@@ -0,0 +1,116 @@
+"""
+prefix autocomplete over product names
+
+a compact, in-memory sorted index of (lowercase name, name, id), searched with binary search:
+a lookup costs O(log n + number of results), with no database query.
+
+the index is built lazily from the db on first use, and then updated incrementally
+by signals on Product (see products/signals.py).
+"""
+import bisect
+import threading
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+class ProductNameIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None  # sorted list of (lowercase name, name, id). None until built
+        self._keys_by_id = {}  # id -> its entry, to find the entry of a renamed / deleted product
+
+    @staticmethod
+    def _entry(product_id, name):
+        return name.lower(), name, product_id
+
+    def _build(self):
+        from products.models import Product
+        entries = [self._entry(product_id, name)
+                   for product_id, name in Product.objects.values_list('id', 'name').iterator()]
+        entries.sort()
+        self._entries = entries
+        self._keys_by_id = {entry[2]: entry for entry in entries}
+        logger.debug(f"built product name index with {len(entries)} products")
+
+    def _ensure_built(self):
+        if self._entries is None:
+            self._build()
+
+    def _remove_locked(self, product_id):
+        entry = self._keys_by_id.pop(product_id, None)
+        if entry is not None:
+            i = bisect.bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def update(self, product_id, name):
+        """
+        add a product to the index, or rename it
+        """
+        with self._lock:
+            if self._entries is None:
+                # not built yet: will be loaded from db (including this product) on first lookup
+                return
+            self._remove_locked(product_id)
+            entry = self._entry(product_id, name)
+            bisect.insort(self._entries, entry)
+            self._keys_by_id[product_id] = entry
+
+    def remove(self, product_id):
+        with self._lock:
+            if self._entries is not None:
+                self._remove_locked(product_id)
+
+    def refresh(self, product_ids):
+        """
+        re-read names of products from db (changed by another process): renamed, added or deleted
+        """
+        from products.models import Product
+        with self._lock:
+            if self._entries is None:
+                return
+        names = dict(Product.objects.filter(pk__in=product_ids).values_list('id', 'name'))
+        with self._lock:
+            if self._entries is None:
+                return
+            for product_id in product_ids:
+                self._remove_locked(product_id)
+                if product_id in names:
+                    entry = self._entry(product_id, names[product_id])
+                    bisect.insort(self._entries, entry)
+                    self._keys_by_id[product_id] = entry
+
+    def clear(self):
+        """
+        drop the index. it will be rebuilt from db on next lookup
+        """
+        with self._lock:
+            self._entries = None
+            self._keys_by_id = {}
+
+    def lookup(self, prefix, limit=10):
+        """
+        :param prefix: beginning of product's name (case insensitive)
+        :param limit: max number of results
+        :return: list of (id, name) of products whose names start with prefix, ordered by name
+        """
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        with self._lock:
+            self._ensure_built()
+            results = []
+            i = bisect.bisect_left(self._entries, (prefix,))
+            while i < len(self._entries) and len(results) < limit:
+                lowercase_name, name, product_id = self._entries[i]
+                if not lowercase_name.startswith(prefix):
+                    break
+                results.append((product_id, name))
+                i += 1
+            return results
+
+
+# one index per process
+product_name_index = ProductNameIndex()
@@ -0,0 +1,154 @@
+"""
+catalog cache: rendered pages and fragments of the product catalog, and the object caches of products
+and categories (see core/object_cache.py)
+
+    full pages: GET requests of anonymous users to catalog views (CatalogPageCacheMixin),
+        for settings.CATALOG_PAGE_CACHE_TIMEOUT seconds
+    fragments: parts of a page that are the same for all users, e.g. the product grid (cached_fragment),
+        for settings.CATALOG_FRAGMENT_CACHE_TIMEOUT seconds
+so a catalog page served from cache costs no queries. when an entry expires or the catalog changes, a single
+request renders it again, and the others are served the previous one meanwhile (see core/single_flight.py).
+
+all entries are of a catalog version: an entry of an older one is not served (but while it's rendered
+again). any save or delete of a product or a category bumps it (see
+products/signals.py), and so do bulk writes that skip signals (imports, repricing, stock adjustments).
+stock changes of checkouts (adjust_stock) don't: availability shown by the catalog may lag behind by up to
+the timeouts.
+
+entries are kept in the 'catalog' cache (settings.CACHES): in memory of each process, or in files shared
+by the processes of a host (CATALOG_CACHE_DIR). with files, an entry is rendered again by a single request
+per process (add() of the file cache isn't atomic, see core/single_flight.py).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, QueryDict
+from django.utils.safestring import mark_safe
+
+from core import single_flight
+from core.object_cache import ObjectCache
+
+import logging
+
+logger = logging.getLogger('django')
+
+CATALOG_CACHE_ALIAS = 'catalog'
+VERSION_CACHE_KEY = 'catalog:version'
+
+# lookups of products and categories by id or name (see ProductManager.get_product, CategoryManager.get_category)
+# stock changes with every checkout: it's always read from db
+product_cache = ObjectCache('products.Product', natural_key='name', volatile_fields=('stock',))
+category_cache = ObjectCache('products.Category', natural_key='name')
+
+
+def get_catalog_cache():
+    return caches[CATALOG_CACHE_ALIAS]
+
+
+def get_catalog_version():
+    cache = get_catalog_cache()
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        # a fresh, never used version: entries from before the version was lost can't come back
+        version = time.time_ns()
+        cache.add(VERSION_CACHE_KEY, version, timeout=None)
+        version = cache.get(VERSION_CACHE_KEY, version)
+    return version
+
+
+def _bump():
+    cache = get_catalog_cache()
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        # no version yet: nothing is cached under it
+        pass
+
+
+def invalidate_catalog():
+    """
+    drop all cached pages and fragments of the catalog (by bumping the catalog version)
+
+    bumped now, and again after the transaction commits: a request rendering the catalog between the write
+    and its commit may cache what it read before the commit
+    """
+    _bump()
+    transaction.on_commit(_bump)
+    logger.debug("catalog cache was invalidated")
+
+
+def _key(kind, name, variant):
+    # the catalog version is kept in the entry (see core/single_flight.py): an entry of an old version is
+    # served stale while a single request renders the new one
+    digest = hashlib.md5(variant.encode()).hexdigest()
+    return f'catalog:{kind}:{name}:{digest}'
+
+
+def cached_fragment(name, variant, render, timeout=None):
+    """
+    :param name: name of the fragment, e.g. 'product_grid'
+    :param variant: what the fragment's content depends on, e.g. the query string
+    :param render: function rendering the fragment (str of html), called on a miss
+    :param timeout: seconds. default: settings.CATALOG_FRAGMENT_CACHE_TIMEOUT
+    :return: rendered fragment
+    """
+    html = single_flight.get_or_compute(
+        _key('fragment', name, variant), lambda: str(render()),
+        timeout=settings.CATALOG_FRAGMENT_CACHE_TIMEOUT if timeout is None else timeout,
+        cache=get_catalog_cache(), version=get_catalog_version())
+    return mark_safe(html)
+
+
+class CatalogPageCacheMixin:
+    """
+    view mixin: full-page cache of GET requests of anonymous users.
+    place it after access control mixins, so a cached page is served only to those allowed to see it
+
+    a page is cached by its path and the query parameters in page_cache_params, in a canonical order. other
+    parameters (e.g. tracking ones) are dropped from the request before it's rendered, so they neither add
+    entries nor show up in links of a cached page
+    """
+    page_cache_timeout = None  # seconds. default: settings.CATALOG_PAGE_CACHE_TIMEOUT
+    page_cache_params = ()  # query parameters the page depends on
+
+    def get_page_cache_query(self, request):
+        """
+        :return: QueryDict of the parameters of request.GET in page_cache_params, sorted
+        """
+        query = QueryDict(mutable=True)
+        for name in sorted(set(request.GET) & set(self.page_cache_params)):
+            query.setlist(name, sorted(request.GET.getlist(name)))
+        query._mutable = False
+        return query
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        request.GET = self.get_page_cache_query(request)
+        rendered = {}
+
+        def render():
+            response = super(CatalogPageCacheMixin, self).dispatch(request, *args, **kwargs)
+            rendered['response'] = response
+            if response.status_code != 200 or response.streaming:
+                return None  # not cached
+            if hasattr(response, 'render'):
+                response.render()
+            # headers, without cookies (they are in response.cookies): those are per client
+            return response.content, list(response.items())
+
+        timeout = settings.CATALOG_PAGE_CACHE_TIMEOUT if self.page_cache_timeout is None else self.page_cache_timeout
+        page = single_flight.get_or_compute(
+            _key('response', type(self).__name__, f'{request.path}?{request.GET.urlencode()}'), render,
+            timeout=timeout, cache=get_catalog_cache(), version=get_catalog_version())
+        if 'response' in rendered:
+            return rendered['response']
+        content, headers = page
+        response = HttpResponse(content)
+        for header, value in headers:
+            response[header] = value
+        return response
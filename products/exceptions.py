@@ -0,0 +1,8 @@
+from django.core.exceptions import ValidationError
+
+
+class InsufficientStockError(ValidationError):
+    """
+    raised when a stock decrement would bring a product's stock below zero
+    (subclass of ValidationError, so existing callers handling ValidationError keep working)
+    """
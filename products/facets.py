@@ -0,0 +1,66 @@
+"""
+faceted browsing of the catalog: filter products by category, price band and availability
+
+facet counts tell how many products each choice would show, given the other selected filters
+(selecting a category doesn't zero the counts of the other categories).
+they are all computed by ProductManager.facet_counts, in a query grouped by category and an aggregate query.
+"""
+from django.db.models import Q
+
+# key -> (label, lower bound (inclusive) or None, upper bound (exclusive) or None)
+PRICE_BANDS = {
+    'under-25': ('Under $25', None, 25),
+    '25-100': ('$25 to $100', 25, 100),
+    '100-500': ('$100 to $500', 100, 500),
+    '500-plus': ('$500 and up', 500, None),
+}
+
+FACETS = ('category', 'price', 'in_stock')
+
+
+class CatalogFilters:
+    def __init__(self, category_id=None, price_band=None, in_stock=False):
+        self.category_id = category_id
+        self.price_band = price_band
+        self.in_stock = in_stock
+
+    @classmethod
+    def from_query(cls, query):
+        """
+        :param query: request.GET. parameters: category (id), price (key of PRICE_BANDS), in_stock (True)
+            invalid values are ignored
+        """
+        category = query.get('category', '')
+        price_band = query.get('price')
+        return cls(
+            category_id=int(category) if category.isdigit() else None,
+            price_band=price_band if price_band in PRICE_BANDS else None,
+            in_stock=query.get('in_stock') == 'True',
+        )
+
+    @staticmethod
+    def price_band_condition(price_band):
+        _, lower, upper = PRICE_BANDS[price_band]
+        condition = Q()
+        if lower is not None:
+            condition &= Q(price__gte=lower)
+        if upper is not None:
+            condition &= Q(price__lt=upper)
+        return condition
+
+    def condition(self, exclude=None):
+        """
+        :param exclude: name of a facet (one of FACETS) whose filter is left out
+        :return: Q object of the selected filters
+        """
+        condition = Q()
+        if self.category_id is not None and exclude != 'category':
+            condition &= Q(category_id=self.category_id)
+        if self.price_band is not None and exclude != 'price':
+            condition &= self.price_band_condition(self.price_band)
+        if self.in_stock and exclude != 'in_stock':
+            condition &= Q(stock__gt=0)
+        return condition
+
+    def __bool__(self):
+        return self.category_id is not None or self.price_band is not None or self.in_stock
@@ -0,0 +1,27 @@
+import csv
+import io
+
+from django import forms
+
+from products.stock import parse_adjustments, StockAdjustmentError
+
+
+class StockAdjustmentForm(forms.Form):
+    manifest = forms.CharField(
+        widget=forms.Textarea(attrs={'rows': 15}),
+        help_text="CSV with a header line. columns: id or name (of the product), and delta or stock (new value)",
+    )
+    dry_run = forms.BooleanField(required=False, help_text="only check the manifest, without changing stock")
+
+    def clean_manifest(self):
+        """
+        :return: list of StockAdjustment
+        """
+        rows = csv.DictReader(io.StringIO(self.cleaned_data['manifest'].strip()))
+        try:
+            adjustments = parse_adjustments(rows)
+        except StockAdjustmentError as e:
+            raise forms.ValidationError(e.messages)
+        if not adjustments:
+            raise forms.ValidationError("manifest has no entries")
+        return adjustments
@@ -1,7 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Case, When, Value, Count
 from typing import Union, Optional
 
+from core import identity_map, invalidation
+from core.money import Money
 from ecommerce.constants import EXCEPTION_LOG_LEVELS
+from products.cache import invalidate_catalog, product_cache, category_cache
+from products.exceptions import InsufficientStockError
+from products.facets import CatalogFilters, PRICE_BANDS
+from products.search import SearchResults, get_backend
+from products.stock import StockAdjustmentError
 import logging
 
 logger = logging.getLogger('django')
@@ -44,8 +52,9 @@ class ProductManager(models.Manager):
 
             for key, value in kwargs.items():
                 setattr(product, key, value)
-                product.save()
-                logger.debug(f"updated product {product}, {key}:{value}")
+            # a single UPDATE of the changed fields (see DirtyFieldsMixin)
+            product.save()
+            logger.debug(f"updated product {product}, {kwargs}")
             return product
         except self.model.DoesNotExist:
             logger.error(f"Product was not found")
@@ -55,9 +64,247 @@ class ProductManager(models.Manager):
             logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
             return None
 
+    def adjust_stock(self, product: Union['Product', int], delta: int) -> None:
+        """
+        atomically add delta to product's stock, using a single conditional UPDATE statement
+        (stock = stock + delta WHERE stock + delta >= 0), so concurrent checkouts can't lose updates.
+        a negative delta decrements stock, a positive delta restores it.
+
+        if a Product object is given, its in-memory stock is kept in step with the update.
+
+        :param product: Product object OR product's id (int)
+        :param delta: amount to add to stock (negative to decrement)
+        :raises InsufficientStockError: product exists, but has not enough stock for the decrement
+        :raises Product.DoesNotExist: product is gone
+        """
+        product_id = product.pk if isinstance(product, self.model) else product
+        queryset = self.filter(pk=product_id)
+        if delta < 0:
+            queryset = queryset.filter(stock__gte=-delta)
+
+        updated = queryset.update(stock=F('stock') + delta)
+        if not updated:
+            # only on failure: tell apart a missing product and a product with not enough stock
+            if not self.filter(pk=product_id).exists():
+                raise self.model.DoesNotExist(f"Product #{product_id} does not exist")
+            raise InsufficientStockError(f"Not enough stock in product #{product_id} for a change of {delta}")
+
+        if isinstance(product, self.model):
+            if 'stock' not in product.get_deferred_fields():
+                product.stock += delta
+            identity_map.forget(self.model, pks=[product_id], keep=product)
+        else:
+            identity_map.forget(self.model, pks=[product_id])
+        logger.debug(f"adjusted stock of product #{product_id} by {delta}")
+
+    def adjust_stock_bulk(self, deltas: dict) -> None:
+        """
+        atomically add a delta to the stock of many products, using a single conditional UPDATE statement
+        (stock = stock + CASE id WHEN ... END). either all products are updated, or none of them.
+
+        :param deltas: dict of product's id (int) -> delta (negative to decrement)
+        :raises InsufficientStockError: some product has not enough stock for its decrement
+        :raises Product.DoesNotExist: some product is gone
+        """
+        if not deltas:
+            return
+
+        condition = Q()
+        for product_id, delta in deltas.items():
+            if delta < 0:
+                condition |= Q(pk=product_id, stock__gte=-delta)
+            else:
+                condition |= Q(pk=product_id)
+        stock_change = Case(
+            *[When(pk=product_id, then=Value(delta)) for product_id, delta in deltas.items()],
+            default=Value(0),
+            output_field=models.IntegerField(),
+        )
+
+        with transaction.atomic():
+            updated = self.filter(condition).update(stock=F('stock') + stock_change)
+            if updated != len(deltas):
+                # only on failure (rolling back the rows that were updated): tell apart the reasons
+                existing_ids = set(self.filter(pk__in=deltas.keys()).values_list('pk', flat=True))
+                missing_ids = set(deltas.keys()) - existing_ids
+                if missing_ids:
+                    raise self.model.DoesNotExist(f"Products {sorted(missing_ids)} do not exist")
+                raise InsufficientStockError(f"Not enough stock for some of the products: {deltas}")
+        identity_map.forget(self.model, pks=deltas.keys())
+        logger.debug(f"adjusted stock of {updated} products")
+
+    def apply_stock_adjustments(self, adjustments: list, dry_run: bool = False) -> dict:
+        """
+        apply a manifest of stock changes in one transaction: the products are locked and read with
+        a single SELECT ... FOR UPDATE, and written with a single bulk UPDATE (stock = CASE id WHEN ... END).
+        either all adjustments are applied, or none of them.
+
+        entries of the same product are applied in manifest order (a stock count, then the deltas after it).
+
+        :param adjustments: list of StockAdjustment (see products.stock.parse_adjustments)
+        :param dry_run: only check the adjustments, without writing
+        :return: dict of product's id -> (stock before, stock after), of the adjusted products
+        :raises StockAdjustmentError: unknown products, or stock would go below zero (all conflicts are reported)
+        """
+        ids = {adjustment.product_id for adjustment in adjustments if adjustment.product_id is not None}
+        names = {adjustment.name for adjustment in adjustments if adjustment.product_id is None}
+        with transaction.atomic():
+            products = list(self.filter(Q(pk__in=ids) | Q(name__in=names))
+                            .select_for_update().only('id', 'name', 'stock').order_by('pk'))
+            by_id = {product.pk: product for product in products}
+            by_name = {product.name: product for product in products}
+
+            conflicts, changes = [], {}
+            for adjustment in adjustments:
+                if adjustment.product_id is not None:
+                    product = by_id.get(adjustment.product_id)
+                else:
+                    product = by_name.get(adjustment.name)
+                if product is None:
+                    conflicts.append({'line': adjustment.line, 'product': adjustment.product,
+                                      'error': 'product does not exist'})
+                    continue
+                before, stock = changes.get(product.pk, (product.stock, product.stock))
+                if adjustment.stock is not None:
+                    stock = adjustment.stock
+                elif stock + adjustment.delta >= 0:
+                    stock += adjustment.delta
+                else:
+                    conflicts.append({'line': adjustment.line, 'product': adjustment.product,
+                                      'error': f'not enough stock for a change of {adjustment.delta} '
+                                               f'({stock} in stock)'})
+                    continue
+                changes[product.pk] = (before, stock)
+
+            if conflicts:
+                raise StockAdjustmentError(conflicts)
+            if not dry_run:
+                for product_id, (_, stock) in changes.items():
+                    by_id[product_id].stock = stock
+                self.bulk_update([by_id[product_id] for product_id in changes], ['stock'], batch_size=1000)
+        if not dry_run:
+            identity_map.forget(self.model, pks=changes.keys())
+            invalidate_catalog()
+            invalidation.publish(self.model._meta.label, changes.keys())
+        logger.debug(f"adjusted stock of {len(changes)} products, dry_run= {dry_run}")
+        return changes
+
+    def _repricing_queryset(self, products) -> 'QuerySet':
+        from products.models import Category
+        if products is None:
+            return self.all()
+        if isinstance(products, Category):
+            return self.filter(category=products)
+        return products
+
+    def reprice(self, rule: 'PriceRule', products=None) -> int:
+        """
+        change prices with a single UPDATE statement (price = expression of rule), computed by the database
+        in integer cents. rows whose price wouldn't change are not written.
+
+        :param rule: PriceRule
+        :param products: Category, QuerySet of products, or None for all products
+        :return: number of repriced products
+        """
+        new_price = rule.expression()
+        updated = self._repricing_queryset(products).exclude(price=new_price).update(price=new_price)
+        # prices of loaded and cached instances, and of cached catalog pages are stale
+        identity_map.forget(self.model)
+        product_cache.invalidate_all()
+        invalidate_catalog()
+        invalidation.publish(self.model._meta.label)
+        logger.info(f"repriced {updated} products: {rule}")
+        return updated
+
+    def reprice_diff(self, rule: 'PriceRule', products=None, chunk_size: int = 2000):
+        """
+        dry run of reprice: the new prices are computed by the database, by the same expression
+
+        :param rule: PriceRule
+        :param products: Category, QuerySet of products, or None for all products
+        :return: iterator of (product, differences), only of products whose price would change.
+            differences are as of compare_model_instances: {'price': (current price, new price)}.
+            products have only id, name and price loaded
+        """
+        queryset = (self._repricing_queryset(products).only('id', 'name', 'price')
+                    .annotate(new_price=rule.expression()).order_by('pk'))
+        for product in queryset.iterator(chunk_size=chunk_size):
+            new_price = Money(product.new_price)
+            if new_price != product.price:
+                yield product, {'price': (product.price, new_price)}
+
+    def search(self, query: str) -> 'SearchResults':
+        """
+        full-text search over product's name, description and category's name
+        :param query: free text
+        :return: lazy SearchResults, ranked by relevance. can be sliced or paginated like a queryset
+        """
+        return SearchResults(query)
+
+    def update_search_index(self, product_ids: Optional[list] = None) -> None:
+        """
+        index products for search. saves and deletes are indexed automatically (by signals),
+        this is needed only after writes that skip signals (bulk_create, queryset.update() of indexed fields)
+        :param product_ids: ids of products to index. None to rebuild the whole index
+        """
+        backend = get_backend()
+        if product_ids is None:
+            backend.rebuild()
+        else:
+            backend.index_products(product_ids)
+
+    def filter_catalog(self, filters: 'CatalogFilters') -> 'QuerySet':
+        """
+        :param filters: CatalogFilters (selected category, price band, availability)
+        :return: QuerySet of products matching all filters
+        """
+        return self.filter(filters.condition())
+
+    def facet_counts(self, filters: 'CatalogFilters') -> dict:
+        """
+        count products per facet value: one query grouped by category, and one aggregate query over products for
+        the other facets. the count of a facet value applies the filters selected in the other facets
+
+        :param filters: CatalogFilters (selected category, price band, availability)
+        :return: dict: total (int), categories (list of (Category, count)),
+            price_bands (list of (key, label, count)), in_stock (int)
+        """
+        from products.models import Category
+        categories = list(Category.objects.only('id', 'name').order_by('name'))
+
+        category_counts = dict(self.filter(filters.condition(exclude='category')).order_by()
+                               .values('category_id').annotate(n=Count('pk')).values_list('category_id', 'n'))
+
+        aggregates = {'total': Count('pk', filter=filters.condition())}
+        other_than_price = filters.condition(exclude='price')
+        for i, price_band in enumerate(PRICE_BANDS):
+            aggregates[f'price_{i}'] = Count(
+                'pk', filter=other_than_price & CatalogFilters.price_band_condition(price_band))
+        aggregates['in_stock'] = Count('pk', filter=filters.condition(exclude='in_stock') & Q(stock__gt=0))
+
+        counts = self.aggregate(**aggregates)
+        return {
+            'total': counts['total'],
+            'categories': [(category, category_counts.get(category.id, 0)) for category in categories],
+            'price_bands': [(key, label, counts[f'price_{i}'])
+                            for i, (key, (label, _, _)) in enumerate(PRICE_BANDS.items())],
+            'in_stock': counts['in_stock'],
+        }
+
+    def get_cached(self, pk: Optional[int] = None, name: Optional[str] = None) -> 'Product':
+        """
+        look up a product by id or name: in the request's identity map, then in the object cache
+        (see core/object_cache.py), and only then in db.
+        the product's stock is not cached: it's read from db when accessed
+        :raises Product.DoesNotExist: product was not found
+        """
+        field, value = ('pk', int(pk)) if pk is not None else ('name', name)
+        return identity_map.lookup(self.model, field, value,
+                                   lambda: product_cache.get(field, value, lambda: self.get(**{field: value})))
+
     def get_product(self, name: str) -> Optional['Product']:
         try:
-            product = self.get(name=name)
+            product = self.get_cached(name=name)
             return product
         except self.model.DoesNotExist:
             logger.error(f"Product {name} was not found")
@@ -101,8 +348,9 @@ class CategoryManager(models.Manager):
             category = self.get(name=name)
             for key, value in kwargs.items():
                 setattr(category, key, value)
-                category.save()
-                logger.debug(f"updated category {category}, {key}:{value}")
+            # a single UPDATE of the changed fields (see DirtyFieldsMixin)
+            category.save()
+            logger.debug(f"updated category {category}, {kwargs}")
             return category
         except self.model.DoesNotExist:
             logger.error(f"Category {name} does not exist.")
@@ -112,9 +360,19 @@ class CategoryManager(models.Manager):
             logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
             return None
 
+    def get_cached(self, pk: Optional[int] = None, name: Optional[str] = None) -> 'Category':
+        """
+        look up a category by id or name: in the request's identity map, then in the object cache
+        (see core/object_cache.py), and only then in db
+        :raises Category.DoesNotExist: category was not found
+        """
+        field, value = ('pk', int(pk)) if pk is not None else ('name', name)
+        return identity_map.lookup(self.model, field, value,
+                                   lambda: category_cache.get(field, value, lambda: self.get(**{field: value})))
+
     def get_category(self, name: str) -> Optional['Category']:
         try:
-            category = self.get(name=name)
+            category = self.get_cached(name=name)
             return category
         except self.model.DoesNotExist:
             logger.error(f"Category {name} does not exist.")
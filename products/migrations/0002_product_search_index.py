@@ -0,0 +1,44 @@
+from django.db import migrations
+
+from products.search import PostgresSearchBackend, SqliteSearchBackend
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "ALTER TABLE products_product ADD COLUMN search_vector tsvector"
+        )
+        schema_editor.execute(
+            "CREATE INDEX products_product_search_vector_idx "
+            "ON products_product USING GIN (search_vector)"
+        )
+        schema_editor.execute(PostgresSearchBackend.INDEX_SQL)
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE products_product_fts "
+            "USING fts5(name, category_name, description, "
+            "tokenize='porter unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(SqliteSearchBackend.INDEX_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "ALTER TABLE products_product DROP COLUMN search_vector"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute("DROP TABLE products_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,79 @@
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+import core.money
+
+
+def price_to_cents(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(price_cents=Cast(Round(F('price') * 100), models.BigIntegerField()))
+
+
+def cents_to_price(apps, schema_editor):
+    # in python: integer division in SQL (on SQLite) would drop the cents
+    Product = apps.get_model('products', 'Product')
+    products = []
+    for product in Product.objects.only('pk', 'price_cents').iterator(chunk_size=2000):
+        product.price = product.price_cents.to_decimal()
+        products.append(product)
+    Product.objects.bulk_update(products, ['price'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+    """
+    Product.price: DecimalField -> MoneyField (integer cents).
+    indexes and constraints on price are dropped while the column is replaced, and created again
+    """
+
+    dependencies = [
+        ("products", "0005_model_constraints"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(model_name="product", name="product_price_id_idx"),
+        migrations.RemoveIndex(model_name="product", name="product_category_price_idx"),
+        migrations.RemoveIndex(model_name="product", name="product_in_stock_price_idx"),
+        migrations.RemoveConstraint(model_name="product", name="product_price_non_negative"),
+        migrations.AddField(
+            model_name="product",
+            name="price_cents",
+            field=core.money.MoneyField(default=0),
+        ),
+        # nullable while replaced, so the migration can be reversed (price is re-added empty, then filled)
+        migrations.AlterField(
+            model_name="product",
+            name="price",
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True,
+                                      validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunPython(price_to_cents, cents_to_price),
+        migrations.RemoveField(model_name="product", name="price"),
+        migrations.RenameField(model_name="product", old_name="price_cents", new_name="price"),
+        migrations.AlterField(
+            model_name="product",
+            name="price",
+            field=core.money.MoneyField(validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["price", "id"], name="product_price_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["category", "price"], name="product_category_price_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("stock__gt", 0)), fields=["price", "id"], name="product_in_stock_price_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="product",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("price__gte", 0)), name="product_price_non_negative"
+            ),
+        ),
+    ]
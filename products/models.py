@@ -1,15 +1,16 @@
 from django.db import models
 from .managers import ProductManager, CategoryManager
 from django.core.validators import MinValueValidator, MinLengthValidator
-import decimal
 
+from core.models import DirtyFieldsMixin
+from core.money import MoneyField
 from ecommerce.constants import EXCEPTION_LOG_LEVELS
 import logging
 
 logger = logging.getLogger('django')
 
 
-class Category(models.Model):
+class Category(DirtyFieldsMixin, models.Model):
     """
     a category to which a product can belong
     """
@@ -18,9 +19,14 @@ class Category(models.Model):
 
     objects = CategoryManager()
 
+    class Meta:
+        constraints = [
+            models.CheckConstraint(condition=~models.Q(name=''), name='category_name_not_empty'),
+        ]
+
     def save(self, *args, **kwargs):
         try:
-            self.full_clean()
+            self.validate_for_save(kwargs)
             super().save(*args, **kwargs)
         except Exception as e:
             log_level = EXCEPTION_LOG_LEVELS.get(type(e), logging.ERROR)
@@ -31,45 +37,44 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(DirtyFieldsMixin, models.Model):
     """
     an item for sale in store.
     has a foreign key relationship with 'Category'.
     """
     name = models.CharField(max_length=100, validators=[MinLengthValidator(1)], unique=True)
     description = models.TextField(blank=True, null=True)
-    price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
+    price = MoneyField(validators=[MinValueValidator(0)])  # in cents, see core/money.py
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     stock = models.IntegerField(default=0, validators=[MinValueValidator(0)])
 
     objects = ProductManager()
 
-    # TODO: performance potential issue: assure price (or other when comparing) is not a Decimal
-    # TODO: before casting it. If it is a Decimal, just need to handle decimal places issue
+    class Meta:
+        indexes = [
+            # keyset pagination of the catalog by price ((name, id) is covered by name's unique index)
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            # faceted browsing (see products/facets.py): a category's products by price
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            # faceted browsing: only products in stock, by price
+            models.Index(fields=['price', 'id'], condition=models.Q(stock__gt=0),
+                         name='product_in_stock_price_idx'),
+        ]
+        # same invariants as the fields' validators, enforced by the db for writes that skip validation
+        constraints = [
+            models.CheckConstraint(condition=~models.Q(name=''), name='product_name_not_empty'),
+            models.CheckConstraint(condition=models.Q(price__gte=0), name='product_price_non_negative'),
+            models.CheckConstraint(condition=models.Q(stock__gte=0), name='product_stock_non_negative'),
+        ]
 
     def save(self, *args, **kwargs):
         try:
-            # Ensure the price is formatted correctly according to decimal_places
-            decimal_places = self._meta.get_field('price').decimal_places
-            self.price = decimal.Decimal(self.price).quantize(
-                decimal.Decimal(f'1.{"0" * decimal_places}'),
-                rounding=decimal.ROUND_DOWN
-            )
-            self.full_clean()
+            self.validate_for_save(kwargs)
             super().save(*args, **kwargs)
         except Exception as e:
             log_level = EXCEPTION_LOG_LEVELS.get(type(e), logging.ERROR)
             logger.log(log_level, f"An error occurred: {str(e)}", exc_info=True)
             raise
 
-    # def __eq__(self, other):
-    #     decimal_places = self._meta.get_field('price').decimal_places
-    #     other = decimal.Decimal(other).quantize(
-    #         decimal.Decimal(f'1.{"0" * decimal_places}'),
-    #         rounding=decimal.ROUND_DOWN
-    #     )
-    #
-    #     return self.price == other
-
     def __str__(self):
         return self.name
@@ -0,0 +1,100 @@
+"""
+bulk repricing: a PriceRule (percentage and / or absolute change, rounding, ending, floor) turned into
+a single SQL expression over the price column (integer cents), applied with one UPDATE statement.
+
+the dry run evaluates the same expression in a SELECT, so it shows exactly what the UPDATE would write.
+"""
+import decimal
+
+from django.db.models import F, Value, BigIntegerField, ExpressionWrapper
+from django.db.models.functions import Greatest, Least
+
+from core.money import Money, CENTS
+
+ROUNDING_MODES = ('down', 'up', 'nearest')
+# percentages are applied in basis points (1% = 100): two decimal places
+BASIS_POINTS = 10000
+
+
+def _integer(expression):
+    return ExpressionWrapper(expression, output_field=BigIntegerField())
+
+
+class PriceRule:
+    """
+    a price change, applied in this order:
+        percent: change by a percentage, e.g. -15 for 15% off (up to two decimal places, result rounded down)
+        amount: add an amount of money (negative to subtract)
+        round_to, rounding: round to a multiple of round_to cents, 'down', 'up' or 'nearest'
+        ending: round down to a price ending with these cents, e.g. 99 for x.99
+        floor: minimum price (prices never go below zero)
+    """
+    def __init__(self, percent=None, amount=None, round_to=None, rounding='nearest', ending=None, floor=None):
+        self.basis_points = self._basis_points(percent) if percent is not None else None
+        self.amount = Money.coerce(amount) if amount is not None else None
+        if round_to is not None and (not isinstance(round_to, int) or round_to < 1):
+            raise ValueError(f"round_to must be a positive number of cents, got {round_to}")
+        if rounding not in ROUNDING_MODES:
+            raise ValueError(f"rounding must be one of {', '.join(ROUNDING_MODES)}, got {rounding}")
+        if ending is not None and not (isinstance(ending, int) and 0 <= ending < CENTS):
+            raise ValueError(f"ending must be a number of cents (0 to {CENTS - 1}), got {ending}")
+        self.round_to = round_to
+        self.rounding = rounding
+        self.ending = ending
+        self.floor = Money.coerce(floor) if floor is not None else Money(0)
+        if self.floor < 0:
+            raise ValueError(f"floor can't be negative, got {self.floor}")
+
+    @staticmethod
+    def _basis_points(percent):
+        try:
+            basis_points = decimal.Decimal(str(percent)) * 100
+        except decimal.InvalidOperation:
+            raise ValueError(f"percent must be a number, got {percent}")
+        if basis_points != basis_points.to_integral_value():
+            raise ValueError(f"percent can have up to two decimal places, got {percent}")
+        if basis_points <= -BASIS_POINTS:
+            raise ValueError(f"percent must be above -100, got {percent}")
+        return int(basis_points)
+
+    def __bool__(self):
+        return any(value is not None for value in (self.basis_points, self.amount, self.round_to, self.ending)) \
+            or self.floor > 0
+
+    def expression(self, field='price'):
+        """
+        :return: expression of the new price (integer cents), computed from field, in integer arithmetic only.
+            intermediate results are kept non-negative, so integer division truncates the same on every database
+        """
+        price = F(field)
+        if self.basis_points is not None:
+            price = _integer(price * Value(BASIS_POINTS + self.basis_points) / Value(BASIS_POINTS))
+        if self.amount is not None:
+            price = _integer(price + Value(self.amount.cents))
+        price = Greatest(price, Value(0), output_field=BigIntegerField())
+        if self.round_to is not None:
+            offset = {'down': 0, 'up': self.round_to - 1, 'nearest': self.round_to // 2}[self.rounding]
+            price = _integer((price + Value(offset)) / Value(self.round_to) * Value(self.round_to))
+        if self.ending is not None:
+            # highest price ending with ending, not above price. prices below ending are left as they are
+            price = Greatest(
+                _integer((price + Value(CENTS - self.ending)) / Value(CENTS) * Value(CENTS)
+                         + Value(self.ending - CENTS)),
+                Least(price, Value(self.ending - 1), output_field=BigIntegerField()),
+                output_field=BigIntegerField(),
+            )
+        return Greatest(price, Value(self.floor.cents), output_field=BigIntegerField())
+
+    def __str__(self):
+        parts = []
+        if self.basis_points is not None:
+            parts.append(f"{decimal.Decimal(self.basis_points).scaleb(-2):+}%")
+        if self.amount is not None:
+            parts.append(f"{'+' if self.amount >= 0 else ''}{self.amount}")
+        if self.round_to is not None:
+            parts.append(f"round {self.rounding} to {Money(self.round_to)}")
+        if self.ending is not None:
+            parts.append(f"ending .{self.ending:02d}")
+        if self.floor > 0:
+            parts.append(f"floor {self.floor}")
+        return ', '.join(parts) or 'no change'
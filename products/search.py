@@ -0,0 +1,225 @@
+"""
+full-text search over products: Product.name, Product.description and Category.name
+
+the index lives in the database, next to the products:
+    PostgreSQL: products_product.search_vector (tsvector column) with a GIN index
+    SQLite:     products_product_fts (FTS5 virtual table, rowid = product's id)
+any other database falls back to a (slow, unranked) LIKE search
+
+index tables are created by migration products.0002_product_search_index.
+index is kept current by signals on Product and Category (see products/signals.py),
+so writes through ProductManager, CategoryManager, views and admin are all indexed.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+import logging
+
+logger = logging.getLogger('django')
+
+PRODUCT_TABLE = 'products_product'
+CATEGORY_TABLE = 'products_category'
+FTS_TABLE = 'products_product_fts'
+
+# relative importance of each indexed field, when ranking results
+NAME_WEIGHT, CATEGORY_WEIGHT, DESCRIPTION_WEIGHT = 10.0, 5.0, 1.0
+
+
+class PostgresSearchBackend:
+    """
+    tsvector column, weighted: name (A), category's name (B), description (C)
+    """
+    INDEX_SQL = f"""
+        UPDATE {PRODUCT_TABLE} AS p SET search_vector =
+            setweight(to_tsvector('english', p.name), 'A') ||
+            setweight(to_tsvector('english', c.name), 'B') ||
+            setweight(to_tsvector('english', coalesce(p.description, '')), 'C')
+        FROM {CATEGORY_TABLE} AS c
+        WHERE c.id = p.category_id
+    """
+
+    def index_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(self.INDEX_SQL + " AND p.id = ANY(%s)", [list(product_ids)])
+
+    def index_category(self, category_id):
+        with connection.cursor() as cursor:
+            cursor.execute(self.INDEX_SQL + " AND p.category_id = %s", [category_id])
+
+    def remove_products(self, product_ids):
+        # index is a column of the product's row, and is deleted with it
+        pass
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(self.INDEX_SQL)
+
+    def search_ids(self, query, offset, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT p.id FROM {PRODUCT_TABLE} AS p, websearch_to_tsquery('english', %s) AS q
+                WHERE p.search_vector @@ q
+                ORDER BY ts_rank(p.search_vector, q) DESC, p.id
+                LIMIT %s OFFSET %s
+                """,
+                [query, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def count(self, query):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM {PRODUCT_TABLE} WHERE search_vector @@ websearch_to_tsquery('english', %s)",
+                [query])
+            return cursor.fetchone()[0]
+
+
+class SqliteSearchBackend:
+    """
+    FTS5 virtual table, ranked with bm25 (lower is better)
+    """
+    INDEX_SQL = f"""
+        INSERT INTO {FTS_TABLE} (rowid, name, category_name, description)
+        SELECT p.id, p.name, c.name, coalesce(p.description, '')
+        FROM {PRODUCT_TABLE} AS p JOIN {CATEGORY_TABLE} AS c ON c.id = p.category_id
+    """
+
+    @staticmethod
+    def _placeholders(values):
+        return ', '.join(['%s'] * len(values))
+
+    @staticmethod
+    def match_expression(query):
+        """
+        turn free text into an FTS5 query: every word must match (quoted, so no FTS5 syntax gets through)
+        """
+        words = re.findall(r'\w+', query)
+        return ' '.join(f'"{word}"' for word in words)
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        self.remove_products(product_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(self.INDEX_SQL + f" WHERE p.id IN ({self._placeholders(product_ids)})", product_ids)
+
+    def index_category(self, category_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM {PRODUCT_TABLE} WHERE category_id = %s)",
+                [category_id])
+            cursor.execute(self.INDEX_SQL + " WHERE p.category_id = %s", [category_id])
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({self._placeholders(product_ids)})",
+                           product_ids)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(self.INDEX_SQL)
+
+    def search_ids(self, query, offset, limit):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT rowid FROM {FTS_TABLE}
+                WHERE {FTS_TABLE} MATCH %s
+                ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}, {CATEGORY_WEIGHT}, {DESCRIPTION_WEIGHT}), rowid
+                LIMIT %s OFFSET %s
+                """,
+                [match, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def count(self, query):
+        match = self.match_expression(query)
+        if not match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+            return cursor.fetchone()[0]
+
+
+class BasicSearchBackend:
+    """
+    fallback for databases without full-text search: no index, LIKE on every field, ordered by name
+    """
+    def index_products(self, product_ids):
+        pass
+
+    def index_category(self, category_id):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def _queryset(self, query):
+        from products.models import Product
+        condition = Q()
+        for word in query.split():
+            condition &= (Q(name__icontains=word) | Q(description__icontains=word)
+                          | Q(category__name__icontains=word))
+        return Product.objects.filter(condition) if condition else Product.objects.none()
+
+    def search_ids(self, query, offset, limit):
+        return list(self._queryset(query).order_by('name', 'id').values_list('id', flat=True)[offset:offset + limit])
+
+    def count(self, query):
+        return self._queryset(query).count()
+
+
+def get_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite':
+        return SqliteSearchBackend()
+    return BasicSearchBackend()
+
+
+class SearchResults:
+    """
+    lazy, ranked search results. supports count() and slicing, so it can be paginated by Django's Paginator
+    (or ListView's paginate_by) like a queryset: each page costs one ranked id query and one product query
+    """
+    def __init__(self, query, backend=None):
+        self.query = query
+        self.backend = backend or get_backend()
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.query)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            results = self[key:key + 1]
+            if not results:
+                raise IndexError("search result index out of range")
+            return results[0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        if stop <= start:
+            return []
+
+        from products.models import Product
+        product_ids = self.backend.search_ids(self.query, offset=start, limit=stop - start)
+        products = Product.objects.select_related('category').in_bulk(product_ids)
+        # keep the ranked order
+        return [products[product_id] for product_id in product_ids if product_id in products]
@@ -0,0 +1,88 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core import invalidation
+
+from products.models import Product, Category
+from products.search import get_backend
+from products.autocomplete import product_name_index
+from products.cache import invalidate_catalog, product_cache, category_cache
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_backend().index_products([instance.pk])
+    # in-memory index can't be rolled back, so it's updated only after commit
+    product_id, name = instance.pk, instance.name
+    transaction.on_commit(lambda: product_name_index.update(product_id, name))
+    logger.debug(f"product {instance} was indexed for search")
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    get_backend().remove_products([instance.pk])
+    product_id = instance.pk
+    transaction.on_commit(lambda: product_name_index.remove(product_id))
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created, **kwargs):
+    if not created:
+        # category's name is indexed with each of its products
+        get_backend().index_category(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_cache(sender, instance, **kwargs):
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_object_cache(sender, instance, **kwargs):
+    object_cache = product_cache if sender is Product else category_cache
+    pk = instance.pk
+    # again after commit: another request may cache the row as it was before the commit
+    object_cache.invalidate([pk])
+    transaction.on_commit(lambda: object_cache.invalidate([pk]))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def publish_change(sender, instance, **kwargs):
+    # to the other processes (see core/invalidation.py)
+    invalidation.publish(sender._meta.label, [instance.pk])
+
+
+def product_changed_elsewhere(pks):
+    if pks is None:
+        product_cache.invalidate_all()
+        product_name_index.clear()
+    else:
+        product_cache.invalidate(pks)
+        product_name_index.refresh(pks)
+    invalidate_catalog()
+
+
+def category_changed_elsewhere(pks):
+    if pks is None:
+        category_cache.invalidate_all()
+    else:
+        category_cache.invalidate(pks)
+    invalidate_catalog()
+
+
+invalidation.subscribe(Product._meta.label, product_changed_elsewhere)
+invalidation.subscribe(Category._meta.label, category_changed_elsewhere)
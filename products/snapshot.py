@@ -0,0 +1,198 @@
+"""
+binary catalog snapshot: the product name index of autocomplete, compiled into one read-only file,
+memory-mapped by every worker. pages of the file are shared by all processes of the host (the OS page cache),
+instead of a copy of the index in each worker, and reading it costs no query and no unpickling.
+
+built by the build_catalog_snapshot command into settings.CATALOG_SNAPSHOT_PATH. a rebuild writes a new file
+and renames it over the old one (atomic): workers see either snapshot, never a partial one, and switch to the
+new one within SNAPSHOT_CHECK_INTERVAL seconds.
+
+the snapshot is as of its build, and nothing rebuilds it on catalog changes: rebuild it periodically, and
+after imports. so it serves autocomplete suggestions only, which may lag behind db (the chosen product is
+validated by the form it's submitted with). pages and prices are always read from db.
+
+layout (little endian):
+    header
+    products: fixed-width records, by id
+    name index: (key offset, key length, product record), by lowercase name
+    strings: utf-8 names and lowercase names, pointed to by (offset, length)
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+import logging
+
+logger = logging.getLogger('django')
+
+MAGIC = b'CATSNAP3'
+# magic, built at (ns), product count, offsets of products, name index, strings
+HEADER = struct.Struct('<8sqI3Q')
+# id, name offset, name length
+PRODUCT = struct.Struct('<qII')
+# key offset, key length, product record
+NAME_ENTRY = struct.Struct('<III')
+
+# seconds between checks for a rebuilt snapshot
+SNAPSHOT_CHECK_INTERVAL = 1
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class _Strings:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def add(self, text):
+        data = (text or '').encode()
+        offset = len(self.buffer)
+        self.buffer += data
+        return offset, len(data)
+
+
+def build_snapshot(path):
+    """
+    compile product names into a snapshot file, and swap it in atomically
+    :param path: snapshot file. replaced if it exists
+    :return: dict: products, size (bytes)
+    """
+    from products.models import Product
+
+    strings = _Strings()
+    rows = list(Product.objects.order_by('id').values_list('id', 'name').iterator(chunk_size=2000))
+
+    products = bytearray()
+    names = []
+    for i, (product_id, name) in enumerate(rows):
+        products += PRODUCT.pack(product_id, *strings.add(name))
+        names.append((name.lower().encode(), i))
+    names.sort()
+
+    name_index = bytearray()
+    for key, i in names:
+        name_index += NAME_ENTRY.pack(*strings.add(key.decode()), i)
+
+    sections = [products, name_index, strings.buffer]
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+    header = HEADER.pack(MAGIC, time.time_ns(), len(rows), *offsets)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.catalog-snapshot-')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(header)
+            for section in sections:
+                file.write(section)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    logger.info(f"built catalog snapshot {path}: {len(rows)} products, {offset} bytes")
+    return {'products': len(rows), 'size': offset}
+
+
+class CatalogSnapshot:
+    """
+    read-only view of a snapshot file. records are read in place from the mapped file
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise SnapshotError(f"{path} is not a catalog snapshot")
+        magic, self.built_at, self.product_count, self._products, self._names, self._strings = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a catalog snapshot")
+
+    def _string(self, offset, length):
+        start = self._strings + offset
+        return self._map[start:start + length]
+
+    def _product(self, i):
+        product_id, name_offset, name_length = PRODUCT.unpack_from(self._map, self._products + i * PRODUCT.size)
+        return product_id, self._string(name_offset, name_length).decode()
+
+    def _name_entry(self, i):
+        return NAME_ENTRY.unpack_from(self._map, self._names + i * NAME_ENTRY.size)
+
+    def _name_key(self, i):
+        key_offset, key_length, _ = self._name_entry(i)
+        return self._string(key_offset, key_length)
+
+    def lookup(self, prefix, limit=10):
+        """
+        same as ProductNameIndex.lookup (see products/autocomplete.py)
+        :return: list of (id, name) of products whose names start with prefix (case insensitive), ordered by name
+        """
+        prefix = prefix.lower().encode()
+        # first name not below prefix
+        low, high = 0, self.product_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name_key(middle) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        results = []
+        i = low
+        while i < self.product_count and len(results) < limit and self._name_key(i).startswith(prefix):
+            results.append(self._product(self._name_entry(i)[2]))
+            i += 1
+        return results
+
+    def __len__(self):
+        return self.product_count
+
+
+_snapshot = None
+_checked_at = 0.0
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    :return: CatalogSnapshot of settings.CATALOG_SNAPSHOT_PATH (reopened once it's rebuilt),
+        or None if no snapshot is configured or built
+    """
+    global _snapshot, _checked_at
+    path = getattr(settings, 'CATALOG_SNAPSHOT_PATH', None)
+    if not path:
+        return None
+    now = time.monotonic()
+    if _snapshot is not None and _snapshot.path == path and now - _checked_at < SNAPSHOT_CHECK_INTERVAL:
+        return _snapshot
+    with _snapshot_lock:
+        _checked_at = now
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _snapshot = None
+            return None
+        if _snapshot is None or _snapshot.path != path or \
+                (stat.st_ino, stat.st_dev) != (_snapshot.stat.st_ino, _snapshot.stat.st_dev):
+            # the previous file stays mapped until no one uses it
+            try:
+                _snapshot = CatalogSnapshot(path)
+            except (OSError, ValueError, SnapshotError):
+                logger.exception(f"can't open catalog snapshot {path}")
+                _snapshot = None
+            else:
+                logger.debug(f"opened catalog snapshot {path}: {len(_snapshot)} products")
+        return _snapshot
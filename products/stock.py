@@ -0,0 +1,84 @@
+"""
+bulk stock adjustments: a manifest (e.g. an inbound shipment) of stock changes, applied in one transaction
+
+each entry names a product, by id or by name, and either a delta (added to stock, negative to remove)
+or an absolute stock value (a stock count). a manifest is parsed by parse_adjustments and applied by
+ProductManager.apply_stock_adjustments. either all of it is applied, or nothing (conflicts are reported).
+"""
+from django.core.exceptions import ValidationError
+
+
+class StockAdjustment:
+    def __init__(self, line, product_id=None, name=None, delta=None, stock=None):
+        self.line = line
+        self.product_id = product_id
+        self.name = name
+        self.delta = delta
+        self.stock = stock
+
+    @property
+    def product(self):
+        """
+        :return: the product as named in the manifest (id or name)
+        """
+        return self.product_id if self.product_id is not None else self.name
+
+
+class StockAdjustmentError(ValidationError):
+    """
+    raised when a manifest can't be applied. nothing was changed
+
+    conflicts: list of dicts: line (in manifest), product (id or name), error
+    """
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__([f"line {conflict['line']}: {conflict['product']}: {conflict['error']}"
+                          for conflict in conflicts])
+
+
+def _parse_int(value, field):
+    if isinstance(value, bool):
+        raise ValueError(f"{field} must be a whole number")
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{field} must be a whole number, got '{value}'")
+
+
+def parse_adjustments(rows):
+    """
+    :param rows: iterable of dicts (CSV rows or JSON objects) with keys:
+        id or name: the product
+        delta or stock: change of stock, or new stock value
+    :return: list of StockAdjustment
+    :raises StockAdjustmentError: some rows are invalid (all of them are reported)
+    """
+    adjustments, conflicts = [], []
+    for line, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            conflicts.append({'line': line, 'product': None, 'error': 'entry must be an object'})
+            continue
+        product_id, name = row.get('id'), str(row.get('name') or '').strip() or None
+        delta, stock = row.get('delta'), row.get('stock')
+        product = product_id if product_id not in (None, '') else name
+        try:
+            if (product_id in (None, '')) == (name is None):
+                raise ValueError("give either id or name of the product")
+            if (delta in (None, '')) == (stock in (None, '')):
+                raise ValueError("give either delta or stock")
+            adjustment = StockAdjustment(
+                line,
+                product_id=_parse_int(product_id, 'id') if product_id not in (None, '') else None,
+                name=name,
+                delta=_parse_int(delta, 'delta') if delta not in (None, '') else None,
+                stock=_parse_int(stock, 'stock') if stock not in (None, '') else None,
+            )
+            if adjustment.stock is not None and adjustment.stock < 0:
+                raise ValueError("stock can't be negative")
+        except ValueError as e:
+            conflicts.append({'line': line, 'product': product, 'error': str(e)})
+            continue
+        adjustments.append(adjustment)
+    if conflicts:
+        raise StockAdjustmentError(conflicts)
+    return adjustments
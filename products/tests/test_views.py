@@ -1,3 +1,8 @@
+from decimal import Decimal
+import os
+import tempfile
+from unittest.mock import patch
+
 from django.test import TestCase
 from django.urls import reverse
 from products.models import Product, Category
@@ -8,6 +13,11 @@ from products.models import Product, Category
 from users.models import User
 import factory
 from products.tests.factories import UserFactory, GroupFactory, ProductFactory, CategoryFactory
+from products.autocomplete import product_name_index
+from products.snapshot import build_snapshot
+from products.views import ProductListView
+from products.cache import invalidate_catalog
+from products.pricing import PriceRule
 
 
 class ProductViewTests(TestCase):
@@ -136,6 +146,21 @@ class ProductViewTests(TestCase):
         response = self.client.get(reverse('product_detail', args=[NON_EXISTING_PRODUCT_PK]))
         self.assertEqual(response.status_code, 403)
 
+    def test_read_product_ignores_snapshot(self):
+        # the snapshot is as of its build: pages are read from db
+        self.client.login(username=self.shift_manager_user.username, password='password')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.snapshot')
+            build_snapshot(path)
+            self.product.price = 5
+            self.product.save()
+            with self.settings(CATALOG_SNAPSHOT_PATH=path):
+                self.assertContains(self.client.get(reverse('product_detail', args=[self.product.pk])), '$5.00')
+                url = reverse('product_detail', args=[self.product.pk])
+                self.product.delete()
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
 
     def test_delete_existing_product(self):
         self.client.login(username=self.shift_manager_user.username, password='password')
@@ -249,3 +274,236 @@ class CategoryViewTests(TestCase):
 
         with self.assertRaises(Category.DoesNotExist):
             Category.objects.get(pk=NON_EXISTING_CATEGORY_PK)
+
+
+class ProductSearchViewTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory(name='Kitchen')
+        self.kettle = ProductFactory(name='kettle', description='boils water', category=self.category)
+        self.mug = ProductFactory(name='mug', description='holds tea', category=self.category)
+
+    def test_search_view(self):
+        response = self.client.get(reverse('product_search'), {'q': 'kettle'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'product_search.html')
+        self.assertEqual(list(response.context['products']), [self.kettle])
+        self.assertContains(response, '1 results')
+
+    def test_search_view_empty_query(self):
+        response = self.client.get(reverse('product_search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), 0)
+
+
+class ProductAutocompleteViewTests(TestCase):
+    def setUp(self):
+        product_name_index.clear()
+        self.kettle = ProductFactory(name='kettle')
+        self.ketchup = ProductFactory(name='ketchup')
+
+    def tearDown(self):
+        product_name_index.clear()
+
+    def test_autocomplete(self):
+        response = self.client.get(reverse('product_autocomplete'), {'q': 'kett'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'results': [{'id': self.kettle.id, 'name': 'kettle'}]})
+
+    def test_autocomplete_limit(self):
+        response = self.client.get(reverse('product_autocomplete'), {'q': 'ket', 'limit': 1})
+        self.assertEqual(len(response.json()['results']), 1)
+        response = self.client.get(reverse('product_autocomplete'), {'q': 'ket', 'limit': 'many'})
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_autocomplete_from_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.snapshot')
+            build_snapshot(path)
+            # not in the snapshot yet
+            ProductFactory(name='kettlebell')
+            with self.settings(CATALOG_SNAPSHOT_PATH=path):
+                response = self.client.get(reverse('product_autocomplete'), {'q': 'kett'})
+        self.assertEqual(response.json(), {'results': [{'id': self.kettle.id, 'name': 'kettle'}]})
+
+
+class ProductListViewTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory(name='Kitchen')
+        self.products = [ProductFactory(name=f'product {i}', price=10 - i, category=self.category)
+                         for i in range(5)]
+
+    def follow(self, url):
+        return self.client.get(reverse('product_list') + url)
+
+    @patch.object(ProductListView, 'page_size', 2)
+    def test_pages_by_name(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['products'], self.products[:2])
+        self.assertIsNone(response.context['previous_page_url'])
+
+        response = self.follow(response.context['next_page_url'])
+        self.assertEqual(response.context['products'], self.products[2:4])
+        response = self.follow(response.context['next_page_url'])
+        self.assertEqual(response.context['products'], self.products[4:])
+        self.assertIsNone(response.context['next_page_url'])
+
+        response = self.follow(response.context['previous_page_url'])
+        self.assertEqual(response.context['products'], self.products[2:4])
+
+    @patch.object(ProductListView, 'page_size', 2)
+    def test_pages_by_price(self):
+        response = self.client.get(reverse('product_list'), {'sort': 'price'})
+        self.assertEqual(response.context['products'], self.products[::-1][:2])
+        response = self.follow(response.context['next_page_url'])
+        self.assertEqual(response.context['products'], self.products[::-1][2:4])
+
+    def test_loads_only_listed_columns(self):
+        response = self.client.get(reverse('product_list'))
+        product = response.context['products'][0]
+        self.assertEqual(product.get_deferred_fields(), {'description', 'category_id', 'stock'})
+
+    @patch.object(ProductListView, 'page_size', 2)
+    def test_cursor_of_other_sort_shows_first_page(self):
+        response = self.client.get(reverse('product_list'))
+        cursor = response.context['next_page_url'].split('cursor=')[1]
+        response = self.client.get(reverse('product_list'), {'sort': 'price', 'cursor': cursor})
+        self.assertEqual(response.context['products'], self.products[::-1][:2])
+
+    def test_facet_filters(self):
+        in_stock = ProductFactory(name='product in stock', price=Decimal('30'), category=self.category, stock=5)
+        Product.objects.filter(pk__in=[product.pk for product in self.products]).update(stock=0)
+        response = self.client.get(reverse('product_list'), {'in_stock': 'True', 'category': self.category.id})
+        self.assertEqual(response.context['products'], [in_stock])
+        facets = response.context['facets']
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(facets['in_stock']['count'], 1)
+        self.assertTrue(facets['in_stock']['selected'])
+        self.assertIn('in_stock=True', facets['categories'][0]['url'])
+        self.assertIsNotNone(facets['clear_url'])
+
+    @patch.object(ProductListView, 'page_size', 2)
+    def test_page_urls_keep_filters(self):
+        response = self.client.get(reverse('product_list'), {'price': 'under-25'})
+        self.assertEqual(response.context['products'], self.products[:2])
+        response = self.follow(response.context['next_page_url'])
+        self.assertEqual(response.context['products'], self.products[2:4])
+
+
+class StockAdjustmentViewTests(TestCase):
+    def setUp(self):
+        Command().handle()
+        self.kettle = ProductFactory(name='Kettle', stock=5)
+        self.mug = ProductFactory(name='Mug', stock=1)
+        self.stock_user = UserFactory(groups=[Group.objects.get(name='stock_personnel')])
+        self.customer = UserFactory(groups=[Group.objects.get(name='customers')])
+        self.client.login(username=self.stock_user.username, password='password')
+
+    def test_adjust_from_form(self):
+        manifest = f"id,name,delta,stock\n{self.kettle.pk},,3,\n,Mug,,10\n"
+        response = self.client.post(reverse('adjust_stock'), {'manifest': manifest})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['success'])
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Kettle': 8, 'Mug': 10})
+
+    def test_form_reports_conflicts(self):
+        response = self.client.post(reverse('adjust_stock'), {'manifest': "name,delta\nMug,-5\nKettle,1\n"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('line 1: Mug: not enough stock', response.context['form'].errors['manifest'][0])
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Kettle': 5, 'Mug': 1})
+
+    def test_json_endpoint(self):
+        body = {'adjustments': [{'name': 'Kettle', 'delta': -5}, {'id': self.mug.pk, 'stock': 0}]}
+        response = self.client.post(reverse('adjust_stock_api'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'dry_run': False, 'adjusted': [
+            {'id': self.kettle.pk, 'before': 5, 'after': 0}, {'id': self.mug.pk, 'before': 1, 'after': 0}]})
+
+    def test_json_endpoint_conflicts(self):
+        body = {'adjustments': [{'name': 'Teapot', 'delta': 1}]}
+        response = self.client.post(reverse('adjust_stock_api'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {'conflicts': [
+            {'line': 1, 'product': 'Teapot', 'error': 'product does not exist'}]})
+        response = self.client.post(reverse('adjust_stock_api'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_customers_cannot_adjust(self):
+        self.client.login(username=self.customer.username, password='password')
+        response = self.client.post(reverse('adjust_stock_api'), {'adjustments': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        Command().handle()
+        self.category = CategoryFactory(name='Kitchen')
+        self.kettle = ProductFactory(name='Kettle', price=20, category=self.category)
+        self.customer = UserFactory(groups=[Group.objects.get(name='customers')])
+
+    def test_anonymous_page_served_from_cache(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, 'Kettle')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('product_list'))
+        self.assertContains(response, 'Kettle')
+        self.client.get(reverse('category_list'))
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(reverse('category_list')), 'Kitchen')
+
+    def test_page_key_is_normalised(self):
+        self.client.get(reverse('product_list'), {'price': 'under-25', 'sort': 'price', 'utm_source': 'a'})
+        with self.assertNumQueries(0):
+            response = self.client.get(f"{reverse('product_list')}?utm_source=b&sort=price&price=under-25")
+        self.assertContains(response, 'Kettle')
+        self.assertNotContains(response, 'utm_source')
+
+    def test_cached_page_keeps_headers(self):
+        render_to_response = ProductListView.render_to_response
+
+        def render_with_header(view, context, **kwargs):
+            response = render_to_response(view, context, **kwargs)
+            response['Cache-Control'] = 'max-age=60'
+            return response
+
+        with patch.object(ProductListView, 'render_to_response', render_with_header):
+            response = self.client.get(reverse('product_list'))
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('product_list'))
+        self.assertEqual(cached['Cache-Control'], 'max-age=60')
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+
+    def test_pages_vary_by_query(self):
+        self.client.get(reverse('product_list'))
+        response = self.client.get(reverse('product_list'), {'price': '500-plus'})
+        self.assertNotContains(response, 'Kettle</')
+        self.assertContains(response, '0 products')
+
+    def test_save_and_delete_invalidate(self):
+        self.client.get(reverse('product_list'))
+        ProductFactory(name='Teapot', category=self.category)
+        self.assertContains(self.client.get(reverse('product_list')), 'Teapot')
+
+        self.category.name = 'Cookware'
+        self.category.save()
+        self.assertContains(self.client.get(reverse('category_list')), 'Cookware')
+
+        self.kettle.delete()
+        self.assertNotContains(self.client.get(reverse('product_list')), 'Kettle')
+
+    def test_product_grid_fragment_for_logged_in_users(self):
+        self.client.force_login(self.customer)
+        self.client.get(reverse('product_list'))
+        # a write that skips signals: the cached fragment is still shown
+        Product.objects.filter(pk=self.kettle.pk).update(name='Old kettle')
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, 'Kettle')
+        self.assertNotContains(response, 'Old kettle')
+
+        invalidate_catalog()
+        self.assertContains(self.client.get(reverse('product_list')), 'Old kettle')
+
+    def test_bulk_writes_invalidate(self):
+        self.client.get(reverse('product_list'))
+        Product.objects.reprice(PriceRule(percent=50))
+        self.assertContains(self.client.get(reverse('product_list')), '$30.00')
@@ -1,6 +1,26 @@
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from products.models import Product, Category
+from products.exceptions import InsufficientStockError
+from products.autocomplete import product_name_index
+from products.facets import CatalogFilters
+from products.stock import parse_adjustments, StockAdjustmentError
+from products.pricing import PriceRule
+from products.cache import product_cache, cached_fragment, invalidate_catalog, get_catalog_cache, \
+    get_catalog_version, _key
+from core import invalidation, single_flight
+from core.money import Money
+from core.identity_map import identity_map_scope
 from decimal import Decimal
+import json
+import os
+from unittest import mock
+import threading
+import time
 
 
 class ProductManagerTest(TestCase):
@@ -46,6 +66,24 @@ class ProductManagerTest(TestCase):
         product = Product.objects.get_product(name='Nonexistent')
         self.assertIsNone(product)
 
+    def test_adjust_stock(self):
+        Product.objects.adjust_stock(self.product, -2)
+        self.assertEqual(self.product.stock, 0)
+        Product.objects.adjust_stock(self.product.id, 5)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_adjust_stock_not_enough_stock(self):
+        with self.assertRaises(InsufficientStockError):
+            Product.objects.adjust_stock(self.product, -3)
+        self.assertEqual(self.product.stock, 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+
+    def test_adjust_stock_nonexistent_product(self):
+        with self.assertRaises(Product.DoesNotExist):
+            Product.objects.adjust_stock(12345, -1)
+
     def test_delete_product(self):
         num_of_deleted = Product.objects.delete_product(name='Laptop')
         self.assertEqual(num_of_deleted, (1, {'products.Product': 1}))
@@ -91,3 +129,592 @@ class CategoryManagerTest(TestCase):
     def test_delete_nonexistent_category(self):
         num_of_deleted = Category.objects.delete_category(name='Nonexistent')
         self.assertIsNone(num_of_deleted)
+
+
+class ProductFacetsTest(TestCase):
+    def setUp(self):
+        self.kitchen = Category.objects.create(name='Kitchen')
+        self.garden = Category.objects.create(name='Garden')
+        self.kettle = Product.objects.create(name='kettle', price=Decimal('20'), category=self.kitchen, stock=3)
+        self.mixer = Product.objects.create(name='mixer', price=Decimal('150'), category=self.kitchen, stock=0)
+        self.hose = Product.objects.create(name='hose', price=Decimal('30'), category=self.garden, stock=1)
+
+    def test_filters_from_query(self):
+        filters = CatalogFilters.from_query({'category': str(self.kitchen.id), 'price': 'under-25', 'in_stock': 'True'})
+        self.assertEqual((filters.category_id, filters.price_band, filters.in_stock),
+                         (self.kitchen.id, 'under-25', True))
+        filters = CatalogFilters.from_query({'category': 'x', 'price': 'cheap', 'in_stock': 'yes'})
+        self.assertFalse(filters)
+
+    def test_filter_catalog(self):
+        filters = CatalogFilters(category_id=self.kitchen.id, in_stock=True)
+        self.assertEqual(list(Product.objects.filter_catalog(filters)), [self.kettle])
+        filters = CatalogFilters(price_band='25-100')
+        self.assertEqual(list(Product.objects.filter_catalog(filters)), [self.hose])
+
+    def test_facet_counts(self):
+        with self.assertNumQueries(3):  # categories, counts by category, and one aggregate over products
+            counts = Product.objects.facet_counts(CatalogFilters())
+        self.assertEqual(counts['total'], 3)
+        self.assertEqual(counts['categories'], [(self.garden, 1), (self.kitchen, 2)])
+        self.assertEqual([count for _, _, count in counts['price_bands']], [1, 1, 1, 0])
+        self.assertEqual(counts['in_stock'], 2)
+
+    def test_facet_counts_apply_other_facets(self):
+        counts = Product.objects.facet_counts(CatalogFilters(category_id=self.kitchen.id, in_stock=True))
+        self.assertEqual(counts['total'], 1)
+        # category counts ignore the selected category, but apply in_stock
+        self.assertEqual(counts['categories'], [(self.garden, 1), (self.kitchen, 1)])
+        self.assertEqual([count for _, _, count in counts['price_bands']], [1, 0, 0, 0])
+        # in_stock count ignores in_stock, but applies the category
+        self.assertEqual(counts['in_stock'], 1)
+
+    def test_facet_counts_queries_dont_grow_with_categories(self):
+        for i in range(10):
+            Category.objects.create(name=f'Category {i}')
+        with self.assertNumQueries(3):
+            counts = Product.objects.facet_counts(CatalogFilters())
+        self.assertEqual(len(counts['categories']), 12)
+        self.assertEqual(sum(count for _, count in counts['categories']), 3)
+
+
+class ProductIdentityMapTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Kitchen')
+        self.product = Product.objects.create(name='kettle', price=Decimal('20'), category=self.category, stock=3)
+
+    def test_no_identity_map_outside_request(self):
+        self.assertIsNot(Product.objects.get_product('kettle'), Product.objects.get_product('kettle'))
+
+    def test_repeated_lookups_reuse_instance(self):
+        with identity_map_scope():
+            product = Product.objects.get_product('kettle')
+            with self.assertNumQueries(0):
+                self.assertIs(Product.objects.get_product('kettle'), product)
+            category = Category.objects.get_category('Kitchen')
+            with self.assertNumQueries(0):
+                self.assertIs(Category.objects.get_category('Kitchen'), category)
+
+    def test_coherent_with_writes(self):
+        with identity_map_scope():
+            product = Product.objects.get_product('kettle')
+
+            Product.objects.adjust_stock(product.pk, -1)
+            reloaded = Product.objects.get_product('kettle')
+            self.assertIsNot(reloaded, product)
+            self.assertEqual(reloaded.stock, 2)
+
+            Product.objects.adjust_stock_bulk({reloaded.pk: 5})
+            self.assertEqual(Product.objects.get_product('kettle').stock, 7)
+
+            other = Product.objects.get(pk=self.product.pk)
+            other.description = 'boils water'
+            other.save()
+            self.assertEqual(Product.objects.get_product('kettle').description, 'boils water')
+
+            Product.objects.delete_product('kettle')
+            self.assertIsNone(Product.objects.get_product('kettle'))
+
+
+class DirtyFieldsTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Kitchen')
+        self.product = Product.objects.create(name='kettle', description='boils water', price=Decimal('20'),
+                                              category=self.category, stock=3)
+
+    def test_dirty_fields(self):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.get_dirty_fields(), [])
+        product.price = Decimal('25')
+        product.stock = 3  # same value
+        self.assertEqual(product.get_dirty_fields(), ['price'])
+        self.assertIsNone(Product(name='mug').get_dirty_fields())
+
+    def test_update_writes_changed_fields_once(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with CaptureQueriesContext(connection) as queries:
+            Product.objects.update_product(product, description='whistles', price=Decimal('25'), stock=4)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "products_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"name"', updates[0])
+        # unchanged unique name isn't validated again
+        self.assertFalse([query for query in queries if '"products_product"."name" =' in query['sql']])
+        # and nothing else: the UPDATE, the search index, in a savepoint (TestCase runs in a transaction)
+        self.assertEqual(len(queries), 5)
+        product.refresh_from_db()
+        self.assertEqual((product.description, product.price, product.stock), ('whistles', Decimal('25'), 4))
+
+    def test_save_without_changes_is_skipped(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with self.assertNumQueries(0):
+            product.save()
+
+    def test_changed_fields_are_validated(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock = -1
+        with self.assertRaises(ValidationError):
+            product.save()
+
+    def test_trusted_save_skips_validation(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.category = Category.objects.create(name='Garden')
+        with CaptureQueriesContext(connection) as queries:
+            product.save(trusted=True)
+        # no query checking that the category exists
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT')
+                          and 'products_category' in query['sql']])
+
+    def test_db_constraints_raise_validation_error(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.stock = -1
+        with transaction.atomic(), self.assertRaisesMessage(ValidationError, 'product_stock_non_negative'):
+            product.save(trusted=True)
+
+        duplicate = Product(name='kettle', price=Decimal('1'), category=self.category)
+        with transaction.atomic(), self.assertRaises(ValidationError) as context:
+            duplicate.save(trusted=True)
+        self.assertIn('name', context.exception.message_dict)
+
+    def test_transaction_usable_after_constraint_violation(self):
+        with transaction.atomic():
+            duplicate = Product(name='kettle', price=Decimal('1'), category=self.category)
+            with self.assertRaises(ValidationError):
+                duplicate.save(trusted=True)
+            # the violation was rolled back to a savepoint: the transaction goes on
+            self.assertEqual(Product.objects.filter(name='kettle').count(), 1)
+            Product.objects.create(name='teapot', price=Decimal('1'), category=self.category)
+        self.assertTrue(Product.objects.filter(name='teapot').exists())
+
+    def test_update_category_single_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            Category.objects.update_category('Kitchen', description='pots and pans')
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "products_category"')]), 1)
+        # and nothing else: lookup, the UPDATE, the search index, in a savepoint (TestCase runs in a transaction)
+        self.assertEqual(len(queries), 6)
+        self.assertEqual(Category.objects.get(pk=self.category.pk).description, 'pots and pans')
+
+
+class StockAdjustmentTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Kitchen')
+        self.kettle = Product.objects.create(name='Kettle', price=10, stock=5, category=category)
+        self.mug = Product.objects.create(name='Mug', price=3, stock=1, category=category)
+
+    def test_parse_adjustments(self):
+        adjustments = parse_adjustments([{'id': str(self.kettle.pk), 'delta': '-2'}, {'name': 'Mug', 'stock': 7}])
+        self.assertEqual([(a.line, a.product_id, a.name, a.delta, a.stock) for a in adjustments],
+                         [(1, self.kettle.pk, None, -2, None), (2, None, 'Mug', None, 7)])
+
+        with self.assertRaises(StockAdjustmentError) as context:
+            parse_adjustments([{'id': 1}, {'id': 1, 'name': 'Mug', 'delta': 1}, {'name': 'Mug', 'delta': 'many'},
+                               {'name': 'Mug', 'stock': -1}, {'id': 1, 'delta': 2}])
+        self.assertEqual([conflict['line'] for conflict in context.exception.conflicts], [1, 2, 3, 4])
+
+    def test_apply_in_single_update(self):
+        adjustments = parse_adjustments([
+            {'name': 'Kettle', 'stock': 20}, {'id': self.kettle.pk, 'delta': -3}, {'id': self.mug.pk, 'delta': 4}])
+        with CaptureQueriesContext(connection) as queries:
+            changes = Product.objects.apply_stock_adjustments(adjustments)
+        self.assertEqual(changes, {self.kettle.pk: (5, 17), self.mug.pk: (1, 5)})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Kettle': 17, 'Mug': 5})
+
+    def test_conflicts_apply_nothing(self):
+        adjustments = parse_adjustments([
+            {'id': self.kettle.pk, 'delta': 10}, {'name': 'Mug', 'delta': -2}, {'name': 'Teapot', 'delta': 1}])
+        with self.assertRaises(StockAdjustmentError) as context:
+            Product.objects.apply_stock_adjustments(adjustments)
+        self.assertEqual([(conflict['line'], conflict['product']) for conflict in context.exception.conflicts],
+                         [(2, 'Mug'), (3, 'Teapot')])
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Kettle': 5, 'Mug': 1})
+
+    def test_dry_run(self):
+        changes = Product.objects.apply_stock_adjustments(parse_adjustments([{'name': 'Mug', 'delta': 2}]),
+                                                          dry_run=True)
+        self.assertEqual(changes, {self.mug.pk: (1, 3)})
+        self.assertEqual(Product.objects.get(pk=self.mug.pk).stock, 1)
+
+
+class RepricingTest(TestCase):
+    def setUp(self):
+        self.kitchen = Category.objects.create(name='Kitchen')
+        self.camping = Category.objects.create(name='Camping')
+        self.kettle = Product.objects.create(name='Kettle', price='12.50', category=self.kitchen)
+        self.spoon = Product.objects.create(name='Spoon', price='0.50', category=self.kitchen)
+        self.tent = Product.objects.create(name='Tent', price=100, category=self.camping)
+
+    def prices(self):
+        return {name: str(price) for name, price in Product.objects.values_list('name', 'price')}
+
+    def test_rules(self):
+        cases = [
+            (PriceRule(percent=-15), {'Kettle': '10.62', 'Spoon': '0.42', 'Tent': '85.00'}),
+            (PriceRule(percent='12.5', round_to=5, rounding='up'), {'Kettle': '14.10', 'Spoon': '0.60',
+                                                                    'Tent': '112.50'}),
+            (PriceRule(ending=99), {'Kettle': '11.99', 'Spoon': '0.50', 'Tent': '99.99'}),
+            (PriceRule(amount=-20, floor=1), {'Kettle': '1.00', 'Spoon': '1.00', 'Tent': '80.00'}),
+            (PriceRule(round_to=100, rounding='nearest'), {'Kettle': '13.00', 'Spoon': '1.00', 'Tent': '100.00'}),
+        ]
+        for rule, expected in cases:
+            with self.subTest(rule=str(rule)), transaction.atomic():
+                Product.objects.reprice(rule)
+                self.assertEqual(self.prices(), expected)
+                transaction.set_rollback(True)
+
+    def test_reprice_category_in_single_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            updated = Product.objects.reprice(PriceRule(percent=10), self.kitchen)
+        self.assertEqual(updated, 2)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.prices(), {'Kettle': '13.75', 'Spoon': '0.55', 'Tent': '100.00'})
+
+    def test_unchanged_prices_are_not_written(self):
+        self.assertEqual(Product.objects.reprice(PriceRule(ending=99), Product.objects.filter(name='Spoon')), 0)
+
+    def test_dry_run_diff(self):
+        diff = list(Product.objects.reprice_diff(PriceRule(ending=99)))
+        self.assertEqual([(product.name, differences) for product, differences in diff], [
+            ('Kettle', {'price': (Money(1250), Money(1199))}),
+            ('Tent', {'price': (Money(10000), Money(9999))}),
+        ])
+        self.assertEqual(self.prices(), {'Kettle': '12.50', 'Spoon': '0.50', 'Tent': '100.00'})
+
+    def test_dry_run_diff_queries(self):
+        # the same single query, however many products
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(Product.objects.reprice_diff(PriceRule(ending=99)))), 2)
+        for i in range(20):
+            Product.objects.create(name=f'Mug {i}', price='3.50', category=self.kitchen)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(Product.objects.reprice_diff(PriceRule(ending=99)))), 22)
+
+    def test_invalid_rules(self):
+        for kwargs in [{'percent': '-100'}, {'percent': '1.234'}, {'round_to': 0}, {'rounding': 'sideways'},
+                       {'ending': 100}, {'floor': -1}]:
+            with self.subTest(**kwargs), self.assertRaises(ValueError):
+                PriceRule(**kwargs)
+
+
+class ObjectCacheTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Cached category')
+        self.product = Product.objects.create(name='Cached kettle', price='19.99', stock=5, category=self.category)
+        product_cache.reset_stats()
+
+    def warm_up(self, **lookup):
+        # entries are stored once the transaction that read them commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.get_cached(**lookup)
+
+    def test_read_through(self):
+        self.warm_up(name='Cached kettle')
+        with self.assertNumQueries(0):
+            first = Product.objects.get_cached(name='Cached kettle')
+            second = Product.objects.get_cached(pk=self.product.pk)
+        self.assertEqual((first.pk, first.name, first.price, first.category_id),
+                         (self.product.pk, 'Cached kettle', Money(1999), self.category.pk))
+        self.assertIsNot(first, second)  # a new instance on every lookup
+        self.assertEqual(product_cache.stats()['misses'], 1)
+        self.assertEqual(product_cache.stats()['l1_hits'], 2)
+
+        product_cache.l1.clear()
+        with self.assertNumQueries(0):
+            Product.objects.get_cached(name='Cached kettle')
+        self.assertEqual(product_cache.stats()['l2_hits'], 1)
+
+    def test_stock_is_read_from_db(self):
+        self.warm_up(name='Cached kettle')
+        Product.objects.adjust_stock(self.product.pk, -2)
+        product = Product.objects.get_cached(name='Cached kettle')
+        with self.assertNumQueries(1):
+            self.assertEqual(product.stock, 3)
+
+    def test_save_and_delete_invalidate(self):
+        self.warm_up(name='Cached kettle')
+        self.product.name = 'Renamed kettle'
+        self.product.price = 25
+        self.product.save()
+        with self.assertRaises(Product.DoesNotExist):
+            Product.objects.get_cached(name='Cached kettle')
+        self.assertEqual(Product.objects.get_cached(pk=self.product.pk).price, Money(2500))
+
+        self.warm_up(pk=self.product.pk)
+        self.product.delete()
+        with self.assertRaises(Product.DoesNotExist):
+            Product.objects.get_cached(pk=self.product.pk)
+
+    def test_bulk_writes_invalidate(self):
+        self.warm_up(name='Cached kettle')
+        Product.objects.reprice(PriceRule(amount=1))
+        self.assertEqual(Product.objects.get_cached(name='Cached kettle').price, Money(2099))
+
+    def test_cached_category(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.get_category('Cached category')
+        with self.assertNumQueries(0):
+            self.assertEqual(Category.objects.get_category('Cached category'), self.category)
+        self.assertIsNone(Category.objects.get_category('No such category'))
+
+
+
+class SingleFlightTest(TestCase):
+    def setUp(self):
+        self.key = 'test:single-flight'
+        cache.delete(self.key)
+        single_flight.release(self.key)
+        self.calls = 0
+
+    def compute(self, value, seconds=0):
+        def compute():
+            self.calls += 1
+            time.sleep(seconds)
+            return value
+        return compute
+
+    def test_stale_served_while_recomputed(self):
+        self.assertEqual(single_flight.get_or_compute(self.key, self.compute('first'), 60, version=1), 'first')
+        self.assertEqual(single_flight.get_or_compute(self.key, self.compute('second'), 60, version=1), 'first')
+        # another worker is recomputing the new version
+        self.assertTrue(single_flight.acquire(self.key))
+        self.assertEqual(single_flight.get_or_compute(self.key, self.compute('second'), 60, version=2), 'first')
+        single_flight.release(self.key)
+        self.assertEqual(single_flight.get_or_compute(self.key, self.compute('second'), 60, version=2), 'second')
+        self.assertEqual(self.calls, 2)
+
+    def test_cold_miss_computed_once(self):
+        results = []
+
+        def worker():
+            results.append(single_flight.get_or_compute(self.key, self.compute('value', seconds=0.2), 60))
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_gives_up_waiting(self):
+        single_flight.acquire(self.key)
+        self.assertEqual(single_flight.get_or_compute(self.key, self.compute('value'), 60, wait_timeout=0.1), 'value')
+        self.assertEqual(self.calls, 1)
+
+    def test_early_expiration(self):
+        # took 10 seconds to compute, expires in 1 second
+        cache.set(self.key, ('old', None, time.time() + 1, 10.0))
+        with mock.patch('core.single_flight.random.random', return_value=0.5):
+            self.assertEqual(single_flight.get_or_compute(self.key, self.compute('new'), 60, beta=0), 'old')
+            self.assertEqual(single_flight.get_or_compute(self.key, self.compute('new'), 60), 'new')
+
+    def test_lock_kept_in_process_without_atomic_add(self):
+        self.assertTrue(single_flight.acquire(self.key, timeout=60))
+        self.assertIsNone(cache.get(f'{self.key}:lock'))
+        self.assertFalse(single_flight.acquire(self.key))
+        single_flight.release(self.key)
+        self.assertTrue(single_flight.acquire(self.key, timeout=0))
+        # expired
+        self.assertTrue(single_flight.acquire(self.key))
+
+    def test_lock_in_backend_with_atomic_add(self):
+        with mock.patch('core.single_flight.ATOMIC_ADD_BACKENDS', (type(cache),)):
+            self.assertTrue(single_flight.acquire(self.key))
+            self.assertTrue(cache.get(f'{self.key}:lock'))
+            self.assertFalse(single_flight.acquire(self.key))
+            single_flight.release(self.key)
+            self.assertIsNone(cache.get(f'{self.key}:lock'))
+
+    def test_catalog_fragment_stale_after_invalidation(self):
+        self.assertEqual(cached_fragment('test', 'variant', lambda: 'first'), 'first')
+        invalidate_catalog()
+        key = _key('fragment', 'test', 'variant')
+        single_flight.acquire(key, get_catalog_cache())
+        self.assertEqual(cached_fragment('test', 'variant', lambda: 'second'), 'first')
+        single_flight.release(key, get_catalog_cache())
+        self.assertEqual(cached_fragment('test', 'variant', lambda: 'second'), 'second')
+
+
+class InvalidationBusTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Kitchen')
+        self.product = Product.objects.create(name='Kettle', price='19.99', stock=5, category=self.category)
+        product_name_index.clear()
+
+    def other_process(self, model_label, pks=None):
+        invalidation.receive(invalidation.encode(model_label, pks, origin='other-worker'))
+
+    def test_changes_published_on_commit(self):
+        messages = []
+        bus = invalidation.get_bus()
+        bus.listen(messages.append)
+        self.addCleanup(bus._listeners.remove, messages.append)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.stock = 4
+            self.product.save()
+            self.assertEqual(messages, [])
+        event = json.loads(messages[-1])
+        self.assertEqual((event['model'], event['pks'], event['origin']),
+                         ('products.Product', [self.product.pk], invalidation.get_origin()))
+        self.assertIsNone(json.loads(invalidation.encode('products.Product', range(1000)))['pks'])
+
+    def test_forked_worker_has_own_origin(self):
+        origin = invalidation.get_origin()
+        self.assertEqual(invalidation.get_origin(), origin)
+        with mock.patch('core.invalidation.os.getpid', return_value=os.getpid() + 1):
+            self.assertNotEqual(invalidation.get_origin(), origin)
+            # an event of the parent process is received
+            with mock.patch.object(product_name_index, 'clear') as clear:
+                invalidation.receive(invalidation.encode('products.Product', origin=origin))
+            clear.assert_called()
+
+    def test_product_changed_by_other_process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get_cached(pk=self.product.pk)
+        product_name_index.lookup('ket')
+        version = get_catalog_version()
+        # written by another process: no signals here
+        Product.objects.filter(pk=self.product.pk).update(name='Teapot', price=25)
+        self.assertEqual(Product.objects.get_cached(pk=self.product.pk).name, 'Kettle')
+
+        self.other_process('products.Product', [self.product.pk])
+        product = Product.objects.get_cached(pk=self.product.pk)
+        self.assertEqual((product.name, product.price), ('Teapot', Money(2500)))
+        self.assertEqual(product_name_index.lookup('ket'), [])
+        self.assertEqual(product_name_index.lookup('tea'), [(self.product.pk, 'Teapot')])
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_all_products_changed_by_other_process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get_cached(name='Kettle')
+        Product.objects.update(price=1)
+        self.other_process('products.Product')
+        self.assertEqual(Product.objects.get_cached(name='Kettle').price, Money(100))
+
+    def test_category_changed_by_other_process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.get_category('Kitchen')
+        Category.objects.filter(pk=self.category.pk).update(name='Cookware')
+        self.other_process('products.Category', [self.category.pk])
+        self.assertIsNone(Category.objects.get_category('Kitchen'))
+
+
+class MoneyTest(TestCase):
+    def test_coerce(self):
+        self.assertEqual(Money.coerce('12.34').cents, 1234)
+        self.assertEqual(Money.coerce(Decimal('1899.999')).cents, 189999)  # truncated, as prices always were
+        self.assertEqual(Money.coerce(12).cents, 1200)
+        self.assertEqual(Money.coerce(0.1).cents, 10)
+        with self.assertRaises(ValidationError):
+            Money.coerce('invalid_price')
+
+    def test_arithmetic_and_presentation(self):
+        price = Money(1999)
+        self.assertEqual(price * 3, Money(5997))
+        self.assertEqual(sum([price, price]), Money(3998))
+        self.assertEqual(price - Money(1000), Money(999))
+        self.assertEqual(-price, Money(-1999))
+        self.assertEqual(str(price), '19.99')
+        self.assertEqual(str(Money(-5)), '-0.05')
+        self.assertEqual(f'{price:.1f}', '20.0')
+        # compares with amounts in currency units
+        self.assertEqual(price, Decimal('19.99'))
+        self.assertLess(price, 20)
+        self.assertEqual(hash(price), hash(Decimal('19.99')))
+
+    def test_stored_as_cents(self):
+        category = Category.objects.create(name='Kitchen')
+        product = Product.objects.create(name='kettle', price=Decimal('19.99'), category=category)
+        self.assertIsInstance(product.price, Money)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT price FROM products_product WHERE id = %s", [product.pk])
+            self.assertEqual(cursor.fetchone()[0], 1999)
+        self.assertEqual(Product.objects.get(pk=product.pk).price, Money(1999))
+        self.assertTrue(Product.objects.filter(price__lt=20, price__gte='19.99').exists())
+        self.assertEqual(Product.objects.aggregate(total=Sum('price'))['total'], Money(1999))
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create_category('Kitchen', 'Kitchen things')
+        self.category2 = Category.objects.create_category('Garden', 'Garden things')
+        self.kettle = Product.objects.create_product('Electric kettle', 'Boils water fast', 30, self.category, 5)
+        self.mug = Product.objects.create_product('Mug', 'Good for tea from the electric kettle', 5,
+                                                  self.category, 5)
+        self.hose = Product.objects.create_product('Garden hose', 'Waters plants', 20, self.category2, 5)
+
+    def search(self, query):
+        return list(Product.objects.search(query)[:10])
+
+    def test_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search('kettle'), [self.kettle, self.mug])
+
+    def test_search_category_name(self):
+        self.assertEqual(self.search('garden'), [self.hose])
+        self.assertEqual(Product.objects.search('kitchen').count(), 2)
+
+    def test_search_all_words_must_match(self):
+        self.assertEqual(self.search('electric mug'), [self.mug])
+        self.assertEqual(self.search('kettle hose'), [])
+
+    def test_search_ignores_query_syntax(self):
+        self.assertEqual(self.search('kettle" OR "hose'), [])
+        self.assertEqual(self.search('***'), [])
+
+    def test_search_index_follows_updates(self):
+        Product.objects.update_product(self.mug, name='Teacup')
+        self.assertEqual(self.search('teacup'), [self.mug])
+        self.assertEqual(self.search('mug'), [])
+
+        Product.objects.delete_product('Teacup')
+        self.assertEqual(self.search('teacup'), [])
+
+        self.category2.name = 'Yard'
+        self.category2.save()
+        self.assertEqual(self.search('yard'), [self.hose])
+
+    def test_search_pagination(self):
+        for i in range(5):
+            Product.objects.create_product(f'Kettle {i}', 'Another kettle', 30, self.category, 5)
+        results = Product.objects.search('kettle')
+        self.assertEqual(results.count(), 7)
+        self.assertEqual(len(results[0:3]) + len(results[3:6]) + len(results[6:9]), 7)
+
+    def test_rebuild_search_index(self):
+        Product.objects.filter(pk=self.hose.pk).update(name='Sprinkler')
+        self.assertEqual(self.search('sprinkler'), [])
+        Product.objects.update_search_index()
+        self.assertEqual(self.search('sprinkler'), [self.hose])
+
+
+class ProductNameIndexTest(TestCase):
+    def setUp(self):
+        product_name_index.clear()
+        self.category = Category.objects.create_category('Kitchen', 'Kitchen things')
+        self.kettle = Product.objects.create_product('Kettle', 'Boils water', 30, self.category, 5)
+        self.ketchup = Product.objects.create_product('ketchup', 'Tomato', 3, self.category, 5)
+        self.mug = Product.objects.create_product('Mug', 'Holds tea', 5, self.category, 5)
+
+    def tearDown(self):
+        # index is per process, don't leak products of this test into other tests
+        product_name_index.clear()
+
+    def test_lookup(self):
+        self.assertEqual(product_name_index.lookup('ket'), [(self.ketchup.id, 'ketchup'), (self.kettle.id, 'Kettle')])
+        self.assertEqual(product_name_index.lookup('KETT'), [(self.kettle.id, 'Kettle')])
+        self.assertEqual(product_name_index.lookup('ket', limit=1), [(self.ketchup.id, 'ketchup')])
+        self.assertEqual(product_name_index.lookup('tea'), [])
+        self.assertEqual(product_name_index.lookup(''), [])
+
+    def test_lookup_without_queries(self):
+        product_name_index.lookup('k')  # build index
+        with self.assertNumQueries(0):
+            product_name_index.lookup('mu')
+
+    def test_index_follows_changes(self):
+        product_name_index.lookup('k')  # build index
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.update_product(self.mug, name='Kettle mug')
+            Product.objects.create_product('Kettlebell', 'Heavy', 50, self.category, 5)
+            Product.objects.delete_product('ketchup')
+        self.assertEqual([name for _, name in product_name_index.lookup('ket')],
+                         ['Kettle', 'Kettle mug', 'Kettlebell'])
+        self.assertEqual(product_name_index.lookup('mug'), [])
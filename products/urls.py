@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from .views import ProductUpdateView, ProductCreateView, ProductListView, ProductDetailView, ProductDeleteView, \
+    ProductSearchView, ProductAutocompleteView, StockAdjustmentView, StockAdjustmentApiView, \
     CategoryUpdateView, CategoryCreateView, CategoryListView, CategoryDetailView, CategoryDeleteView
 
 
@@ -8,6 +9,10 @@ urlpatterns = [
     path('product/update/<int:pk>/', ProductUpdateView.as_view(), name='update_product'),
     path('product/create/', ProductCreateView.as_view(), name='create_product'),
     path('product/list', ProductListView.as_view(), name='product_list'),
+    path('product/search', ProductSearchView.as_view(), name='product_search'),
+    path('product/autocomplete', ProductAutocompleteView.as_view(), name='product_autocomplete'),
+    path('product/stock/adjust', StockAdjustmentView.as_view(), name='adjust_stock'),
+    path('product/stock/adjust.json', StockAdjustmentApiView.as_view(), name='adjust_stock_api'),
     path('product/<int:pk>/', ProductDetailView.as_view(), name='product_detail'),
     path('product/<int:pk>/delete', ProductDeleteView.as_view(), name='delete_product'),
 
@@ -1,16 +1,136 @@
-from django.contrib.auth.mixins import UserPassesTestMixin
+import json
+
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.views.generic.edit import UpdateView, CreateView, DeleteView
-from django.views.generic import ListView, DetailView
+from django.views.generic import ListView, DetailView, View, FormView
+from django.http import JsonResponse
 from .models import Product, Category
-from core.mixins import GroupRequiredMixin
+from .forms import StockAdjustmentForm
+from .stock import parse_adjustments, StockAdjustmentError
+from .autocomplete import product_name_index
+from .facets import CatalogFilters, FACETS
+from .cache import CatalogPageCacheMixin, cached_fragment
+from .snapshot import get_snapshot
+from core.mixins import GroupRequiredMixin, KeysetPaginationMixin
+from users.groups import is_in_any_group
 
 
-class ProductListView(ListView):
+class ProductListView(CatalogPageCacheMixin, KeysetPaginationMixin, ListView):
     model = Product
     template_name = 'product_list.html'
     context_object_name = 'products'
+    page_size = 48
+    # sort parameter -> keyset ordering
+    sort_orderings = {
+        'name': ('name', 'id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
+    sort_labels = {'name': 'Name', 'price': 'Price: low to high', '-price': 'Price: high to low'}
+    default_sort = 'name'
+    page_cache_params = FACETS + ('sort', KeysetPaginationMixin.cursor_param)
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort')
+        return sort if sort in self.sort_orderings else self.default_sort
+
+    def get_keyset_ordering(self):
+        return self.sort_orderings[self.get_sort()]
+
+    def get_queryset(self):
+        self.filters = CatalogFilters.from_query(self.request.GET)
+        # only the columns the template shows (skips the unbounded description)
+        return Product.objects.filter_catalog(self.filters).only('id', 'name', 'price')
+
+    def list_url(self, **changes):
+        """
+        :param changes: query parameters to set, or to clear (when value is None)
+        :return: url of the first page of the list, keeping the other parameters
+        """
+        query = self.request.GET.copy()
+        query.pop(self.cursor_param, None)
+        for name, value in changes.items():
+            query.pop(name, None)
+            if value is not None:
+                query[name] = value
+        return f'?{query.urlencode()}'
+
+    def get_facets(self):
+        counts = Product.objects.facet_counts(self.filters)
+        return {
+            'total': counts['total'],
+            'categories': [
+                {'label': category.name, 'count': count, 'url': self.list_url(category=category.id),
+                 'selected': category.id == self.filters.category_id}
+                for category, count in counts['categories']],
+            'price_bands': [
+                {'label': label, 'count': count, 'url': self.list_url(price=key),
+                 'selected': key == self.filters.price_band}
+                for key, label, count in counts['price_bands']],
+            'in_stock': {'count': counts['in_stock'], 'url': self.list_url(in_stock='True'),
+                         'selected': self.filters.in_stock},
+            'clear_url': self.list_url(**{facet: None for facet in FACETS}) if self.filters else None,
+        }
+
+    def render_product_grid(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['facets'] = self.get_facets()
+        return render_to_string('product_grid.html', context, self.request)
+
+    def get_context_data(self, **kwargs):
+        # facets, products and pagination are rendered as a cached fragment: on a hit, no queries at all
+        return {
+            'view': self,
+            'sort': self.get_sort(),
+            'sort_links': [(label, self.list_url(sort=sort)) for sort, label in self.sort_labels.items()],
+            'product_grid': cached_fragment('product_grid', self.request.get_full_path(),
+                                            lambda: self.render_product_grid(**kwargs)),
+        }
+
+
+class ProductSearchView(ListView):
+    """
+    full-text product search, ranked by relevance
+    """
+    template_name = 'product_search.html'
+    context_object_name = 'products'
+    paginate_by = 20
+
+    def get_query(self):
+        return self.request.GET.get('q', '').strip()
+
+    def get_queryset(self):
+        query = self.get_query()
+        if not query:
+            return []
+        return Product.objects.search(query)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.get_query()
+        return context
+
+
+class ProductAutocompleteView(View):
+    """
+    JSON endpoint: products whose names start with a prefix, from the catalog snapshot if there's one
+    (shared by all workers, see products/snapshot.py), else from the in-memory name index
+    GET parameters: q (prefix), limit (max number of results, default 10)
+    """
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.GET.get('limit', 10)), self.max_limit)
+        except ValueError:
+            limit = 10
+        index = get_snapshot()
+        if index is None:
+            index = product_name_index
+        results = index.lookup(request.GET.get('q', ''), limit=limit)
+        return JsonResponse({'results': [{'id': product_id, 'name': name} for product_id, name in results]})
 
 
 class ProductUpdateView(GroupRequiredMixin, UpdateView):
@@ -22,7 +142,7 @@ class ProductUpdateView(GroupRequiredMixin, UpdateView):
 
     def test_func(self):
         user = self.request.user
-        return user.groups.filter(name__in=self.allowed_groups).exists() or user.is_superuser
+        return is_in_any_group(user, self.allowed_groups) or user.is_superuser
 
     def form_valid(self, form):
         # called when form was validated successfully according to model
@@ -35,6 +155,61 @@ class ProductUpdateView(GroupRequiredMixin, UpdateView):
         return super().form_invalid(form)
 
 
+class StockAdjustmentView(GroupRequiredMixin, FormView):
+    """
+    adjust stock of many products at once, from a manifest (e.g. an inbound shipment) pasted as CSV
+    """
+    form_class = StockAdjustmentForm
+    template_name = 'adjust_stock.html'
+    allowed_groups = ['staff', 'stock_personnel', 'shift_manager']
+
+    def test_func(self):
+        user = self.request.user
+        return is_in_any_group(user, self.allowed_groups) or user.is_superuser
+
+    def form_valid(self, form):
+        dry_run = form.cleaned_data['dry_run']
+        try:
+            changes = Product.objects.apply_stock_adjustments(form.cleaned_data['manifest'], dry_run=dry_run)
+        except StockAdjustmentError as e:
+            form.add_error('manifest', e.messages)
+            return self.form_invalid(form)
+        return self.render_to_response(self.get_context_data(form=form, success=True, changes=changes,
+                                                             dry_run=dry_run))
+
+
+class StockAdjustmentApiView(GroupRequiredMixin, View):
+    """
+    JSON endpoint: adjust stock of many products at once
+    POST body: {"adjustments": [{"id": 12, "delta": 5}, {"name": "Kettle", "stock": 40}, ...], "dry_run": false}
+    responds with the adjusted products (200), or with the conflicts, nothing adjusted (409)
+    """
+    allowed_groups = ['staff', 'stock_personnel', 'shift_manager']
+
+    def test_func(self):
+        user = self.request.user
+        return is_in_any_group(user, self.allowed_groups) or user.is_superuser
+
+    def post(self, request, *args, **kwargs):
+        try:
+            body = json.loads(request.body)
+            rows, dry_run = body['adjustments'], body.get('dry_run', False) is True
+            if not isinstance(rows, list):
+                raise TypeError("adjustments must be a list")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return JsonResponse({'error': f"Invalid request body: {str(e)}"}, status=400)
+
+        try:
+            changes = Product.objects.apply_stock_adjustments(parse_adjustments(rows), dry_run=dry_run)
+        except StockAdjustmentError as e:
+            return JsonResponse({'conflicts': e.conflicts}, status=409)
+        return JsonResponse({
+            'dry_run': dry_run,
+            'adjusted': [{'id': product_id, 'before': before, 'after': after}
+                         for product_id, (before, after) in changes.items()],
+        })
+
+
 class ProductCreateView(GroupRequiredMixin, CreateView):
     model = Product
     fields = ['name', 'description', 'price', 'stock', 'category']
@@ -53,7 +228,7 @@ class ProductCreateView(GroupRequiredMixin, CreateView):
 
     def test_func(self):
         user = self.request.user
-        return user.groups.filter(name__in=self.allowed_groups).exists() or user.is_superuser
+        return is_in_any_group(user, self.allowed_groups) or user.is_superuser
 
 
 class BaseProductView(GroupRequiredMixin):
@@ -81,7 +256,7 @@ class ProductDetailView(BaseProductView, DetailView):
         return super().get(request, *args, **kwargs)
 
 
-class CategoryListView(ListView):
+class CategoryListView(CatalogPageCacheMixin, ListView):
     model = Category
     template_name = 'category_list.html'
     context_object_name = 'categories'
@@ -96,7 +271,7 @@ class CategoryUpdateView(GroupRequiredMixin, UpdateView):
 
     def test_func(self):
         user = self.request.user
-        return user.groups.filter(name__in=self.allowed_groups).exists() or user.is_superuser
+        return is_in_any_group(user, self.allowed_groups) or user.is_superuser
 
     def form_valid(self, form):
         # called when form was validated successfully according to model
@@ -126,7 +301,7 @@ class CategoryCreateView(GroupRequiredMixin, CreateView):
 
     def test_func(self):
         user = self.request.user
-        return user.groups.filter(name__in=self.allowed_groups).exists() or user.is_superuser
+        return is_in_any_group(user, self.allowed_groups) or user.is_superuser
 
 
 class BaseCategoryView(GroupRequiredMixin):
@@ -136,7 +311,7 @@ class BaseCategoryView(GroupRequiredMixin):
 
     def test_func(self):
         user = self.request.user
-        return user.groups.filter(name__in=self.allowed_groups).exists() or user.is_superuser
+        return is_in_any_group(user, self.allowed_groups) or user.is_superuser
 
 
 class CategoryDeleteView(BaseCategoryView, DeleteView):
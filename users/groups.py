@@ -0,0 +1,104 @@
+"""
+group membership resolver
+
+a user's group names are resolved once, and then reused:
+    per request: kept on the user object (request.user is loaded once per request)
+    across requests: kept in the cache backend, for GROUPS_CACHE_TIMEOUT seconds
+so authorization checks (GroupRequiredMixin, OwnershipRequiredMixin, is_shift_manager) cost no queries
+on a warm cache.
+
+cached entries are invalidated by signals on User.groups, Group and User (see users/signals.py),
+and by the assign_permissions command. all cache keys include a version, so all entries can be
+invalidated at once by bumping it.
+invalidations are published to the other processes as well (see core/invalidation.py), so they're immediate
+with the default (per-process) local memory cache too.
+"""
+import time
+
+from django.core.cache import cache
+
+from core import invalidation
+
+import logging
+
+logger = logging.getLogger('django')
+
+GROUPS_CACHE_TIMEOUT = 300
+VERSION_CACHE_KEY = 'user_groups:version'
+# events of users' group memberships (see core/invalidation.py)
+USER_MODEL_LABEL = 'users.User'
+
+
+def _get_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        # a fresh, never used version: entries from before the version was lost can't come back
+        version = time.time_ns()
+        cache.add(VERSION_CACHE_KEY, version, timeout=None)
+        version = cache.get(VERSION_CACHE_KEY, version)
+    return version
+
+
+def _cache_key(user_id):
+    return f'user_groups:{_get_version()}:{user_id}'
+
+
+def get_user_groups(user) -> frozenset:
+    """
+    :param user: User object (or AnonymousUser)
+    :return: frozenset of names of user's groups
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    group_names = getattr(user, '_group_names', None)
+    if group_names is not None:
+        return group_names
+
+    key = _cache_key(user.pk)
+    group_names = cache.get(key)
+    if group_names is None:
+        group_names = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(key, group_names, timeout=GROUPS_CACHE_TIMEOUT)
+        logger.debug(f"resolved groups of user #{user.pk}: {sorted(group_names)}")
+
+    user._group_names = group_names
+    return group_names
+
+
+def is_in_any_group(user, group_names) -> bool:
+    return not get_user_groups(user).isdisjoint(group_names)
+
+
+def invalidate_user_groups(user_ids, user=None, publish=True):
+    """
+    :param user_ids: ids of users whose groups changed
+    :param user: User object whose groups changed (its per-request copy is dropped as well), optional
+    :param publish: publish to the other processes. False when the change came from one of them
+    """
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+    if user is not None:
+        user.__dict__.pop('_group_names', None)
+    if publish:
+        invalidation.publish(USER_MODEL_LABEL, user_ids)
+
+
+def invalidate_all_groups(publish=True):
+    """
+    drop the cached groups of all users (group renamed or deleted, permissions reassigned)
+    :param publish: publish to the other processes. False when the change came from one of them
+    """
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        # no version yet: nothing is cached under it
+        pass
+    if publish:
+        invalidation.publish(USER_MODEL_LABEL)
+
+
+def groups_changed_elsewhere(pks):
+    if pks is None:
+        invalidate_all_groups(publish=False)
+    else:
+        invalidate_user_groups(pks, publish=False)
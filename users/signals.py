@@ -0,0 +1,45 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from core import invalidation
+from users.groups import invalidate_user_groups, invalidate_all_groups, groups_changed_elsewhere, \
+    USER_MODEL_LABEL
+from users.models import User
+
+import logging
+
+logger = logging.getLogger('django')
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # user.groups.add(...) / remove / clear
+        invalidate_user_groups([instance.pk], user=instance)
+    elif pk_set:
+        # group.user_set.add(...) / remove
+        invalidate_user_groups(pk_set)
+    else:
+        # group.user_set.clear(): members are unknown at this point
+        invalidate_all_groups()
+    logger.debug(f"invalidated cached groups after {action}")
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # a new user may reuse the id of a deleted one
+    invalidate_user_groups([instance.pk])
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # renamed or deleted group: any user may be affected
+    invalidate_all_groups()
+
+
+invalidation.subscribe(USER_MODEL_LABEL, groups_changed_elsewhere)
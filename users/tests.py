@@ -1,6 +1,12 @@
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+
+from ecommerce.management.commands.assign_permissions import Command as AssignPermissionsCommand
+from core import invalidation
+from users.groups import get_user_groups, is_in_any_group
 User = get_user_model()
 
 
@@ -160,3 +166,72 @@ class UserLoginTestCase(TestCase):
         self.assertIn('__all__', form.errors)  # Login form errors are usually stored under `__all__`
 
 
+
+
+class UserGroupsResolverTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customers = Group.objects.create(name='customers')
+        self.staff = Group.objects.create(name='staff')
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user.groups.add(self.customers)
+
+    def fresh_user(self):
+        # a new User object, as loaded for another request
+        return User.objects.get(pk=self.user.pk)
+
+    def test_resolved_once_per_request(self):
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_groups(user), {'customers'})
+            self.assertTrue(is_in_any_group(user, ['customers', 'staff']))
+            self.assertFalse(is_in_any_group(user, ['staff']))
+
+    def test_cached_across_requests(self):
+        get_user_groups(self.fresh_user())
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_groups(user), {'customers'})
+
+    def test_anonymous_user(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_groups(AnonymousUser()), frozenset())
+
+    def test_invalidated_on_groups_change(self):
+        get_user_groups(self.user)
+        self.user.groups.add(self.staff)
+        self.assertEqual(get_user_groups(self.user), {'customers', 'staff'})
+        self.assertEqual(get_user_groups(self.fresh_user()), {'customers', 'staff'})
+
+        self.user.groups.remove(self.customers)
+        self.assertEqual(get_user_groups(self.fresh_user()), {'staff'})
+
+    def test_invalidated_on_reverse_groups_change(self):
+        get_user_groups(self.fresh_user())
+        self.staff.user_set.add(self.user)
+        self.assertEqual(get_user_groups(self.fresh_user()), {'customers', 'staff'})
+        self.customers.user_set.clear()
+        self.assertEqual(get_user_groups(self.fresh_user()), {'staff'})
+
+    def test_invalidated_on_group_rename(self):
+        get_user_groups(self.fresh_user())
+        self.customers.name = 'clients'
+        self.customers.save()
+        self.assertEqual(get_user_groups(self.fresh_user()), {'clients'})
+
+    def test_invalidated_by_assign_permissions(self):
+        get_user_groups(self.fresh_user())
+        # membership change that skips signals
+        User.groups.through.objects.create(user=self.user, group=self.staff)
+        self.assertEqual(get_user_groups(self.fresh_user()), {'customers'})
+        AssignPermissionsCommand().handle()
+        self.assertEqual(get_user_groups(self.fresh_user()), {'customers', 'staff'})
+
+    def test_invalidated_by_other_process(self):
+        get_user_groups(self.fresh_user())
+        User.groups.through.objects.create(user=self.user, group=self.staff)
+        # own events were already applied
+        invalidation.receive(invalidation.encode('users.User', [self.user.pk]))
+        self.assertEqual(get_user_groups(self.fresh_user()), {'customers'})
+        invalidation.receive(invalidation.encode('users.User', [self.user.pk], origin='other-worker'))
+        self.assertEqual(get_user_groups(self.fresh_user()), {'customers', 'staff'})